@@ -59,7 +59,29 @@ if __name__ == "__main__":
 
     args = check_args(make_parser().parse_args())
 
-    init_logger(logging.DEBUG if args.debug else logging.INFO)
+    init_logger(
+        logging.DEBUG if args.debug else logging.INFO,
+        max_bytes=args.log_max_mb * 1024**2,
+        backup_count=args.log_backups,
+        events_file=args.events_file if args.log_format == "json" else None,
+    )
+
+    if args.command == "whitelist":
+        import asyncio
+
+        from src.storage import transfer_whitelist
+
+        asyncio.run(
+            transfer_whitelist(
+                args.whitelist_storage,
+                args.whitelist_file,
+                args.whitelist_db,
+                args.whitelist_action,
+                args.whitelist_transfer_file,
+                args.whitelist_guild,
+            )
+        )
+        sys.exit(0)
 
     assert load_dotenv(), "Failed to load .env file"
     BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -1,6 +1,7 @@
+import logging
 import os
 from argparse import ArgumentParser, Namespace
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any
 
 import yaml
@@ -40,12 +41,51 @@ class CliArgs:
     cpu_offload: bool = False
     debug: bool = False
     no_warmup: bool = False
+    log_max_mb: int = 10
+    log_backups: int = 5
+    log_format: str = "text"  # "json" writes the interactions to `events_file` as JSON lines
+    events_file: str = "events.jsonl"
 
     model: str = None
     lora_weights: str = None
     refiner: str = None
+    pipelined: bool = True
     fp: int = 16
 
+    compile_cache_dir: str = os.path.join(".cache", "inductor")
+    warmup_plan: list[dict[str, int]] = field(default_factory=list)  # empty for every batch size
+
+    models: dict[str, dict[str, str]] = field(default_factory=dict)
+    max_resident_models: int = 1
+    model_memory_budget_mb: int = 0
+    evict_models_to: str = "disk"
+
+    max_batch_size: int = 4
+    max_batch_wait_ms: int = 50
+    max_queue_depth: int = 32
+    inference_workers: int = 0
+    embedding_cache_mb: int = 256
+    result_cache_dir: str = os.path.join(".cache", "results")
+    result_cache_mb: int = 256
+    result_cache_disk_mb: int = 2048
+    image_format: str = "png"
+    image_quality: int = 90
+    png_compress_level: int = 6
+    thumbnail_size: int = 256
+    preview_size: int = 192  # 0 disables the in-progress previews
+
+    whitelist_storage: str = "json"
+    whitelist_file: str = "whitelist.json"
+    whitelist_db: str = "whitelist.db"
+    message_edit_interval_ms: int = 1000
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0  # 0 disables the metrics endpoint
+
+    command: str = None  # maintenance command to run instead of the bot
+    whitelist_action: str = None
+    whitelist_transfer_file: str = None
+    whitelist_guild: int = None
+
     def load_yml(self):
         # get default values from config file
         with open(self.config, "r", encoding="utf-8") as file:
@@ -53,10 +93,42 @@ class CliArgs:
             self.cpu_offload = data.get("cpu_offload", self.cpu_offload)
             self.debug = data.get("debug", self.debug)
             self.no_warmup = data.get("no_warmup", self.no_warmup)
+            self.log_max_mb = data.get("log_max_mb", self.log_max_mb)
+            self.log_backups = data.get("log_backups", self.log_backups)
+            self.log_format = data.get("log_format", self.log_format)
+            self.events_file = data.get("events_file", self.events_file)
             self.model = data.get("model", self.model)
             self.lora_weights = data.get("lora_weights", self.lora_weights)
             self.refiner = data.get("refiner", self.refiner)
+            self.pipelined = data.get("pipelined", self.pipelined)
             self.fp = data.get("fp", self.fp)
+            self.compile_cache_dir = data.get("compile_cache_dir", self.compile_cache_dir)
+            self.warmup_plan = data.get("warmup_plan") or self.warmup_plan
+            self.models = data.get("models") or self.models
+            self.max_resident_models = data.get("max_resident_models", self.max_resident_models)
+            self.model_memory_budget_mb = data.get("model_memory_budget_mb", self.model_memory_budget_mb)
+            self.evict_models_to = data.get("evict_models_to", self.evict_models_to)
+            self.max_batch_size = data.get("max_batch_size", self.max_batch_size)
+            self.max_batch_wait_ms = data.get("max_batch_wait_ms", self.max_batch_wait_ms)
+            self.max_queue_depth = data.get("max_queue_depth", self.max_queue_depth)
+            self.inference_workers = data.get("inference_workers", self.inference_workers)
+            self.embedding_cache_mb = data.get("embedding_cache_mb", self.embedding_cache_mb)
+            self.result_cache_dir = data.get("result_cache_dir", self.result_cache_dir)
+            self.result_cache_mb = data.get("result_cache_mb", self.result_cache_mb)
+            self.result_cache_disk_mb = data.get("result_cache_disk_mb", self.result_cache_disk_mb)
+            self.image_format = data.get("image_format", self.image_format)
+            self.image_quality = data.get("image_quality", self.image_quality)
+            self.png_compress_level = data.get("png_compress_level", self.png_compress_level)
+            self.thumbnail_size = data.get("thumbnail_size", self.thumbnail_size)
+            self.preview_size = data.get("preview_size", self.preview_size)
+            self.whitelist_storage = data.get("whitelist_storage", self.whitelist_storage)
+            self.whitelist_file = data.get("whitelist_file", self.whitelist_file)
+            self.whitelist_db = data.get("whitelist_db", self.whitelist_db)
+            self.message_edit_interval_ms = data.get(
+                "message_edit_interval_ms", self.message_edit_interval_ms
+            )
+            self.metrics_host = data.get("metrics_host", self.metrics_host)
+            self.metrics_port = data.get("metrics_port", self.metrics_port)
 
 
 def make_parser() -> WeakParser:
@@ -66,7 +138,7 @@ def make_parser() -> WeakParser:
         epilog="For more information, visit <https://github.com/ThomasByr/pixelia>.",
     )
 
-    return (
+    parser = (
         parser.with_path_argument(
             "-c",
             "--config",
@@ -91,6 +163,13 @@ def make_parser() -> WeakParser:
             dest="no_warmup",
             help="Do not warm up the diffusion model (useful for fast debugging).",
         )
+        .with_str_argument(
+            "--log-format",
+            dest="log_format",
+            choices=["text", "json"],
+            help="How interactions are logged, 'json' appends them to the events file as JSON lines "
+            f"(default: {defaults.log_format}).",
+        )
         .with_str_argument(
             "-m",
             "--model",
@@ -109,13 +188,116 @@ def make_parser() -> WeakParser:
             dest="refiner",
             help="Hugging Face refiner model name.",
         )
+        .with_store_true_argument(
+            "--no-pipeline",
+            dest="no_pipeline",
+            help="Run the base model and the refiner one after the other instead of on separate workers.",
+        )
         .with_int_argument(
             "--fp",
             dest="fp",
             help="Number of fixed point bits for the model (default: 16).",
         )
+        .with_int_argument(
+            "--max-resident-models",
+            dest="max_resident_models",
+            help="Maximum number of models kept loaded at once "
+            f"(default: {defaults.max_resident_models}).",
+        )
+        .with_str_argument(
+            "--evict-models-to",
+            dest="evict_models_to",
+            choices=["cpu", "disk"],
+            help=f"Where to evict the least recently used models (default: {defaults.evict_models_to}).",
+        )
+        .with_int_argument(
+            "--max-batch-size",
+            dest="max_batch_size",
+            help=f"Maximum number of prompts generated in one batch (default: {defaults.max_batch_size}).",
+        )
+        .with_int_argument(
+            "--max-batch-wait",
+            dest="max_batch_wait_ms",
+            help="Time (in ms) to wait for more prompts before running a batch "
+            f"(default: {defaults.max_batch_wait_ms}).",
+        )
+        .with_int_argument(
+            "--max-queue-depth",
+            dest="max_queue_depth",
+            help="Maximum number of jobs waiting for the model before new ones are rejected "
+            f"(default: {defaults.max_queue_depth}).",
+        )
+        .with_int_argument(
+            "--inference-workers",
+            dest="inference_workers",
+            help="Number of separate processes running the models, 0 to run them in the bot process "
+            f"(default: {defaults.inference_workers}).",
+        )
+        .with_int_argument(
+            "--embedding-cache",
+            dest="embedding_cache_mb",
+            help="Memory (in MB) kept for cached prompt embeddings, 0 to disable "
+            f"(default: {defaults.embedding_cache_mb}).",
+        )
+        .with_path_argument(
+            "--compile-cache-dir",
+            dest="compile_cache_dir",
+            help="Directory where compiled models are cached across restarts "
+            f"(default: {defaults.compile_cache_dir}).",
+        )
+        .with_path_argument(
+            "--result-cache-dir",
+            dest="result_cache_dir",
+            help=f"Directory where generated images are cached (default: {defaults.result_cache_dir}).",
+        )
+        .with_int_argument(
+            "--result-cache",
+            dest="result_cache_mb",
+            help=f"Memory (in MB) kept for cached images, 0 to disable (default: {defaults.result_cache_mb}).",
+        )
+        .with_int_argument(
+            "--result-cache-disk",
+            dest="result_cache_disk_mb",
+            help="Disk space (in MB) kept for cached images, 0 to disable "
+            f"(default: {defaults.result_cache_disk_mb}).",
+        )
+        .with_str_argument(
+            "--image-format",
+            dest="image_format",
+            choices=["png", "webp", "jpeg"],
+            help=f"Format of the images sent to users (default: {defaults.image_format}).",
+        )
+        .with_int_argument(
+            "--image-quality",
+            dest="image_quality",
+            help=f"Quality of WebP and JPEG images, from 1 to 100 (default: {defaults.image_quality}).",
+        )
+        .with_str_argument(
+            "--whitelist-storage",
+            dest="whitelist_storage",
+            choices=["json", "sqlite"],
+            help="Where to store the whitelist, a sqlite database is imported from the JSON file once "
+            f"(default: {defaults.whitelist_storage}).",
+        )
+        .with_int_argument(
+            "--metrics-port",
+            dest="metrics_port",
+            help=f"Port serving the metrics on /metrics, 0 to disable (default: {defaults.metrics_port}).",
+        )
     )
 
+    # maintenance commands, the bot does not start when one is given
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    whitelist = commands.add_parser("whitelist", help="Import or export the whitelist and exit.")
+    whitelist.add_argument("action", choices=["import", "export"], help="What to do with the file.")
+    whitelist.add_argument("file", help="CSV (user_id,perms) or JSONL file to import from or export to.")
+    whitelist.with_int_argument(
+        "--guild",
+        dest="guild",
+        help="Guild to import into or to export (default: global entries on import, every guild on export).",
+    )
+    return parser
+
 
 def check_path(path: str, mode: str = "r") -> str:
     """Check if the path exists and returns it if it does."""
@@ -161,6 +343,16 @@ def check_args(args: Namespace) -> CliArgs:
     if args.no_warmup:
         cli_args.no_warmup = True
 
+    # check log rotation
+    if cli_args.log_max_mb < 0 or cli_args.log_backups < 0:
+        raise ValueError("log file size and number of backups must be positive")
+
+    # check log format
+    if args.log_format:
+        cli_args.log_format = args.log_format
+    if cli_args.log_format not in {"text", "json"}:
+        raise ValueError("log format must be 'text' or 'json'")
+
     # check model
     if args.model:
         cli_args.model = args.model
@@ -173,12 +365,129 @@ def check_args(args: Namespace) -> CliArgs:
     if args.refiner:
         cli_args.refiner = args.refiner
 
+    # check pipeline
+    if args.no_pipeline:
+        cli_args.pipelined = False
+
     # check fixed point
     if args.fp:
         if args.fp not in {16, 32}:
             raise ValueError("fixed point bits must be 16 or 32")
         cli_args.fp = args.fp
 
+    # check model pool
+    if args.max_resident_models:
+        cli_args.max_resident_models = args.max_resident_models
+    if args.evict_models_to:
+        cli_args.evict_models_to = args.evict_models_to
+    if cli_args.max_resident_models < 1:
+        raise ValueError("at least one model needs to be resident")
+    if cli_args.model_memory_budget_mb < 0:
+        raise ValueError("model memory budget must be positive")
+    if cli_args.evict_models_to not in {"cpu", "disk"}:
+        raise ValueError("models can only be evicted to 'cpu' or 'disk'")
+    for name, spec in cli_args.models.items():
+        if not isinstance(spec, dict) or not spec.get("model"):
+            raise ValueError(f"model {name} needs a Hugging Face model name")
+
+    # check batching
+    if args.max_batch_size:
+        cli_args.max_batch_size = args.max_batch_size
+    if args.max_batch_wait_ms is not None:
+        cli_args.max_batch_wait_ms = args.max_batch_wait_ms
+    if cli_args.max_batch_size < 1:
+        raise ValueError("max batch size must be at least 1")
+    if cli_args.max_batch_wait_ms < 0:
+        raise ValueError("max batch wait must be positive")
+
+    # check queue depth
+    if args.max_queue_depth:
+        cli_args.max_queue_depth = args.max_queue_depth
+    if cli_args.max_queue_depth < 1:
+        raise ValueError("max queue depth must be at least 1")
+
+    # check inference workers
+    if args.inference_workers is not None:
+        cli_args.inference_workers = args.inference_workers
+    if cli_args.inference_workers < 0:
+        raise ValueError("number of inference workers must be positive")
+
+    # check compilation cache and warmup plan
+    if args.compile_cache_dir:
+        cli_args.compile_cache_dir = args.compile_cache_dir
+    for shape in cli_args.warmup_plan:
+        if not isinstance(shape, dict):
+            raise ValueError("warmup plan entries need a batch size, steps and optionally a width and height")
+        if shape.get("batch_size", 1) < 1:
+            raise ValueError("warmup batch sizes must be positive")
+        if shape.get("steps", 4) < 2:
+            raise ValueError("warmup shapes need at least 2 steps")
+        if any(shape.get(side) is not None and shape[side] % 8 != 0 for side in ("width", "height")):
+            raise ValueError("warmup widths and heights must be multiples of 8")
+    # the batches never get that big, there is nothing to warm up for them
+    too_big = [
+        shape for shape in cli_args.warmup_plan if shape.get("batch_size", 1) > cli_args.max_batch_size
+    ]
+    if too_big:
+        logging.getLogger("cli").warning(
+            "Skipping %d warmup shape(s) above the max batch size (%d)", len(too_big), cli_args.max_batch_size
+        )
+        cli_args.warmup_plan = [shape for shape in cli_args.warmup_plan if shape not in too_big]
+
+    # check embedding cache
+    if args.embedding_cache_mb is not None:
+        cli_args.embedding_cache_mb = args.embedding_cache_mb
+    if cli_args.embedding_cache_mb < 0:
+        raise ValueError("embedding cache size must be positive")
+
+    # check result cache
+    if args.result_cache_dir:
+        cli_args.result_cache_dir = args.result_cache_dir
+    if args.result_cache_mb is not None:
+        cli_args.result_cache_mb = args.result_cache_mb
+    if args.result_cache_disk_mb is not None:
+        cli_args.result_cache_disk_mb = args.result_cache_disk_mb
+    if cli_args.result_cache_mb < 0 or cli_args.result_cache_disk_mb < 0:
+        raise ValueError("result cache sizes must be positive")
+
+    # check image encoding
+    if args.image_format:
+        cli_args.image_format = args.image_format
+    if args.image_quality is not None:
+        cli_args.image_quality = args.image_quality
+    if cli_args.image_format not in {"png", "webp", "jpeg"}:
+        raise ValueError("image format must be one of 'png', 'webp' or 'jpeg'")
+    if not 1 <= cli_args.image_quality <= 100:
+        raise ValueError("image quality must be between 1 and 100")
+    if not 0 <= cli_args.png_compress_level <= 9:
+        raise ValueError("png compression level must be between 0 and 9")
+    if cli_args.thumbnail_size < 16:
+        raise ValueError("thumbnail size must be at least 16 pixels")
+    if cli_args.preview_size != 0 and cli_args.preview_size < 16:
+        raise ValueError("preview size must be 0 (disabled) or at least 16 pixels")
+
+    # check whitelist storage
+    if args.whitelist_storage:
+        cli_args.whitelist_storage = args.whitelist_storage
+    if cli_args.whitelist_storage not in {"json", "sqlite"}:
+        raise ValueError("whitelist storage must be 'json' or 'sqlite'")
+    if cli_args.message_edit_interval_ms < 0:
+        raise ValueError("message edit interval must be positive")
+
+    # check metrics endpoint
+    if args.metrics_port is not None:
+        cli_args.metrics_port = args.metrics_port
+    if not 0 <= cli_args.metrics_port <= 65535:
+        raise ValueError("metrics port must be between 0 (disabled) and 65535")
+
+    # check maintenance command
+    if args.command == "whitelist":
+        cli_args.command = args.command
+        cli_args.whitelist_action = args.action
+        cli_args.whitelist_transfer_file = check_path(args.file) if args.action == "import" else args.file
+        cli_args.whitelist_guild = args.guild
+        return cli_args
+
     # model needs to be set
     if cli_args.model is None:
         raise ValueError("model needs to be set (either with --model or in the config file)")
@@ -1,31 +1,61 @@
 import asyncio
+import io
 import os
+import random
+import time
 from collections.abc import Callable
-from PIL import Image
 import discord
 from discord import app_commands
 from discord.ext import commands
 
 from ..cli import CliArgs
 from ..core.cogs import UsefullCog
-from ..helper.chrono import ChronoContext
+from ..helper.chrono import TRACER, ChronoContext
+from ..helper.events import prompt_hash
 from ..messages import CustomView
-from ..models import DiffusionModel
+from ..messages import format_timestamp as ft
+from ..models import (
+    DiffusionModel,
+    EmbeddingCache,
+    GenerationProgress,
+    GenerationResult,
+    ImageEncoder,
+    Job,
+    JobCancelledError,
+    ModelPool,
+    ModelSpec,
+    ModelState,
+    QueueFullError,
+    RemoteDiffusionModel,
+    ResultCache,
+    WarmupShape,
+)
 from .manage import WhiteListManager
 
 
+class JobProgress:
+    """Latest progress of a job, the model calls it on the event loop as the denoising goes"""
+
+    def __init__(self):
+        self.latest: GenerationProgress = None
+
+    def __call__(self, progress: GenerationProgress) -> None:
+        self.latest = progress
+
+
 class ImagineView(CustomView):
 
     def __init__(
         self,
         orig_inter: discord.Interaction,
         embed: discord.Embed,
-        model: DiffusionModel,
+        model_name: str,
         imagine_cog: "Imagine",
         pprompt: str,
         nprompt: str = None,
         __pprompt: str = None,
         __nprompt: str = None,
+        count: int = 1,
         timeout: int = 180,
     ):
         super().__init__(orig_inter, timeout)
@@ -33,33 +63,99 @@ class ImagineView(CustomView):
         self.edit_button("redo", style=discord.ButtonStyle.green)
 
         self.embed = embed
-        self.model = model
+        self.model_name = model_name
         self.imagine_cog = imagine_cog
         self.pprompt = pprompt
         self.nprompt = nprompt
+        self.count = count
+        self.variants: list[GenerationResult] = []
         self.__pprompt = __pprompt
         self.__nprompt = __nprompt
 
+    variant_emojis = ("1️⃣", "2️⃣", "3️⃣", "4️⃣")
+
+    def set_variants(self, variants: list[GenerationResult]) -> None:
+        """Replace the buttons that send the full size variants (there are none for a single image)"""
+        for item in list(self.children):
+            if (getattr(item, "custom_id", None) or "").startswith("variant:"):
+                self.remove_item(item)
+        self.variants = variants
+        if len(variants) > 1:
+            for i in range(len(variants)):
+                self.with_button_callback(self.variant_emojis[i], None, f"variant:{i}", self.__on_variant(i))
+
+    def __on_variant(self, index: int) -> Callable[[discord.Interaction], None]:
+
+        async def callback(inter: discord.Interaction) -> None:
+            await inter.response.defer()
+            if index >= len(self.variants):
+                # the variants are being created again
+                return
+            await self.imagine_cog.send_variant(inter, self.variants[index])
+
+        return callback
+
     def __on_redo(self) -> Callable[[discord.Integration], None]:
 
         async def callback(inter: discord.Interaction) -> None:
+            with TRACER.trace(
+                inter.id, "redo", guild_id=inter.guild_id, model=self.model_name, count=self.count
+            ):
+                await redo(inter)
+
+        async def redo(inter: discord.Interaction) -> None:
             if not await self.imagine_cog.do_check(inter):
                 return
 
-            self.edit_button("redo", disabled=True)
             await inter.response.defer()
+            with ChronoContext("model", name=self.model_name):
+                model = await self.imagine_cog.get_model(inter, self.model_name)
+            if model is None:
+                return
+            progress = JobProgress()
+            try:
+                jobs = await self.imagine_cog.submit_or_reply(
+                    inter, model, self.pprompt, self.nprompt, on_progress=progress, count=self.count
+                )
+            finally:
+                self.imagine_cog.pool.release(self.model_name)
+            if jobs is None:
+                return
 
-            embed = self.imagine_cog.create_generate_embed(self.model.counter, self.__pprompt, self.__nprompt)
+            self.edit_button("redo", disabled=True)
+            self.set_variants([])
+            embed = self.imagine_cog.create_generate_embed(
+                model.position(jobs[0]), self.__pprompt, self.__nprompt
+            )
             await self.imagine_cog.dispatcher.edit_embed_view(self.interaction, embed, self, [])
-            with ChronoContext() as cc:
-                image = await self.model.query(self.pprompt, self.nprompt)
+            follower = asyncio.get_running_loop().create_task(
+                self.imagine_cog.follow_job(self.interaction, model, jobs[0], progress, embed, self)
+            )
+            try:
+                with ChronoContext("wait") as cc:
+                    results = await self.imagine_cog.wait_jobs(jobs)
+            finally:
+                await self.imagine_cog.stop_following(follower, jobs[0])
+            if results is None:
+                self.edit_button("redo", disabled=False)
+                await self.update()
+                return
 
             self.edit_button("redo", disabled=False)
             await self.imagine_cog.modify_generate_embed(
-                inter, image, cc.get_formatted_elapsed("%Mm %Ss"), embed, self
+                inter, results, cc.get_formatted_elapsed("%Mm %S.%fs"), embed, self
             )
 
-            self.imagine_cog.log_interaction(self.interaction, self.pprompt, self.nprompt)
+            self.imagine_cog.log_generation(
+                inter,
+                self.pprompt,
+                self.nprompt,
+                self.model_name,
+                jobs,
+                results,
+                cc.elapsed,
+                redo_of=self.interaction,
+            )
 
         return callback
 
@@ -71,20 +167,153 @@ class Imagine(UsefullCog):
     ) -> None:
         super().__init__(client)
 
-        self.__model = DiffusionModel(
-            cli_args.model,
-            cli_args.refiner,
-            cli_args.lora_weights,
-            cli_args.cpu_offload,
-            cli_args.fp,
+        self.__cli_args = cli_args
+        # the outbound scheduler does not edit a message more often anyway
+        self.__update_interval = max(1, cli_args.message_edit_interval_ms / 1000)
+        # caches are shared by every model of the pool, their keys include the model
+        self.__embedding_cache = EmbeddingCache(cli_args.embedding_cache_mb * 1024**2)
+        self.__result_cache = ResultCache(
+            cli_args.result_cache_dir,
+            cli_args.result_cache_mb * 1024**2,
+            cli_args.result_cache_disk_mb * 1024**2,
+        )
+        self.__encoder = ImageEncoder(
+            cli_args.image_format,
+            cli_args.image_quality,
+            cli_args.png_compress_level,
+            cli_args.thumbnail_size,
+        )
+
+        specs = [ModelSpec("default", cli_args.model, cli_args.refiner, cli_args.lora_weights)]
+        specs += [ModelSpec.from_dict(name, data) for name, data in cli_args.models.items()]
+        self.pool = ModelPool(
+            specs,
+            self.__make_model,
+            "default",
+            cli_args.max_resident_models,
+            cli_args.model_memory_budget_mb * 1024**2,
+            cli_args.evict_models_to,
+            None if cli_args.no_warmup else self.__warmup,
+            os.path.join(cli_args.compile_cache_dir, "model_timings.json"),
         )
         self.whitelist = whitelist
-        if not cli_args.no_warmup:
-            asyncio.create_task(self.__model.warmup())
+        # in the background, the bot answers other commands in the meantime
+        self.pool.start()
+
+    def __make_model(self, spec: ModelSpec) -> DiffusionModel | RemoteDiffusionModel:
+        if self.__cli_args.inference_workers > 0:
+            # worker processes own their embedding caches, the bot looks up the result cache before them
+            return RemoteDiffusionModel(
+                self.__cli_args.inference_workers,
+                spec.model,
+                spec.refiner,
+                spec.lora_weights,
+                self.__cli_args.cpu_offload,
+                self.__cli_args.fp,
+                self.__cli_args.max_batch_size,
+                self.__cli_args.max_batch_wait_ms,
+                self.__cli_args.max_queue_depth,
+                self.__cli_args.pipelined,
+                self.__cli_args.embedding_cache_mb * 1024**2,
+                self.__result_cache,
+                self.__encoder,
+                progress_interval=self.__update_interval / 2,
+                preview_size=self.__cli_args.preview_size,
+                compile_cache_dir=self.__cli_args.compile_cache_dir,
+            )
+        return DiffusionModel(
+            spec.model,
+            spec.refiner,
+            spec.lora_weights,
+            self.__cli_args.cpu_offload,
+            self.__cli_args.fp,
+            self.__cli_args.max_batch_size,
+            self.__cli_args.max_batch_wait_ms,
+            self.__cli_args.max_queue_depth,
+            self.__cli_args.pipelined,
+            self.__embedding_cache,
+            self.__result_cache,
+            self.__encoder,
+            self.__update_interval / 2,
+            self.__cli_args.preview_size,
+            self.__cli_args.compile_cache_dir,
+        )
+
+    async def __warmup(self, model: DiffusionModel | RemoteDiffusionModel) -> None:
+        plan = [WarmupShape.from_dict(shape) for shape in self.__cli_args.warmup_plan] or None
+        await model.warmup(plan)
+
+    def loading_status(self, model_name: str) -> str:
+        """Description of where a model that is not ready yet stands"""
+        if self.pool.state(model_name) is ModelState.WARMING:
+            status = f"Warming model `{model_name}` up"
+        else:
+            status = f"Loading model `{model_name}`"
+        match self.pool.eta(model_name):
+            case None:
+                return f"{status}, this can take a few minutes."
+            case 0:
+                return f"{status}, it should be ready any moment now."
+            case eta:
+                return f"{status}, it should be ready {ft(time.time() + eta)}."
+
+    async def get_model(
+        self, interaction: discord.Interaction, model_name: str
+    ) -> DiffusionModel | RemoteDiffusionModel | None:
+        """
+        Get a model of the pool ; while it is not ready, reply with where it stands and when it should
+        be ready.\\
+        The model is acquired : release it with `self.pool.release(model_name)` once the jobs are submitted.\\
+        Returns `None` (after replying with an error) if the model could not be loaded.
+        """
+        if self.pool.state(model_name) is ModelState.READY:
+            return await self.pool.acquire(model_name)
+
+        # also retries a failed load
+        self.pool.start(model_name)
+        embed = self.embed_builder.build_response_embed(
+            title="🖼️ Creating your image ...", description=self.loading_status(model_name)
+        )
+        # answered before the interaction times out
+        if interaction.response.is_done():
+            await self.dispatcher.edit_reply_with_embed(interaction, embed)
+        else:
+            await self.dispatcher.reply_with_embed(interaction, embed)
+
+        loading = asyncio.ensure_future(self.pool.acquire(model_name))
+        state = self.pool.state(model_name)
+        while not loading.done():
+            await asyncio.wait([loading], timeout=self.__update_interval)
+            # the estimate is a relative timestamp, the embed only changes along with the state
+            if not loading.done() and self.pool.state(model_name) is not state:
+                state = self.pool.state(model_name)
+                embed.description = self.loading_status(model_name)
+                await self.dispatcher.edit_reply_with_embed(interaction, embed.copy())
+
+        try:
+            return loading.result()
+        except Exception:  # noqa
+            # already logged by the pool
+            embed = self.embed_builder.build_error_embed(
+                title=f"Could not load model `{model_name}`",
+                description="Please try again later, or with another model.",
+            )
+            await self.dispatcher.edit_reply_with_embed(interaction, embed)
+            return None
+
+    async def model_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(name=name, value=name)
+            for name in self.pool.names
+            if current.lower() in name.lower()
+        ][:25]
 
     async def do_check(self, interaction: discord.Interaction) -> bool:
         """Check if the user can use the command and if not, send an error message."""
-        can_use = self.whitelist.can_use_imagine(interaction.user.id)
+        with ChronoContext("whitelist"):
+            can_use = await self.whitelist.can_use_imagine(interaction.guild_id, interaction.user.id)
 
         if not can_use:
             embed = self.embed_builder.build_error_embed(
@@ -95,6 +324,59 @@ class Imagine(UsefullCog):
 
         return can_use
 
+    async def priority_of(self, interaction: discord.Interaction) -> int:
+        """Queue priority of a user (its whitelist permission level)"""
+        entry = await self.whitelist.get_entry(interaction.guild_id, interaction.user.id)
+        return 0 if entry is None else entry.perms
+
+    async def submit_or_reply(
+        self,
+        interaction: discord.Interaction,
+        model: DiffusionModel,
+        pprompt: str,
+        nprompt: str = None,
+        seed: int = None,
+        on_progress: Callable[[GenerationProgress], None] = None,
+        count: int = 1,
+    ) -> list[Job] | None:
+        """
+        Enqueue the jobs of `count` variants (seeds `seed`, `seed + 1`, ...),
+        or reply with an error and return `None` if the queue is full.\\
+        Submitted together, the variants are usually generated in the same batch (and their prompts encoded
+        once), but they may be split across batches when the batch fills up ; only the first one reports
+        its progress.
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+        priority = await self.priority_of(interaction)
+        jobs: list[Job] = []
+        try:
+            with ChronoContext("submit", count=count):
+                for i in range(count):
+                    jobs.append(
+                        model.submit(
+                            pprompt,
+                            nprompt,
+                            priority=priority,
+                            expires_at=interaction.expires_at.timestamp(),
+                            seed=(seed + i) % 2**32,
+                            on_progress=on_progress if i == 0 else None,
+                        )
+                    )
+            return jobs
+        except QueueFullError:
+            for job in jobs:
+                job.cancel("queue full")
+            embed = self.embed_builder.build_error_embed(
+                title="Too many images are being created right now",
+                description="The queue is full, please try again in a few minutes.",
+            )
+            if interaction.response.is_done():
+                await self.dispatcher.followup_with_status_embed(interaction, embed)
+            else:
+                await self.dispatcher.reply_with_status_embed(interaction, embed, failed=True)
+            return None
+
     @app_commands.command(name="help", description="Get help about a command")
     async def help(self, interaction: discord.Interaction):
         embed = (
@@ -117,18 +399,121 @@ class Imagine(UsefullCog):
                 value="Create a logo from a prompt",
                 inline=False,
             )
+            .add_field(
+                name="⏱️ `trace`",
+                value="Get where the time of a request went, as a Chrome trace (for whitelist managers)",
+                inline=False,
+            )
         )
 
         await self.dispatcher.reply_with_embed(interaction, embed)
         self.log_interaction(interaction)
 
-    def create_generate_embed(
-        self, currently_in_queue: int, __pprompt: str, __nprompt: str = None
-    ) -> discord.Embed:
+    @app_commands.command(name="trace", description="Get the timings of a request as a Chrome trace")
+    @app_commands.describe(request="The request ID, in the footer of the image")
+    async def trace(self, interaction: discord.Interaction, request: str):
+        entry = await self.whitelist.get_entry(interaction.guild_id, interaction.user.id)
+        if entry is None or entry.perms < 2:
+            embed = self.embed_builder.build_error_embed(
+                title="You are not allowed to use this command.",
+                description="You are not in this guild's whitelist or do not have the required permissions.",
+            )
+            await self.dispatcher.reply_with_status_embed(interaction, embed, failed=True)
+            self.log_interaction(interaction)
+            return
+
+        # requests of other guilds are not to be found from here
+        data = TRACER.dump(int(request), interaction.guild_id) if request.strip().isdigit() else None
+        if data is None:
+            embed = self.embed_builder.build_error_embed(
+                title="Unknown request",
+                description="Only the last requests since the bot started are traced.",
+            )
+            await self.dispatcher.reply_with_status_embed(interaction, embed, failed=True)
+            self.log_interaction(interaction, request)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        embed = self.embed_builder.build_success_embed(
+            title="Request traced",
+            description="Open the file in `chrome://tracing` or <https://ui.perfetto.dev>.",
+        )
+        file = discord.File(io.BytesIO(data.encode("utf-8")), f"trace-{request.strip()}.json")
+        await self.dispatcher.followup_with_embed_and_files(interaction, embed, [file])
+        self.log_interaction(interaction, request)
+
+    @staticmethod
+    def generate_status(position: int, progress: GenerationProgress = None) -> str:
+        """Description of the embed of a job that is not done yet"""
+        if position > 0:
+            status = f"Your job is `#{position}` in queue."
+        elif progress is None:
+            status = "Your job is being processed."
+        else:
+            filled = round(progress.fraction * 20)
+            stage = "Refining" if progress.stage == "refiner" else "Denoising"
+            status = f"{stage} : step {progress.step}/{progress.total}\n`{'█' * filled}{'░' * (20 - filled)}`"
+        return f"Please wait while I create your image.\n{status}"
+
+    async def follow_job(
+        self,
+        interaction: discord.Interaction,
+        model: DiffusionModel,
+        job: Job,
+        progress: JobProgress,
+        embed: discord.Embed,
+        view: discord.ui.View = None,
+    ) -> None:
+        """
+        Keep the embed of a job up to date (queue position, then progress and preview) until it is done.\\
+        The embed is checked once per edit interval and only edited when it changes,
+        the edits are coalesced by the dispatcher anyway.
+        """
+        shown, shown_preview = embed.description, None
+        while not job.done:
+            await asyncio.wait([job.future], timeout=self.__update_interval)
+            if job.done:
+                return
+            latest = progress.latest
+            status = self.generate_status(model.position(job), latest)
+            preview = latest.preview if latest is not None else None
+            if status == shown and preview is shown_preview:
+                continue
+            shown = embed.description = status
+            shown_preview = preview
+            # a copy, the final edit reuses the embed
+            update = embed.copy()
+            try:
+                if preview is not None:
+                    update.set_image(url="attachment://preview.jpg")
+                    await self.dispatcher.edit_embed_with_image(
+                        interaction, update, preview, "preview.jpg", view
+                    )
+                elif view is not None:
+                    await self.dispatcher.edit_embed_view(interaction, update, view)
+                else:
+                    await self.dispatcher.edit_reply_with_embed(interaction, update)
+            except discord.HTTPException as e:
+                self.log.warning("could not update the progress of job %d: %s", job.id, e)
+                return
+
+    async def stop_following(self, follower: asyncio.Task, job: Job) -> None:
+        """
+        Wait for the `follow_job` task of a job to be done, so that its last edit never lands after the
+        final one ; it is cancelled if the job is not done (the wait failed or was cancelled).\\
+        Its errors are logged.
+        """
+        if not job.done:
+            follower.cancel()
+        # unlike awaiting the task, only the cancellation of the caller is raised
+        await asyncio.wait([follower])
+        if not follower.cancelled() and (e := follower.exception()) is not None:
+            self.log.error("following the progress of job %d failed: %s", job.id, e)
+
+    def create_generate_embed(self, position: int, __pprompt: str, __nprompt: str = None) -> discord.Embed:
         embed = self.embed_builder.build_response_embed(
             title="🖼️ Creating your image ...",
-            description="Please wait while I create your image.\n"
-            f"`{currently_in_queue}` job{'s' if currently_in_queue > 1 else ''} currently in queue.",
+            description=self.generate_status(position),
         ).add_field(
             name="Positive prompt",
             value=f"```txt\n{__pprompt}\n```",
@@ -143,25 +528,144 @@ class Imagine(UsefullCog):
 
         return embed
 
+    @staticmethod
+    def trace_job(job: Job) -> None:
+        """
+        Record the queue wait and the stages of a job in the running trace.\\
+        Only their durations are known, the stages are laid end to end from the start of the job.
+        """
+        if job.started_at is None:
+            return
+        start = int(job.started_at * 1e9)
+        ChronoContext.record("queue", int(job.enqueued_at * 1e9), start, job=job.id)
+        for stage in ("base", "refiner"):
+            if (elapsed := job.timings.get(stage)) is None:
+                continue
+            ChronoContext.record(stage, start, start + int(elapsed * 1e9), job=job.id)
+            start += int(elapsed * 1e9)
+        if (decode := job.timings.get("decode")) is not None:
+            # the end of the last stage
+            ChronoContext.record("decode", start - int(decode * 1e9), start, job=job.id)
+
+    async def wait_jobs(self, jobs: list[Job]) -> list[GenerationResult] | None:
+        """Wait for the variants of a request, `None` if they were dropped before they could run"""
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        # the variants may be split across batches (the batch was almost full), each one is traced
+        for job in jobs:
+            self.trace_job(job)
+        for job, result in zip(jobs, results, strict=True):
+            if isinstance(result, JobCancelledError):
+                self.log.info("job %d dropped: %s", job.id, result)
+                return None
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    def log_generation(
+        self,
+        interaction: discord.Interaction,
+        pprompt: str,
+        nprompt: str,
+        model_name: str,
+        jobs: list[Job],
+        results: list[GenerationResult],
+        elapsed: float,
+        redo_of: discord.Interaction = None,
+    ) -> None:
+        """
+        Log a delivered request ; in structured mode, with a hash of its prompts instead of the prompts,
+        and where its time went.
+
+        ## Parameters
+        ```py
+        >>> elapsed : float
+        ```
+        time (in seconds) from the submission of the jobs to their results
+        ```py
+        >>> redo_of : discord.Interaction, (optional)
+        ```
+        the original command, if the request comes from its redo button\\
+        defaults to `None`
+        """
+        if not self.structured_logs:
+            self.log_interaction(redo_of or interaction, pprompt, nprompt)
+            return
+
+        # the variants may be split across batches, the request waits for the slowest of them
+        queue_wait = max(job.wait_time for job in jobs)
+        compute = max(sum(job.timings.get(stage, 0) for stage in ("base", "refiner")) for job in jobs)
+        width, height = results[0].size
+        fields = {"redo": True, "command": redo_of.command.qualified_name} if redo_of is not None else {}
+        self.log_event(
+            interaction,
+            "generation",
+            model=model_name,
+            prompt_hash=prompt_hash(pprompt, nprompt),
+            seeds=[r.seed for r in results],
+            cached=all(r.cached for r in results),
+            queue_wait=round(queue_wait, 4),
+            compute=round(compute, 4),
+            total=round(elapsed, 4),
+            width=width,
+            height=height,
+            png_bytes=sum(len(r.png) for r in results),
+            **fields,
+        )
+
+    def __grid(self, results: list[GenerationResult]) -> bytes:
+        # blocking, decodes the images that only come as PNG
+        return self.__encoder.grid([result.image for result in results])
+
+    async def send_variant(self, interaction: discord.Interaction, result: GenerationResult) -> None:
+        """Reply to the message of a component interaction with the full size image of a variant"""
+        encoded = await asyncio.to_thread(result.encode, self.__encoder)
+        image = discord.File(io.BytesIO(encoded.data), encoded.filename)
+        await self.dispatcher.reply_files(interaction.user, interaction.message, [image])
+
     async def modify_generate_embed(
         self,
         interaction: discord.Interaction,
-        image: Image.Image,
+        results: list[GenerationResult],
         elapsed: str,
         embed: discord.Embed,
         view: ImagineView,
     ) -> discord.Embed:
+        view.set_variants(results)
+        if len(results) > 1:
+            embed.title = "🖼️ Your images are ready !"
+            embed.description = f"Your {len(results)} images were created in {elapsed}.\nPick one below."
+            embed.set_footer(
+                text="Seeds: "
+                + ", ".join(f"{r.seed}{' (cached)' if r.cached else ''}" for r in results)
+                + f" | Request: {interaction.id}"
+            )
+            # composed off the event loop, the full size variants are only encoded when picked
+            with ChronoContext("encode", count=len(results)):
+                grid = discord.File(
+                    io.BytesIO(await asyncio.to_thread(self.__grid, results)),
+                    f"grid.{self.__encoder.thumbnail_extension}",
+                )
+            embed.set_image(url=f"attachment://{grid.filename}")
+            with ChronoContext("upload"):
+                await self.dispatcher.edit_embed_view(interaction, embed, view, [grid])
+            return embed
+
+        result = results[0]
         embed.title = "🖼️ Your image is ready !"
         embed.description = f"Your image was created in {elapsed}."
+        embed.set_footer(
+            text=f"Seed: {result.seed}{' (cached)' if result.cached else ''} | Request: {interaction.id}"
+        )
 
-        image.save(f"{interaction.id}.png")
-
-        local_file = discord.File(f"{interaction.id}.png", "image.png")
-        embed.set_thumbnail(url=f"attachment://{local_file.filename}")
-        i = await self.dispatcher.edit_embed_view(interaction, embed, view, [local_file])
-        local_file = discord.File(f"{interaction.id}.png", "image.png")
-        await self.dispatcher.reply_files(interaction.user, i, [local_file])
-        os.unlink(f"{interaction.id}.png")
+        # encoded once off the event loop, the buffers are then only wrapped for each upload
+        with ChronoContext("encode", count=1):
+            encoded = await asyncio.to_thread(result.encode, self.__encoder)
+        thumbnail = discord.File(io.BytesIO(encoded.thumbnail), encoded.thumbnail_filename)
+        embed.set_thumbnail(url=f"attachment://{thumbnail.filename}")
+        with ChronoContext("upload", size=len(encoded.data)):
+            i = await self.dispatcher.edit_embed_view(interaction, embed, view, [thumbnail])
+            image = discord.File(io.BytesIO(encoded.data), encoded.filename)
+            await self.dispatcher.reply_files(interaction.user, i, [image])
         return embed
 
     async def __generate(
@@ -171,43 +675,140 @@ class Imagine(UsefullCog):
         nprompt: str = None,
         __pprompt: str = None,
         __nprompt: str = None,
+        seed: int = None,
+        model_name: str = None,
+        count: int = 1,
     ):
-        if not await self.do_check(interaction):
-            return
+        with TRACER.trace(
+            interaction.id,
+            "imagine",
+            guild_id=interaction.guild_id,
+            model=model_name or self.pool.default,
+            count=count,
+        ):
+            if not await self.do_check(interaction):
+                return
 
-        if nprompt is None:
-            nprompt = "text, blurry, fuzziness, watermark"
+            if nprompt is None:
+                nprompt = "text, blurry, fuzziness, watermark"
 
-        embed = self.create_generate_embed(self.__model.counter, __pprompt, __nprompt)
-        await self.dispatcher.reply_with_embed(interaction, embed)
+            model_name = model_name or self.pool.default
+            if model_name not in self.pool.names:
+                embed = self.embed_builder.build_error_embed(
+                    title="Unknown model",
+                    description=f"Available models: {', '.join(f'`{name}`' for name in self.pool.names)}",
+                )
+                await self.dispatcher.reply_with_status_embed(interaction, embed, failed=True)
+                return
 
-        with ChronoContext() as cc:
-            image = await self.__model.query(pprompt, nprompt)
+            with ChronoContext("model", name=model_name):
+                model = await self.get_model(interaction, model_name)
+            if model is None:
+                return
 
-        view = ImagineView(interaction, embed, self.__model, self, pprompt, nprompt, __pprompt, __nprompt)
-        await self.modify_generate_embed(interaction, image, cc.get_formatted_elapsed("%Mm %Ss"), embed, view)
+            progress = JobProgress()
+            try:
+                jobs = await self.submit_or_reply(interaction, model, pprompt, nprompt, seed, progress, count)
+            finally:
+                self.pool.release(model_name)
+            if jobs is None:
+                return
+
+            embed = self.create_generate_embed(model.position(jobs[0]), __pprompt, __nprompt)
+            if interaction.response.is_done():
+                await self.dispatcher.edit_reply_with_embed(interaction, embed)
+            else:
+                await self.dispatcher.reply_with_embed(interaction, embed)
+            follower = asyncio.get_running_loop().create_task(
+                self.follow_job(interaction, model, jobs[0], progress, embed)
+            )
+
+            try:
+                with ChronoContext("wait") as cc:
+                    results = await self.wait_jobs(jobs)
+            finally:
+                await self.stop_following(follower, jobs[0])
+            if results is None:
+                return
+
+            view = ImagineView(
+                interaction, embed, model_name, self, pprompt, nprompt, __pprompt, __nprompt, count
+            )
+            elapsed = cc.get_formatted_elapsed("%Mm %S.%fs")
+            await self.modify_generate_embed(interaction, results, elapsed, embed, view)
 
-        self.log_interaction(interaction, pprompt, nprompt)
+            self.log_generation(interaction, pprompt, nprompt, model_name, jobs, results, cc.elapsed)
 
     @app_commands.command(name="raw", description="Create an image from a raw positive and negative prompts")
-    @app_commands.describe(pprompt="The positive prompt", nprompt="An optional negative prompt")
-    async def raw(self, interaction: discord.Interaction, pprompt: str, nprompt: str = None):
-        await self.__generate(interaction, pprompt, nprompt, pprompt, nprompt)
+    @app_commands.describe(
+        pprompt="The positive prompt",
+        nprompt="An optional negative prompt",
+        seed="An optional seed to get the same image again",
+        model="The model to use",
+        count="How many variants to create at once",
+    )
+    @app_commands.autocomplete(model=model_autocomplete)
+    async def raw(
+        self,
+        interaction: discord.Interaction,
+        pprompt: str,
+        nprompt: str = None,
+        seed: int = None,
+        model: str = None,
+        count: app_commands.Range[int, 1, 4] = 1,
+    ):
+        await self.__generate(interaction, pprompt, nprompt, pprompt, nprompt, seed, model, count)
 
     @app_commands.command(name="realistic", description="Create a realistic image from a prompt")
-    async def realistic(self, interaction: discord.Interaction, prompt: str):
+    @app_commands.describe(
+        prompt="What to create",
+        seed="An optional seed to get the same image again",
+        model="The model to use",
+        count="How many variants to create at once",
+    )
+    @app_commands.autocomplete(model=model_autocomplete)
+    async def realistic(
+        self,
+        interaction: discord.Interaction,
+        prompt: str,
+        seed: int = None,
+        model: str = None,
+        count: app_commands.Range[int, 1, 4] = 1,
+    ):
         pprompt = f"{prompt}, photography, realistic, detailed, high resolution, high quality, textures"
         nprompt = (
             "text, blur, deformed, black and white, cut body, only body, no head, deformed head, "
             "strange proportions, uneven eyes, deformed hands, deformed toes, strange, ugly, low resolution, "
             "no details, no textures, watermark, multiple bodies, painting, fade, pastel colors"
         )
-        await self.__generate(interaction, pprompt, nprompt, prompt)
+        await self.__generate(interaction, pprompt, nprompt, prompt, seed=seed, model_name=model, count=count)
 
     @app_commands.command(name="logo", description="Create a logo from a prompt")
-    async def logo(self, interaction: discord.Interaction, prompt: str):
+    @app_commands.describe(
+        prompt="What to create",
+        seed="An optional seed to get the same image again",
+        model="The model to use",
+        count="How many variants to create at once",
+    )
+    @app_commands.autocomplete(model=model_autocomplete)
+    async def logo(
+        self,
+        interaction: discord.Interaction,
+        prompt: str,
+        seed: int = None,
+        model: str = None,
+        count: app_commands.Range[int, 1, 4] = 1,
+    ):
         nprompt = (
             "old, vintage, retro, classic, traditional, ancient, outdated, "
             "detailed, obsolete, old-fashioned, text, blurry, fuzziness, watermark"
         )
-        await self.__generate(interaction, f"{prompt}, digital art, minimal logo", nprompt, prompt)
+        await self.__generate(
+            interaction,
+            f"{prompt}, digital art, minimal logo",
+            nprompt,
+            prompt,
+            seed=seed,
+            model_name=model,
+            count=count,
+        )
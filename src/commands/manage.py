@@ -1,33 +1,36 @@
+import asyncio
 import datetime
-import os
+import tempfile
+import time
+from collections import OrderedDict
 from collections.abc import Callable
 from dataclasses import dataclass
 
+import aiohttp
 import discord
-import pyjson5 as json
 from discord import app_commands
 from discord.ext import commands
 
 from ..core.cogs import UsefullCog
+from ..core.members import MemberResolver
 from ..helper.auto_numbered import AutoNumberedEnum
-from ..messages import CustomView
+from ..helper.metrics import REGISTRY
+from ..messages import CustomView, Dispatcher
+from ..storage import (
+    GLOBAL_GUILD,
+    WhiteListEntry,
+    WhiteListStorage,
+    parse_rows,
+    transfer_format,
+    write_entries,
+)
 
-__all__ = ["Manage", "WhiteListEntry", "WhiteListManager", "WhiteListResultCode"]
+__all__ = ["ImportSummary", "Manage", "WhiteListEntry", "WhiteListManager", "WhiteListResultCode"]
 
-
-@dataclass
-class WhiteListEntry:
-    user_id: int
-    perms: int  # 1 = use, 2 = use + add/remove 1, 3 = use + add/remove 1 + add/remove 2
-    by: int
-    date: float
-
-    def to_dict(self):
-        return {"user_id": self.user_id, "perms": self.perms, "by": self.by, "date": self.date}
-
-    @classmethod
-    def from_dict(cls, data: dict[str, int | float]):
-        return cls(data["user_id"], data["perms"], data["by"], data["date"])
+_checks = REGISTRY.counter("pixelia_whitelist_checks_total", "Whitelist checks by outcome", ("allowed",))
+_check_seconds = REGISTRY.histogram(
+    "pixelia_whitelist_check_seconds", "Time spent checking the whitelist", buckets=(1e-4, 1e-3, 0.01, 0.1, 1)
+)
 
 
 class WhiteListResultCode(AutoNumberedEnum):
@@ -55,111 +58,286 @@ class WhiteListResultCode(AutoNumberedEnum):
         }
 
 
-class WhiteListManager:
-    def __init__(self, owner_id: int, filename: str = "whitelist.json"):
-        self.filename = filename
-        self.__whitelist = self.__load_whitelist(owner_id)
-
-    @property
-    def whitelist(self) -> list[WhiteListEntry]:
-        return self.__whitelist
-
-    def __load_whitelist(self, owner_id: int) -> list[WhiteListEntry]:
-        should_create = False
-        if not os.path.exists(self.filename):
-            should_create = True
-
-        try:
-            with open(self.filename, "r", encoding="utf-8") as f:
-                return [WhiteListEntry.from_dict(entry) for entry in json.decode_io(f)]
-        except (FileNotFoundError, json.Json5DecoderException):
-            should_create = True
-
-        if should_create:
-            entry = WhiteListEntry(owner_id, 3, owner_id, 0)
-            with open(self.filename, "w", encoding="utf-8") as f:
-                f.write(json.encode([entry.to_dict()]))
-
-            return [entry]
-
-        raise ValueError("Unreachable code")
-
-    def __save_whitelist(self):
-        with open(self.filename, "w", encoding="utf-8") as f:
-            f.write(json.encode([entry.to_dict() for entry in self.whitelist]))
-
-    def __add_entry(self, entry: WhiteListEntry):
-        self.__whitelist.append(entry)
-        self.__save_whitelist()
+@dataclass
+class ImportSummary:
+    """What happened to the rows of an imported whitelist file"""
+
+    added: int = 0
+    updated: int = 0
+    not_permitted: int = 0
+    not_in_guild: int = 0
+    invalid: int = 0
+
+
+class _GuildIndex:
+    """Entries of a single guild, indexed by user, granter and permission level"""
+
+    def __init__(self, entries: list[WhiteListEntry]):
+        self.loaded_at = time.monotonic()
+        self.board: list[WhiteListEntry] = None  # sorted entries that apply in the guild, built on demand
+        self.entries: dict[int, WhiteListEntry] = {}
+        self.by_granter: dict[int, set[int]] = {}
+        self.by_perms: dict[int, set[int]] = {}
+        for entry in entries:
+            self.index(entry)
+
+    def index(self, entry: WhiteListEntry):
+        if (previous := self.entries.get(entry.user_id)) is not None:
+            self.unindex(previous)
+        self.entries[entry.user_id] = entry
+        self.by_granter.setdefault(entry.by, set()).add(entry.user_id)
+        self.by_perms.setdefault(entry.perms, set()).add(entry.user_id)
+
+    def unindex(self, entry: WhiteListEntry):
+        del self.entries[entry.user_id]
+        for index, key in ((self.by_granter, entry.by), (self.by_perms, entry.perms)):
+            users = index[key]
+            users.discard(entry.user_id)
+            if not users:
+                del index[key]
 
-    def __remove_entry(self, user_id: int):
-        self.__whitelist = [entry for entry in self.whitelist if entry.user_id != user_id]
-        self.__save_whitelist()
 
-    def __update_entry(self, entry: WhiteListEntry):
-        for i, e in enumerate(self.whitelist):
-            if e.user_id == entry.user_id:
-                self.whitelist[i] = entry
-                self.__save_whitelist()
-                return
+class WhiteListManager:
+    """
+    Per-guild whitelist of the users allowed to use the bot.
+
+    A user's entry in a guild is its entry for that guild if any, or else its global
+    entry (`GLOBAL_GUILD`, which holds the owner and the entries from before per-guild
+    whitelists). Entries live in a `WhiteListStorage` ; the guilds being used are
+    cached (up to `max_cached_guilds`, each for `cache_ttl` seconds so that changes
+    made by other processes sharing the storage show up) and indexed by `user_id`,
+    by the user that granted them (`by`) and by permission level.
+
+    ```py
+    whitelist = WhiteListManager(owner_id, SqliteWhiteListStorage("whitelist.db"))
+    await whitelist.load()
+    await whitelist.can_use_imagine(guild_id, user_id)
+    ```
+    """
 
-    def get_entry(self, user_id: int) -> WhiteListEntry | None:
-        for entry in self.whitelist:
-            if entry.user_id == user_id:
-                return entry
-        return None
-
-    def can_use_imagine(self, user_id: int) -> bool:
-        entry = self.get_entry(user_id)
-        return entry is not None and entry.perms >= 1
-
-    def add_user(self, user_id: int, perms: int, by: int, date: float) -> WhiteListResultCode:
-        manager_entry = self.get_entry(by)
-        if manager_entry is None:
-            return WhiteListResultCode.ASKING_USER_NOT_FOUND
-        if manager_entry.perms < 2 or (perms > manager_entry.perms):
-            return WhiteListResultCode.OPERATION_NOT_PERMITTED
-
-        user_entry = self.get_entry(user_id)
-        if user_entry is not None:
-            return WhiteListResultCode.USER_ALREADY_WHITELISTED
-        self.__add_entry(WhiteListEntry(user_id, perms, by, date))
-        return WhiteListResultCode.USER_ADDED
-
-    def remove_user(self, user_id: int, by: int) -> WhiteListResultCode:
-        manager_entry = self.get_entry(by)
-        if manager_entry is None:
-            return WhiteListResultCode.ASKING_USER_NOT_FOUND
-
-        user_entry = self.get_entry(user_id)
-        if user_entry is None:
-            return WhiteListResultCode.USER_NOT_WHITELISTED
-        if manager_entry.perms < user_entry.perms or manager_entry.perms < 2:
-            return WhiteListResultCode.OPERATION_NOT_PERMITTED
-        self.__remove_entry(user_id)
-        return WhiteListResultCode.USER_REMOVED
-
-    def update_user_perms(self, user_id: int, perms: int, by: int, date: float) -> WhiteListResultCode:
-        manager_entry = self.get_entry(by)
-        if manager_entry is None:
-            return WhiteListResultCode.ASKING_USER_NOT_FOUND
-
-        user_entry = self.get_entry(user_id)
-        if user_entry is None:
-            return WhiteListResultCode.USER_NOT_FOUND
-        if manager_entry.perms < user_entry.perms or manager_entry.perms < 2:
-            return WhiteListResultCode.OPERATION_NOT_PERMITTED
-        if perms > manager_entry.perms:
-            return WhiteListResultCode.OPERATION_NOT_PERMITTED
-
-        user_entry.perms = perms
-        user_entry.by = by
-        user_entry.date = date
-        self.__update_entry(user_entry)
-        return WhiteListResultCode.USER_PERMS_UPDATED
+    def __init__(
+        self,
+        owner_id: int,
+        storage: WhiteListStorage,
+        max_cached_guilds: int = 1024,
+        cache_ttl: float = 60,
+    ):
+        self.owner_id = owner_id
+        self.storage = storage
+        self.max_cached_guilds = max(1, max_cached_guilds)
+        self.cache_ttl = cache_ttl
+
+        # ordered from the least to the most recently used
+        self.__guilds: OrderedDict[int, _GuildIndex] = OrderedDict()
+        self.__lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        """Give the owner every permission if the storage is brand new"""
+        if await self.storage.is_empty():
+            await self.storage.put(WhiteListEntry(self.owner_id, 3, self.owner_id, 0, GLOBAL_GUILD))
+
+    def __invalidate(self, guild_id: int):
+        # global entries show up on the board of every guild
+        for cached_id, index in self.__guilds.items():
+            if guild_id in {cached_id, GLOBAL_GUILD}:
+                index.board = None
+
+    async def __guild(self, guild_id: int) -> _GuildIndex:
+        index = self.__guilds.get(guild_id)
+        if index is None or time.monotonic() - index.loaded_at > self.cache_ttl:
+            index = _GuildIndex(await self.storage.load_guild(guild_id))
+            self.__guilds[guild_id] = index
+            self.__invalidate(guild_id)
+            while len(self.__guilds) > self.max_cached_guilds:
+                self.__guilds.popitem(last=False)
+        self.__guilds.move_to_end(guild_id)
+        return index
+
+    async def __own_entry(self, guild_id: int, user_id: int) -> WhiteListEntry | None:
+        return (await self.__guild(guild_id)).entries.get(user_id)
+
+    async def get_entry(self, guild_id: int | None, user_id: int) -> WhiteListEntry | None:
+        """Entry that applies to a user in a guild (`None` for direct messages)"""
+        guild_id = guild_id or GLOBAL_GUILD
+        if (entry := await self.__own_entry(guild_id, user_id)) is not None:
+            return entry
+        if guild_id == GLOBAL_GUILD:
+            return None
+        return await self.__own_entry(GLOBAL_GUILD, user_id)
+
+    async def entries(self, guild_id: int) -> list[WhiteListEntry]:
+        """Every entry that applies in a guild"""
+        own = (await self.__guild(guild_id)).entries
+        if guild_id == GLOBAL_GUILD:
+            return list(own.values())
+        shared = (await self.__guild(GLOBAL_GUILD)).entries
+        return list(own.values()) + [entry for user_id, entry in shared.items() if user_id not in own]
+
+    async def board(self, guild_id: int) -> list[WhiteListEntry]:
+        """
+        Every entry that applies in a guild, highest permission level first.\\
+        The list is cached until the whitelist of the guild changes, do not modify it.
+        """
+        index = await self.__guild(guild_id)
+        if index.board is None:
+            index.board = sorted(await self.entries(guild_id), key=lambda x: x.perms, reverse=True)
+        return index.board
+
+    async def granted_by(self, guild_id: int, by: int) -> list[WhiteListEntry]:
+        """Entries of a guild last granted or updated by a given user"""
+        index = await self.__guild(guild_id)
+        return [index.entries[user_id] for user_id in index.by_granter.get(by, ())]
+
+    async def with_perms(self, guild_id: int, perms: int) -> list[WhiteListEntry]:
+        """Entries of a guild with a given permission level"""
+        index = await self.__guild(guild_id)
+        return [index.entries[user_id] for user_id in index.by_perms.get(perms, ())]
+
+    async def __put(self, entry: WhiteListEntry):
+        await self.storage.put(entry)
+        if (index := self.__guilds.get(entry.guild_id)) is not None:
+            index.index(entry)
+        self.__invalidate(entry.guild_id)
+
+    async def __delete(self, entry: WhiteListEntry):
+        await self.storage.delete(entry.guild_id, entry.user_id)
+        if (index := self.__guilds.get(entry.guild_id)) is not None and entry.user_id in index.entries:
+            index.unindex(index.entries[entry.user_id])
+        self.__invalidate(entry.guild_id)
+
+    def __may_change(self, manager_entry: WhiteListEntry, user_entry: WhiteListEntry) -> bool:
+        """
+        If a manager may change an existing entry : its level must be at least the one of the entry,
+        global entries (which apply in every guild) are only changed by global managers,
+        and the owner's entries only by the owner
+        """
+        if manager_entry.perms < 2 or manager_entry.perms < user_entry.perms:
+            return False
+        if user_entry.user_id == self.owner_id and manager_entry.user_id != self.owner_id:
+            return False
+        return user_entry.guild_id != GLOBAL_GUILD or manager_entry.guild_id == GLOBAL_GUILD
+
+    @staticmethod
+    def __updated_guild(guild_id: int, manager_entry: WhiteListEntry, user_entry: WhiteListEntry) -> int:
+        """Guild of the entry written on update, guild managers override global entries in their guild"""
+        if user_entry.guild_id == GLOBAL_GUILD and manager_entry.guild_id != GLOBAL_GUILD:
+            return guild_id
+        return user_entry.guild_id
+
+    async def can_use_imagine(self, guild_id: int | None, user_id: int) -> bool:
+        with _check_seconds.time():
+            entry = await self.get_entry(guild_id, user_id)
+        allowed = entry is not None and entry.perms >= 1
+        _checks.inc(allowed=str(allowed).lower())
+        return allowed
+
+    async def add_user(
+        self, guild_id: int, user_id: int, perms: int, by: int, date: float
+    ) -> WhiteListResultCode:
+        async with self.__lock:
+            manager_entry = await self.get_entry(guild_id, by)
+            if manager_entry is None:
+                return WhiteListResultCode.ASKING_USER_NOT_FOUND
+            if manager_entry.perms < 2 or (perms > manager_entry.perms):
+                return WhiteListResultCode.OPERATION_NOT_PERMITTED
+
+            user_entry = await self.get_entry(guild_id, user_id)
+            if user_entry is not None:
+                return WhiteListResultCode.USER_ALREADY_WHITELISTED
+            await self.__put(WhiteListEntry(user_id, perms, by, date, guild_id))
+            return WhiteListResultCode.USER_ADDED
+
+    async def remove_user(self, guild_id: int, user_id: int, by: int) -> WhiteListResultCode:
+        async with self.__lock:
+            manager_entry = await self.get_entry(guild_id, by)
+            if manager_entry is None:
+                return WhiteListResultCode.ASKING_USER_NOT_FOUND
+
+            user_entry = await self.get_entry(guild_id, user_id)
+            if user_entry is None:
+                return WhiteListResultCode.USER_NOT_WHITELISTED
+            if not self.__may_change(manager_entry, user_entry):
+                return WhiteListResultCode.OPERATION_NOT_PERMITTED
+            await self.__delete(user_entry)
+            return WhiteListResultCode.USER_REMOVED
+
+    async def update_user_perms(
+        self, guild_id: int, user_id: int, perms: int, by: int, date: float
+    ) -> WhiteListResultCode:
+        async with self.__lock:
+            manager_entry = await self.get_entry(guild_id, by)
+            if manager_entry is None:
+                return WhiteListResultCode.ASKING_USER_NOT_FOUND
+
+            user_entry = await self.get_entry(guild_id, user_id)
+            if user_entry is None:
+                return WhiteListResultCode.USER_NOT_FOUND
+            if not self.__may_change(manager_entry, user_entry) or perms > manager_entry.perms:
+                return WhiteListResultCode.OPERATION_NOT_PERMITTED
+
+            updated_guild = self.__updated_guild(guild_id, manager_entry, user_entry)
+            await self.__put(WhiteListEntry(user_id, perms, by, date, updated_guild))
+            return WhiteListResultCode.USER_PERMS_UPDATED
+
+    async def import_users(
+        self, guild_id: int, rows: dict[int, int], by: int, date: float, summary: ImportSummary = None
+    ) -> ImportSummary:
+        """
+        Add or update many users at once, with a single write to the storage.\\
+        Each row goes through the same permission checks as `add_user` and `update_user_perms`.
+
+        ## Parameters
+        ```py
+        >>> rows : dict[int, int]
+        ```
+        permission level to give to each user
+        ```py
+        >>> summary : ImportSummary, (optional)
+        ```
+        summary to add the outcome of each row to\\
+        defaults to `None` (a new summary)
+
+        ## Returns
+        ```py
+        ImportSummary : what happened to the rows
+        ```
+        """
+        summary = summary if summary is not None else ImportSummary()
+        async with self.__lock:
+            manager_entry = await self.get_entry(guild_id, by)
+            if manager_entry is None or manager_entry.perms < 2:
+                summary.not_permitted += len(rows)
+                return summary
+
+            entries = []
+            for user_id, perms in rows.items():
+                user_entry = await self.get_entry(guild_id, user_id)
+                if user_id == by or perms > manager_entry.perms:
+                    summary.not_permitted += 1
+                elif user_entry is None:
+                    entries.append(WhiteListEntry(user_id, perms, by, date, guild_id))
+                    summary.added += 1
+                elif not self.__may_change(manager_entry, user_entry):
+                    summary.not_permitted += 1
+                else:
+                    updated_guild = self.__updated_guild(guild_id, manager_entry, user_entry)
+                    entries.append(WhiteListEntry(user_id, perms, by, date, updated_guild))
+                    summary.updated += 1
+
+            if entries:
+                await self.storage.put_many(entries)
+                for entry in entries:
+                    if (index := self.__guilds.get(entry.guild_id)) is not None:
+                        index.index(entry)
+                    self.__invalidate(entry.guild_id)
+            return summary
 
 
 class BoardView(CustomView):
+    """
+    Paginated whitelist of a guild.\\
+    Pages are only formatted when they are first shown, then kept in `items`.
+    """
 
     items_per_page = 10
 
@@ -167,7 +345,8 @@ class BoardView(CustomView):
         self,
         orig_inter: discord.Integration,
         embed: discord.Embed,
-        db: WhiteListManager,
+        entries: list[WhiteListEntry],
+        dispatcher: Dispatcher,
         timeout: int | None = 180,
     ):
         super().__init__(orig_inter, timeout)
@@ -178,58 +357,49 @@ class BoardView(CustomView):
         self.embed = embed
         self.items: dict[int, str] = {}
 
-        self.__tmp_records: list[WhiteListEntry] = []
-        self.__db = db
+        self.__entries = entries  # already sorted
+        self.__dispatcher = dispatcher
         self.__page = 0
 
-        self.__setup()
-
     @property
     def first_page(self) -> str:
-        return self.items[0]
+        return self.page(0)
 
     @property
     def n_pages(self) -> int:
-        return len(self.items)
+        return max(1, -(-len(self.__entries) // self.items_per_page))
 
     def wrap_page_no(self, page: int) -> int:
         return page % self.n_pages
 
-    def __setup(self) -> None:
-        self.__tmp_records = sorted(self.__db.whitelist, key=lambda x: x.perms, reverse=True)
+    def page(self, page: int) -> str:
+        if (content := self.items.get(page)) is not None:
+            return content
 
-        building_page = 0
-        current_page = ""
-        i = 0
-        for entry in self.__tmp_records:
+        start = page * self.items_per_page
+        lines = []
+        for i, entry in enumerate(self.__entries[start : start + self.items_per_page], start + 1):
             user = self.interaction.guild.get_member(entry.user_id)
-            if user is None:
-                continue
-            i += 1
-            line = (
-                f"{i}. `{user.display_name}` ({user.mention}) [`{entry.perms}`] "
+            name = f"`{user.display_name}` ({user.mention})" if user is not None else f"<@{entry.user_id}>"
+            lines.append(
+                f"{i}. {name} [`{entry.perms}`] "
                 f"by <@{entry.by}> on {datetime.datetime.fromtimestamp(entry.date).strftime('%Y-%m-%d %H:%M:%S')}\n"
             )
-            current_page += line
-
-            if i % self.items_per_page == 0:
-                self.items.update({building_page: current_page})
-                current_page = ""
-                building_page += 1
-
-        if current_page != "":
-            self.items.update({building_page: current_page})
+        content = "".join(lines) or "Nobody is whitelisted yet."
+        self.items[page] = content
+        return content
 
     def __on_page_change(self, page: int) -> Callable[[discord.Interaction], None]:
 
         async def callback(interaction: discord.Interaction) -> None:
             self.__page = self.wrap_page_no(self.__page + page)
 
-            self.embed.description = self.items[self.__page]
+            self.embed.description = self.page(self.__page)
             self.embed.set_footer(text=f"Page {self.__page + 1}/{self.n_pages}")
 
-            await self.interaction.edit_original_response(embed=self.embed, view=self)
             await interaction.response.defer()
+            # quick clicks only cost one edit
+            await self.__dispatcher.edit_embed_view(self.interaction, self.embed, self)
 
         return callback
 
@@ -241,17 +411,18 @@ class Manage(UsefullCog):
         super().__init__(client)
 
         self.whitelist = whitelist
+        self.members = MemberResolver()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.members.forget(member.guild.id, member.id)
 
     async def __is_user_in_guild(self, guild: discord.Guild, user_id: int) -> bool:
-        try:
-            await guild.fetch_member(user_id)
-            return True
-        except:  # noqa
-            return False
+        return await self.members.is_member(guild, user_id)
 
-    async def __check_for_command_perms(self, user_id: int) -> bool:
+    async def __check_for_command_perms(self, guild_id: int, user_id: int) -> bool:
         """checks if the user can use the command, not if the command is allowed"""
-        entry = self.whitelist.get_entry(user_id)
+        entry = await self.whitelist.get_entry(guild_id, user_id)
         return entry is not None and entry.perms >= 2
 
     @app_commands.command(name="help", description="Get help about a command")
@@ -281,6 +452,16 @@ class Manage(UsefullCog):
                 value="Set the permissions of a user.",
                 inline=False,
             )
+            .add_field(
+                name="📥 `import`",
+                value="Add or update many users at once from a CSV (`user_id,perms`) or JSONL file.",
+                inline=False,
+            )
+            .add_field(
+                name="📤 `export`",
+                value="Download this guild's whitelist as a CSV or JSONL file.",
+                inline=False,
+            )
         )
         await self.dispatcher.reply_with_embed(interaction, embed)
         self.log_interaction(interaction)
@@ -289,7 +470,7 @@ class Manage(UsefullCog):
     @app_commands.describe(user="The user to get the permissions of")
     async def list(self, interaction: discord.Interaction, user: discord.Member = None):
 
-        if not await self.__check_for_command_perms(interaction.user.id):
+        if not await self.__check_for_command_perms(interaction.guild_id, interaction.user.id):
             embed = self.embed_builder.build_error_embed(
                 title="You are not allowed to use this command.",
                 description="You are not in this guild's whitelist or do not have the required permissions.",
@@ -303,14 +484,16 @@ class Manage(UsefullCog):
                 title=f"📊 WhiteList of {interaction.guild.name}",
                 description="...loading...",
             )
-            view = BoardView(interaction, embed, self.whitelist)
+            view = BoardView(
+                interaction, embed, await self.whitelist.board(interaction.guild_id), self.dispatcher
+            )
             await self.dispatcher.send_embed_and_view(interaction, embed, view)
 
             embed.description = view.first_page
             embed.set_footer(text=f"Page 1/{view.n_pages}")
-            await interaction.edit_original_response(embed=embed, view=view)
+            await self.dispatcher.edit_embed_view(interaction, embed, view)
         else:
-            entry = self.whitelist.get_entry(user.id)
+            entry = await self.whitelist.get_entry(interaction.guild_id, user.id)
             if entry is None:
                 embed = self.embed_builder.build_error_embed(
                     title="User not found",
@@ -346,7 +529,7 @@ class Manage(UsefullCog):
         permission: app_commands.Choice[int] = None,
     ):
         perm = 1 if permission is None else permission.value
-        if not await self.__check_for_command_perms(interaction.user.id):
+        if not await self.__check_for_command_perms(interaction.guild_id, interaction.user.id):
             embed = self.embed_builder.build_error_embed(
                 title="You are not allowed to use this command.",
                 description="You are not in this guild's whitelist or do not have the required permissions.",
@@ -373,7 +556,8 @@ class Manage(UsefullCog):
             self.log_interaction(interaction)
             return
 
-        result = self.whitelist.add_user(
+        result = await self.whitelist.add_user(
+            interaction.guild_id,
             user.id,
             perm,
             interaction.user.id,
@@ -398,7 +582,7 @@ class Manage(UsefullCog):
     @app_commands.command(name="remove", description="Remove a user from this guild's whitelist")
     @app_commands.describe(user="The user to remove")
     async def remove(self, interaction: discord.Interaction, user: discord.Member):
-        if not await self.__check_for_command_perms(interaction.user.id):
+        if not await self.__check_for_command_perms(interaction.guild_id, interaction.user.id):
             embed = self.embed_builder.build_error_embed(
                 title="You are not allowed to use this command.",
                 description="You are not in this guild's whitelist or do not have the required permissions.",
@@ -425,7 +609,7 @@ class Manage(UsefullCog):
             self.log_interaction(interaction)
             return
 
-        result = self.whitelist.remove_user(user.id, interaction.user.id)
+        result = await self.whitelist.remove_user(interaction.guild_id, user.id, interaction.user.id)
         if result.is_ok():
             embed = self.embed_builder.build_success_embed(
                 title="User removed from the whitelist",
@@ -459,7 +643,7 @@ class Manage(UsefullCog):
         user: discord.Member,
         permission: app_commands.Choice[int],
     ):
-        if not await self.__check_for_command_perms(interaction.user.id):
+        if not await self.__check_for_command_perms(interaction.guild_id, interaction.user.id):
             embed = self.embed_builder.build_error_embed(
                 title="You are not allowed to use this command.",
                 description="You are not in this guild's whitelist or do not have the required permissions.",
@@ -486,7 +670,8 @@ class Manage(UsefullCog):
             self.log_interaction(interaction)
             return
 
-        result = self.whitelist.update_user_perms(
+        result = await self.whitelist.update_user_perms(
+            interaction.guild_id,
             user.id,
             permission.value,
             interaction.user.id,
@@ -508,3 +693,104 @@ class Manage(UsefullCog):
             await self.dispatcher.reply_with_status_embed(interaction, embed, failed=True)
 
         self.log_interaction(interaction)
+
+    @app_commands.command(name="import", description="Add or update many users from a file")
+    @app_commands.describe(file="A CSV (user_id,perms) or JSONL file")
+    async def import_(self, interaction: discord.Interaction, file: discord.Attachment):
+        if not await self.__check_for_command_perms(interaction.guild_id, interaction.user.id):
+            embed = self.embed_builder.build_error_embed(
+                title="You are not allowed to use this command.",
+                description="You are not in this guild's whitelist or do not have the required permissions.",
+            )
+            await self.dispatcher.reply_with_status_embed(interaction, embed, failed=True)
+            self.log_interaction(interaction)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        summary = ImportSummary()
+        rows: dict[int, int] = {}
+        try:
+            # parsed as it is downloaded, a later row for the same user wins
+            async with aiohttp.ClientSession() as session, session.get(file.url) as response:
+                response.raise_for_status()
+                async for row in parse_rows(response.content, transfer_format(file.filename)):
+                    if isinstance(row, ValueError):
+                        summary.invalid += 1
+                        continue
+                    user_id, perms = row
+                    rows[user_id] = perms
+        except aiohttp.ClientError as e:
+            embed = self.embed_builder.build_error_embed(
+                title="An error occurred",
+                description=f"Could not download the file.\n\n```txt\n{e}\n```",
+            )
+            await self.dispatcher.followup_with_status_embed(interaction, embed)
+            self.log_interaction(interaction, file.filename)
+            return
+        except ValueError as e:
+            # raised by the stream for a line over its limit (or by a line that is not UTF-8),
+            # the rest of the file cannot be read
+            embed = self.embed_builder.build_error_embed(
+                title="An error occurred",
+                description=f"Could not read the file.\n\n```txt\n{e}\n```",
+            )
+            await self.dispatcher.followup_with_status_embed(interaction, embed)
+            self.log_interaction(interaction, file.filename)
+            return
+
+        # lookups of the whole file are coalesced into a few member requests
+        in_guild = await asyncio.gather(
+            *(self.__is_user_in_guild(interaction.guild, user_id) for user_id in rows)
+        )
+        summary.not_in_guild = in_guild.count(False)
+        rows = {
+            user_id: perms for (user_id, perms), found in zip(rows.items(), in_guild, strict=True) if found
+        }
+
+        summary = await self.whitelist.import_users(
+            interaction.guild_id, rows, interaction.user.id, interaction.created_at.timestamp(), summary
+        )
+        embed = self.embed_builder.build_success_embed(
+            title="Whitelist imported",
+            description=f"Added: `{summary.added}`\n"
+            f"Updated: `{summary.updated}`\n"
+            f"Not permitted: `{summary.not_permitted}`\n"
+            f"Not in this guild: `{summary.not_in_guild}`\n"
+            f"Invalid rows: `{summary.invalid}`",
+        )
+        await self.dispatcher.followup_with_status_embed(interaction, embed)
+        self.log_interaction(interaction, file.filename)
+
+    @app_commands.command(name="export", description="Export this guild's whitelist")
+    @app_commands.describe(format="The format of the file")
+    @app_commands.choices(
+        format=[
+            app_commands.Choice(name="CSV", value="csv"),
+            app_commands.Choice(name="JSONL", value="jsonl"),
+        ]
+    )
+    async def export(self, interaction: discord.Interaction, format: app_commands.Choice[str] = None):  # noqa
+        if not await self.__check_for_command_perms(interaction.guild_id, interaction.user.id):
+            embed = self.embed_builder.build_error_embed(
+                title="You are not allowed to use this command.",
+                description="You are not in this guild's whitelist or do not have the required permissions.",
+            )
+            await self.dispatcher.reply_with_status_embed(interaction, embed, failed=True)
+            self.log_interaction(interaction)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        fmt = "csv" if format is None else format.value
+        # rows are written one by one, spilling to disk past a megabyte
+        out = tempfile.SpooledTemporaryFile(max_size=1024**2)
+        n = await asyncio.to_thread(write_entries, await self.whitelist.board(interaction.guild_id), fmt, out)
+        out.seek(0)
+
+        embed = self.embed_builder.build_success_embed(
+            title="Whitelist exported",
+            description=f"Exported `{n}` users.",
+        )
+        await self.dispatcher.followup_with_embed_and_files(
+            interaction, embed, [discord.File(out, f"whitelist.{fmt}")]
+        )
+        self.log_interaction(interaction)
@@ -9,7 +9,10 @@ from typing_extensions import override
 
 from ..cli import CliArgs
 from ..commands import Imagine, Manage, Utils, WhiteListManager
-from ..messages import Dispatcher, Embedder
+from ..helper.logger import shutdown_logger
+from ..helper.metrics import start_metrics_server
+from ..messages import Dispatcher, Embedder, OutboundScheduler
+from ..storage import open_whitelist_storage
 from ..version import __version__
 
 __all__ = ["UsefulClient"]
@@ -29,7 +32,8 @@ class UsefulClient(commands.AutoShardedBot):
         self.logger = logging.getLogger("pixelia")
 
         self.embed_builder = Embedder()
-        self.dispatcher = Dispatcher()
+        self.log_format = cli_args.log_format
+        self.dispatcher = Dispatcher(OutboundScheduler(cli_args.message_edit_interval_ms / 1000))
         self.whitelist: WhiteListManager = None
         self.started_once = False
 
@@ -70,9 +74,15 @@ class UsefulClient(commands.AutoShardedBot):
     @override
     async def setup_hook(self) -> None:
         owner_id = (await self.application_info()).owner.id
-        self.whitelist = WhiteListManager(owner_id)
+        storage = await open_whitelist_storage(
+            self.__cli_args.whitelist_storage, self.__cli_args.whitelist_file, self.__cli_args.whitelist_db
+        )
+        self.whitelist = WhiteListManager(owner_id, storage)
+        await self.whitelist.load()
         self.logger.info("Owner ID: %d", owner_id)
         await self.setup()
+        if self.__cli_args.metrics_port > 0:
+            await start_metrics_server(self.__cli_args.metrics_host, self.__cli_args.metrics_port)
         self.logger.info("Messing around ...")
 
         signal.signal(signal.SIGINT, self.on_end_handler)
@@ -117,6 +127,8 @@ class UsefulClient(commands.AutoShardedBot):
         """
         print("", end="\r")
         self.logger.info("Shutdown complete ✅")
+        # the listener thread would not get to write what is still queued
+        shutdown_logger()
         sys.exit(0)
 
     async def setup(self):
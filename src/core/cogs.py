@@ -1,8 +1,10 @@
 import logging
+from typing import Any
 
 import discord
 from discord.ext import commands
 
+from ..helper.events import emit
 from ..messages import Embedder, Dispatcher
 
 __all__ = ["UsefullCog"]
@@ -15,6 +17,8 @@ class UsefullCog(commands.GroupCog):
         self.client = client
         self.dispatcher: Dispatcher = client.dispatcher
         self.embed_builder: Embedder = client.embed_builder
+        # interactions are logged as JSON events instead of text
+        self.structured_logs: bool = client.log_format == "json"
 
         self.log = logging.getLogger(f"cogs.{self.__class__.__name__.lower()}")
 
@@ -26,7 +30,28 @@ class UsefullCog(commands.GroupCog):
         self.__loaded = True
         self.log.info("%s cog loaded !", self.__class__.__name__)
 
+    def log_event(self, interaction: discord.Interaction, event: str = "interaction", **fields: Any) -> None:
+        """
+        Log an interaction as a JSON event, along with where and by whom it was made.\\
+        `fields` may override the defaults (e.g. the `command` of a component interaction).
+        """
+        data = {
+            "guild_id": interaction.guild_id,
+            "user_id": interaction.user.id,
+            "command": interaction.command.qualified_name if interaction.command is not None else None,
+        }
+        data.update(fields)
+        emit(event, **data)
+
     def log_interaction(self, interaction: discord.Interaction, *args, **kwargs):
+        if self.structured_logs:
+            # kept apart, so that they never override the standard fields
+            self.log_event(
+                interaction,
+                args=[str(arg) for arg in args],
+                kwargs={key: str(value) for key, value in kwargs.items()},
+            )
+            return
         if len(args) == 0 and len(kwargs) == 0:
             self.log.info(
                 "[%s] %s#%s - %s",
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+__all__ = ["MemberResolver"]
+
+
+class MemberResolver:
+    """
+    Resolves guild members with as few requests as possible.
+
+    The gateway member cache is looked up first ; the remaining lookups of a guild
+    are gathered for `batch_window_ms` milliseconds and sent as a single gateway
+    member request (at most `max_batch` users each). Users found not to be members
+    are remembered for `negative_ttl` seconds ; a lookup that fails (e.g. rate limited)
+    is raised to its callers and not remembered.
+
+    ```py
+    members = MemberResolver()
+    member = await members.resolve(guild, user_id)
+    ```
+    """
+
+    max_batch = 100  # gateway limit on user ids per member request
+
+    def __init__(self, negative_ttl: float = 300, batch_window_ms: int = 50):
+        self.logger = logging.getLogger("members")
+        self.negative_ttl = negative_ttl
+        self.batch_window = max(0, batch_window_ms) / 1000
+
+        self.__missing: dict[tuple[int, int], float] = {}  # (guild_id, user_id) -> expiration time
+        self.__pending: dict[int, dict[int, asyncio.Future]] = {}  # guild_id -> user_id -> future
+
+    def forget(self, guild_id: int, user_id: int) -> None:
+        """Drop a negative result (e.g. when the user joins the guild)"""
+        self.__missing.pop((guild_id, user_id), None)
+
+    def __is_missing(self, guild_id: int, user_id: int) -> bool:
+        expires_at = self.__missing.get((guild_id, user_id))
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self.__missing[(guild_id, user_id)]
+            return False
+        return True
+
+    async def resolve(self, guild: discord.Guild, user_id: int) -> discord.Member | None:
+        """
+        Get a member of a guild.
+
+        ## Parameters
+        ```py
+        >>> guild : discord.Guild
+        ```
+        the guild to look into
+        ```py
+        >>> user_id : int
+        ```
+        the user to look for
+
+        ## Returns
+        ```py
+        discord.Member | None : the member, or `None` if the user is not in the guild
+        ```
+
+        ## Raises
+        ```py
+        discord.HTTPException : if the user could not be looked up
+        ```
+        """
+        if (member := guild.get_member(user_id)) is not None:
+            return member
+        if self.__is_missing(guild.id, user_id):
+            return None
+
+        pending = self.__pending.get(guild.id)
+        if pending is None:
+            pending = self.__pending[guild.id] = {}
+            asyncio.get_running_loop().create_task(self.__flush(guild))
+        if (future := pending.get(user_id)) is None:
+            future = pending[user_id] = asyncio.get_running_loop().create_future()
+        # shielded, a cancelled caller must not fail the others waiting on the same user
+        return await asyncio.shield(future)
+
+    async def is_member(self, guild: discord.Guild, user_id: int) -> bool:
+        return await self.resolve(guild, user_id) is not None
+
+    async def __flush(self, guild: discord.Guild) -> None:
+        await asyncio.sleep(self.batch_window)
+        pending = self.__pending.pop(guild.id)
+
+        try:
+            await self.__query(guild, pending)
+        except Exception as e:  # noqa
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    async def __query(self, guild: discord.Guild, pending: dict[int, asyncio.Future]) -> None:
+        user_ids = list(pending)
+        for i in range(0, len(user_ids), self.max_batch):
+            batch = user_ids[i : i + self.max_batch]
+            failed: dict[int, discord.HTTPException] = {}
+            try:
+                found = {
+                    member.id: member
+                    for member in await guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+                }
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                self.logger.warning("member request failed (%s), falling back to REST", e)
+                found, failed = await self.__fetch(guild, batch)
+
+            expires_at = time.monotonic() + self.negative_ttl
+            for user_id in batch:
+                if (error := failed.get(user_id)) is not None:
+                    # not known to be missing, the next lookup tries again
+                    if not pending[user_id].done():
+                        pending[user_id].set_exception(error)
+                    continue
+                member = found.get(user_id)
+                if member is None:
+                    self.__missing[(guild.id, user_id)] = expires_at
+                if not pending[user_id].done():
+                    pending[user_id].set_result(member)
+
+    @staticmethod
+    async def __fetch(
+        guild: discord.Guild, user_ids: list[int]
+    ) -> tuple[dict[int, discord.Member], dict[int, discord.HTTPException]]:
+        """Members fetched one by one, and the lookups that failed for another reason than a missing user"""
+        found, failed = {}, {}
+        for user_id in user_ids:
+            try:
+                found[user_id] = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                failed[user_id] = e
+        return found, failed
@@ -1,56 +1,132 @@
+import json
+import os
+import threading
 import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any
 
+__all__ = ["ChronoContext", "Trace", "Tracer", "TRACER"]
 
-__all__ = ["ChronoContext"]
+# innermost named chrono of the running task, tasks inherit it from the task that created them
+_current: ContextVar["ChronoContext | None"] = ContextVar("chrono_span", default=None)
 
 
 class ChronoContext:
     """
     Chrono class for measuring time. Designed to be used with `with` statement.
 
+    A named chrono is also a span : entered while another named chrono is running (in the same
+    task, or in a task created from it), it becomes a child of it and is recorded in its trace.
+
     ```py
     with ChronoContext() as cc:
         time.sleep(1)
     print(cc.elapsed)
+
+    with TRACER.trace(interaction.id, "imagine"):
+        with ChronoContext("whitelist"):
+            ...
     ```
     """
 
-    def __init__(self):
+    def __init__(self, name: str = None, **attributes: Any):
+        self.name = name
+        self.attributes = attributes
+        self.trace: Trace = None
+        self.parent: ChronoContext = None
+        self.thread_id = 0
+
         self.__start = 0
         self.__end = 0
-        self.__elapsed = 0
         self.__done = False
+        self.__token = None
 
     def __enter__(self):
-        self.__start = time.perf_counter()
+        if self.name is not None:
+            self.parent = _current.get()
+            if self.trace is None and self.parent is not None:
+                self.trace = self.parent.trace
+            self.__token = _current.set(self)
+        self.thread_id = threading.get_ident()
+        self.__start = time.perf_counter_ns()
         return self
 
     def __exit__(self, *args):
-        self.__end = time.perf_counter()
-        self.__elapsed = self.__end - self.__start
+        self.__end = time.perf_counter_ns()
         self.__done = True
+        if self.__token is not None:
+            try:
+                _current.reset(self.__token)
+            except ValueError:
+                # left from another context than the one it was entered in
+                _current.set(self.parent)
+            self.__token = None
+        if self.trace is not None:
+            self.trace.add(self)
+
+    @classmethod
+    def record(cls, name: str, start_ns: int, end_ns: int, **attributes: Any) -> "ChronoContext":
+        """
+        Record a span measured elsewhere (e.g. on a model thread) as a child of the running span.
+
+        ## Parameters
+        ```py
+        >>> name : str
+        ```
+        name of the span
+        ```py
+        >>> start_ns, end_ns : int
+        ```
+        bounds of the span, read from `time.perf_counter_ns` (or `time.perf_counter` times 1e9)
+
+        ## Returns
+        ```py
+        ChronoContext : the finished span, only kept if a span is running
+        ```
+        """
+        span = cls(name, **attributes)
+        span.parent = _current.get()
+        span.trace = span.parent.trace if span.parent is not None else None
+        span.thread_id = threading.get_ident()
+        span.__start, span.__end, span.__done = start_ns, max(start_ns, end_ns), True
+        if span.trace is not None:
+            span.trace.add(span)
+        return span
 
     @property
-    def elapsed(self):
+    def elapsed_ns(self) -> int:
         if not self.__done:
             raise RuntimeError("ChronoContext hasn't finished yet")
-        return self.__elapsed
+        return self.__end - self.__start
+
+    @property
+    def elapsed(self) -> float:
+        return self.elapsed_ns / 1e9
 
     @property
-    def start(self):
+    def start_ns(self) -> int:
         return self.__start
 
     @property
-    def end(self):
+    def end_ns(self) -> int:
         return self.__end
 
+    @property
+    def start(self) -> float:
+        return self.__start / 1e9
+
+    @property
+    def end(self) -> float:
+        return self.__end / 1e9
+
     def get_formatted_elapsed(self, fmt: str = "%H:%M:%S"):
         """
         Get formatted elapsed time.
 
         ## Parameters
         - `fmt` - str, (optional)\\
-        format for time.strftime\\
+        format for time.strftime, `%f` stands for the milliseconds\\
         defaults to `"%H:%M:%S"`
 
         ## Returns
@@ -58,4 +134,110 @@ class ChronoContext:
         """
 
         # use property so it raises error if not done
-        return time.strftime(fmt, time.gmtime(self.elapsed))
+        elapsed_ns = self.elapsed_ns
+        fmt = fmt.replace("%f", f"{elapsed_ns // 1_000_000 % 1000:03d}")
+        return time.strftime(fmt, time.gmtime(elapsed_ns // 1_000_000_000))
+
+
+class Trace:
+    """The spans of a single operation (e.g. an interaction), in the order they ended"""
+
+    def __init__(self, trace_id: int, name: str, guild_id: int = None):
+        self.id = trace_id
+        self.name = name
+        self.guild_id = guild_id  # where the operation comes from, only shown there
+        self.spans: list[ChronoContext] = []
+
+        # spans may end on the model threads
+        self.__lock = threading.Lock()
+
+    def add(self, span: ChronoContext) -> None:
+        with self.__lock:
+            self.spans.append(span)
+
+    def to_chrome(self) -> dict[str, Any]:
+        """
+        The trace as Chrome trace events, to open in `chrome://tracing` or Perfetto.\\
+        Spans are complete (`"X"`) events, nested by the viewer from their bounds on each thread.
+        """
+        pid = os.getpid()
+        with self.__lock:
+            spans = sorted(self.spans, key=lambda span: (span.start_ns, -span.end_ns))
+        events = [
+            {
+                "name": span.name,
+                "cat": self.name,
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": span.elapsed_ns / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {key: str(value) for key, value in span.attributes.items()},
+            }
+            for span in spans
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace": str(self.id)}}
+
+
+class Tracer:
+    """
+    Keeps the traces of the last `max_traces` operations, by ID.
+
+    ```py
+    with TRACER.trace(interaction.id, "imagine", guild_id=interaction.guild_id):
+        ...
+    data = TRACER.dump(interaction.id, interaction.guild_id)
+    ```
+    """
+
+    def __init__(self, max_traces: int = 256):
+        self.max_traces = max(1, max_traces)
+
+        self.__traces: OrderedDict[int, Trace] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def trace(self, trace_id: int, name: str, guild_id: int = None, **attributes: Any) -> ChronoContext:
+        """Start a trace, the returned root span is to be entered with `with`"""
+        span = ChronoContext(name, **attributes)
+        span.trace = Trace(trace_id, name, guild_id)
+        with self.__lock:
+            self.__traces[trace_id] = span.trace
+            self.__traces.move_to_end(trace_id)
+            while len(self.__traces) > self.max_traces:
+                self.__traces.popitem(last=False)
+        return span
+
+    def get(self, trace_id: int, guild_id: int = None) -> Trace | None:
+        """A trace by ID ; with a `guild_id`, only if the trace comes from that guild"""
+        with self.__lock:
+            trace = self.__traces.get(trace_id)
+        if trace is None or (guild_id is not None and trace.guild_id != guild_id):
+            return None
+        return trace
+
+    def dump(self, trace_id: int, guild_id: int = None) -> str | None:
+        """
+        Chrome trace event JSON of a trace.
+
+        ## Parameters
+        ```py
+        >>> trace_id : int
+        ```
+        ID of the trace
+        ```py
+        >>> guild_id : int, (optional)
+        ```
+        only dump the trace if it comes from this guild\\
+        defaults to `None` (any guild)
+
+        ## Returns
+        ```py
+        str | None : the JSON document, `None` if the trace is unknown (or was dropped, or comes from another
+        guild)
+        ```
+        """
+        trace = self.get(trace_id, guild_id)
+        return None if trace is None else json.dumps(trace.to_chrome(), separators=(",", ":"))
+
+
+TRACER = Tracer()
@@ -0,0 +1,44 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Any
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    HAS_ORJSON = False
+else:
+    HAS_ORJSON = True
+
+__all__ = ["EVENTS_LOGGER", "dumps", "emit", "prompt_hash"]
+
+# name of the logger of the structured events, `init_logger` sends them to their own file
+EVENTS_LOGGER = "events"
+
+_logger = logging.getLogger(EVENTS_LOGGER)
+
+
+def dumps(data: dict[str, Any]) -> str:
+    """Serialize an event on a single line, with `orjson` when it is installed"""
+    if HAS_ORJSON:
+        return orjson.dumps(data, default=str).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def prompt_hash(pprompt: str, nprompt: str = None) -> str:
+    """Short hash of a pair of prompts, to group the requests for the same image without logging the prompts"""
+    return hashlib.sha256(f"{pprompt}\0{nprompt or ''}".encode("utf-8")).hexdigest()[:16]
+
+
+def emit(event: str, **fields: Any) -> None:
+    """
+    Log an event as a JSON object, along with when it happened.
+
+    ```py
+    emit("generation", guild_id=1234, user_id=5678, queue_wait=0.25)
+    # {"ts":1700000000.0,"event":"generation","guild_id":1234,"user_id":5678,"queue_wait":0.25}
+    ```
+    """
+    if _logger.isEnabledFor(logging.INFO):
+        _logger.info("%s", dumps({"ts": round(time.time(), 3), "event": event, **fields}))
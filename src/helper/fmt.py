@@ -8,7 +8,7 @@ from typing import Any
 from termcolor import colored
 from typing_extensions import override
 
-__all__ = ["UsefulFormatter", "UselessHandler"]
+__all__ = ["UsefulFormatter", "UselessHandler", "strip_emojis"]
 
 emoji_pattern = re.compile(
     "["
@@ -34,6 +34,27 @@ emoji_pattern = re.compile(
 )
 
 
+class _EmojiTable(dict):
+    """
+    `str.translate` table deleting what `emoji_pattern` matches.\\
+    Filled as characters show up : after the first lookup of a character, it is a plain dict hit.
+    """
+
+    def __missing__(self, code: int) -> int | None:
+        value = self[code] = None if emoji_pattern.match(chr(code)) else code
+        return value
+
+
+_emoji_table = _EmojiTable()
+
+
+def strip_emojis(text: str) -> str:
+    """Remove the characters matched by `emoji_pattern`, ASCII text is returned as is"""
+    if text.isascii():
+        return text
+    return text.translate(_emoji_table)
+
+
 # hide and show cursor functions from colorama
 # someone stripped colorama to only keep these functions
 # https://stackoverflow.com/a/10455937/13708995
@@ -88,25 +109,39 @@ class UsefulFormatter(logging.Formatter):
     name_width = 10
     dt_fmt = "%Y-%m-%d %H:%M:%S"
 
+    # color (and attributes) of each level
+    level_colors = {
+        logging.DEBUG: ("green", None),
+        logging.INFO: ("blue", None),
+        logging.WARNING: ("yellow", None),
+        logging.ERROR: ("red", None),
+        logging.CRITICAL: ("red", ["bold"]),
+    }
+
     def __init__(self, *args: Any, colored_output: bool = True, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
         self.colored_output = colored_output
 
+        # formatters of the current name width, by level
+        self.__formatters: dict[int, logging.Formatter] = {}
+
+    def __formatter(self, levelno: int) -> logging.Formatter:
+        if (fmt := self.__formatters.get(levelno)) is None:
+            # levels without a color (custom ones) get the default format, as they always did
+            c, attrs = self.level_colors.get(levelno, (None, None))
+            log_fmt = None if c is None else formatter(c, self.colored_output, self.name_width, attrs)
+            fmt = self.__formatters[levelno] = logging.Formatter(log_fmt, self.dt_fmt, style="%")
+        return fmt
+
     @override
     def format(self, record: logging.LogRecord) -> str:
-        self.name_width = max(len(record.name) + 1, self.name_width)
-        formats = {
-            logging.DEBUG: formatter("green", self.colored_output, self.name_width),
-            logging.INFO: formatter("blue", self.colored_output, self.name_width),
-            logging.WARNING: formatter("yellow", self.colored_output, self.name_width),
-            logging.ERROR: formatter("red", self.colored_output, self.name_width),
-            logging.CRITICAL: formatter("red", self.colored_output, self.name_width, ["bold"]),
-        }
-        log_fmt = formats.get(record.levelno)
-        fmt = logging.Formatter(log_fmt, self.dt_fmt, style="%")
-        if not self.colored_output:
-            record.msg = emoji_pattern.sub("", record.msg)
-        return fmt.format(record)
+        if len(record.name) + 1 > self.name_width:
+            # names are only ever aligned to the longest one seen so far
+            self.name_width = len(record.name) + 1
+            self.__formatters.clear()
+        if not self.colored_output and isinstance(record.msg, str):
+            record.msg = strip_emojis(record.msg)
+        return self.__formatter(record.levelno).format(record)
 
 
 class UselessHandler(logging.StreamHandler):
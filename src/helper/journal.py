@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+from collections.abc import Callable
+from typing import Any, TextIO
+
+__all__ = ["Journal"]
+
+
+def _fsync_directory(filename: str) -> None:
+    """Make a rename in the directory of a file durable (not possible, nor needed, on Windows)"""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """
+    Append-only persistence for a dict of records.
+
+    Every mutation is appended as one JSON line to `{filename}.journal` ; once the
+    journal holds `compact_every` mutations, it is folded into the snapshot
+    (`filename`), written to a temporary file and atomically renamed over the old one.
+    Loading reads the snapshot then replays the journal, a line cut short by a crash
+    is ignored.
+
+    ```py
+    journal = Journal("whitelist.json", key=lambda record: record["user_id"])
+    records = journal.load()
+    journal.put({"user_id": 42, "perms": 1})
+    journal.delete(42)
+    ```
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        key: Callable[[dict[str, Any]], Any],
+        decode: Callable[[TextIO], list[dict[str, Any]]] = json.load,
+        encode: Callable[[list[dict[str, Any]]], str] = json.dumps,
+        compact_every: int = 256,
+    ):
+        self.logger = logging.getLogger("journal")
+        self.filename = filename
+        self.journal_filename = f"{filename}.journal"
+        self.compact_every = max(1, compact_every)
+
+        self.__key = key
+        self.__decode = decode
+        self.__encode = encode
+        self.__records: dict[Any, dict[str, Any]] = {}
+        self.__pending = 0
+        self.__file: TextIO = None
+
+    def __len__(self) -> int:
+        return len(self.__records)
+
+    def load(self) -> dict[Any, dict[str, Any]]:
+        """
+        Read the snapshot and replay the journal on top of it.
+
+        ## Returns
+        ```py
+        dict[Any, dict[str, Any]] : the records by key
+        ```
+
+        ## Raises
+        ```py
+        FileNotFoundError : if there is neither a snapshot nor a journal
+        ```
+        """
+        found = False
+        records: dict[Any, dict[str, Any]] = {}
+        if os.path.exists(self.filename):
+            found = True
+            with open(self.filename, "r", encoding="utf-8") as f:
+                records = {self.__key(record): record for record in self.__decode(f)}
+
+        pending, damaged = 0, False
+        if os.path.exists(self.journal_filename):
+            found = True
+            with open(self.journal_filename, "r", encoding="utf-8") as f:
+                for n, line in enumerate(f, 1):
+                    try:
+                        # a line without its newline was cut short, even if what is there parses
+                        if not line.endswith("\n"):
+                            raise ValueError("missing newline")
+                        mutation = json.loads(line)
+                    except ValueError:
+                        self.logger.warning(
+                            "ignoring a truncated mutation at %s:%d", self.journal_filename, n
+                        )
+                        damaged = True
+                        break
+                    self.__apply(records, mutation)
+                    pending += 1
+
+        if not found:
+            raise FileNotFoundError(self.filename)
+
+        self.__records = records
+        self.__pending = pending
+        if pending > 0 or damaged:
+            # start from a clean journal ; a truncated tail must go, the next mutation would be appended to it
+            self.compact()
+        return dict(records)
+
+    def __apply(self, records: dict[Any, dict[str, Any]], mutation: dict[str, Any]) -> None:
+        match mutation["op"]:
+            case "put":
+                records[self.__key(mutation["record"])] = mutation["record"]
+            case "delete":
+                records.pop(mutation["key"], None)
+
+    def __append(self, mutations: list[dict[str, Any]]) -> None:
+        for mutation in mutations:
+            self.__apply(self.__records, mutation)
+        if self.__file is None:
+            self.__file = open(self.journal_filename, "a", encoding="utf-8")
+        self.__file.write(
+            "".join(json.dumps(mutation, separators=(",", ":")) + "\n" for mutation in mutations)
+        )
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+        self.__pending += len(mutations)
+        if self.__pending >= self.compact_every:
+            self.compact()
+
+    def put(self, record: dict[str, Any]) -> None:
+        """Insert or replace a record"""
+        self.__append([{"op": "put", "record": record}])
+
+    def put_many(self, records: list[dict[str, Any]]) -> None:
+        """Insert or replace several records with a single write"""
+        self.__append([{"op": "put", "record": record} for record in records])
+
+    def delete(self, key: Any) -> None:
+        """Remove the record stored under a key"""
+        self.__append([{"op": "delete", "key": key}])
+
+    def reset(self, records: list[dict[str, Any]]) -> None:
+        """Replace every record at once"""
+        self.__records = {self.__key(record): record for record in records}
+        self.compact()
+
+    def compact(self) -> None:
+        """Fold the journal into a new snapshot"""
+        tmp = f"{self.filename}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.__encode(list(self.__records.values())))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+        _fsync_directory(self.filename)
+
+        # the snapshot now holds every mutation, the journal can start over
+        if self.__file is not None:
+            self.__file.close()
+        self.__file = open(self.journal_filename, "w", encoding="utf-8")
+        self.__pending = 0
+
+    def close(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
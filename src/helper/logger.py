@@ -1,10 +1,17 @@
+import atexit
 import logging
 import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
+from .events import EVENTS_LOGGER
 from .fmt import UsefulFormatter, UselessHandler
 
-__all__ = ["init_logger"]
+__all__ = ["DroppingQueueHandler", "init_logger", "shutdown_logger"]
+
+# started by `init_logger`, writes the records to the console and the log file on its own thread
+_listener: QueueListener = None
 
 try:
     import colorama  # type: ignore
@@ -57,19 +64,89 @@ def supports_color():
     )
 
 
-def init_logger(log_lvl: int = logging.INFO) -> bool:
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands the records over to a `QueueListener` without ever blocking for long.
+
+    When the queue is full, records below `block_level` (errors by default) are dropped right away,
+    the others wait up to `block_timeout` seconds for some room before being dropped too.
+    The number of dropped records is logged as soon as there is room again.
+    """
+
+    def __init__(self, queue_: queue.Queue, block_level: int = logging.ERROR, block_timeout: float = 1):
+        super().__init__(queue_)
+        self.block_level = block_level
+        self.block_timeout = block_timeout
+        self.dropped = 0
+
+    def __put(self, record: logging.LogRecord) -> bool:
+        try:
+            if record.levelno >= self.block_level:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            return False
+        return True
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped > 0:
+            dropped = logging.LogRecord(
+                "logger", logging.WARNING, __file__, 0, "%d log records dropped", (self.dropped,), None
+            )
+            if self.__put(self.prepare(dropped)):
+                self.dropped = 0
+        if not self.__put(record):
+            self.dropped += 1
+
+
+class _BlockingSentinelListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # the listener keeps draining the queue, so there is room for the sentinel soon enough
+        self.queue.put(self._sentinel)
+
+
+def init_logger(
+    log_lvl: int = logging.INFO,
+    log_file: str = ".log",
+    max_bytes: int = 10 * 1024**2,
+    backup_count: int = 5,
+    queue_size: int = 10_000,
+    events_file: str = None,
+) -> bool:
     """
     Initializes the logger for the application\\
     This sets the global configuration for the logger
 
+    Records are only queued by the thread that logs them, a listener thread writes them to the
+    console and to the log file ; so that a slow disk or terminal never stalls the event loop.
+    The log file is rolled over when it gets bigger than `max_bytes` and on every start.
+
     ## Parameters
     - `log_lvl` - int, (optional)
     the logging level (see `logging` module for more info)
     defaults to `logging.INFO`
+    - `log_file` - str, (optional)
+    the log file, previous ones are kept as `{log_file}.1` to `{log_file}.{backup_count}`
+    defaults to `".log"`
+    - `max_bytes` - int, (optional)
+    size of the log file before it is rolled over, 0 to never roll it over while running
+    defaults to 10 MB
+    - `backup_count` - int, (optional)
+    number of previous log files to keep
+    defaults to `5`
+    - `queue_size` - int, (optional)
+    number of records that may wait for the listener, see `DroppingQueueHandler`
+    defaults to `10_000`
+    - `events_file` - str, (optional)
+    file the structured events (see `events.emit`) are appended to, one JSON object per line,
+    instead of being logged along with the rest ; rolled over like the log file but not on start
+    defaults to `None` (logged along with the rest)
 
     ## Returns
     - bool - if color is supported for the console
     """
+    global _listener
     colored_output = supports_color()
 
     # create console handler with a higher log level
@@ -78,13 +155,58 @@ def init_logger(log_lvl: int = logging.INFO) -> bool:
     console_handler.setFormatter(UsefulFormatter(colored_output=colored_output))
 
     # create file handler which logs even debug messages
-    file_handler = logging.FileHandler(".log", mode="w", encoding="utf-8")
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+    )
+    if os.path.exists(log_file) and os.path.getsize(log_file) > 0:
+        # one file per run, as long as it fits
+        file_handler.doRollover()
     file_handler.setLevel(logging.DEBUG)  # lowest level to log
     file_handler.setFormatter(UsefulFormatter(colored_output=False))
 
+    handlers: list[logging.Handler] = [console_handler, file_handler]
+    if events_file is not None:
+        events_handler = RotatingFileHandler(
+            events_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+        )
+        events_handler.setFormatter(logging.Formatter("%(message)s"))
+        events_handler.addFilter(lambda record: record.name == EVENTS_LOGGER)
+        console_handler.addFilter(lambda record: record.name != EVENTS_LOGGER)
+        file_handler.addFilter(lambda record: record.name != EVENTS_LOGGER)
+        handlers.append(events_handler)
+
+    records = queue.Queue(max(1, queue_size))
+    _listener = _BlockingSentinelListener(records, *handlers)
+    _listener.start()
+
+    # only merges the arguments (and the traceback) into the message, the listener does the rest
+    queue_handler = DroppingQueueHandler(records)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
     logging.basicConfig(
         level=log_lvl,
         style="%",
-        handlers=[console_handler, file_handler],
+        handlers=[queue_handler],
     )
+    atexit.register(shutdown_logger)
     return colored_output
+
+
+def shutdown_logger() -> None:
+    """
+    Write out the queued records and flush the log file, on the way out.\\
+    Records logged afterwards are written right away, by the thread that logs them.
+    """
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    for handler in listener.handlers:
+        handler.flush()
+        root.addHandler(handler)
@@ -0,0 +1,247 @@
+import bisect
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from aiohttp import web
+
+__all__ = ["Counter", "Gauge", "Histogram", "MetricsRegistry", "REGISTRY", "start_metrics_server"]
+
+# seconds, from a cache hit to a full generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+
+        # observations come from the event loop and from the model threads alike
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """The metric in the Prometheus text exposition format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self.__values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.__values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self.__values.items():
+            yield f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+
+
+class Gauge(_Metric):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self.__values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.__values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        return self.__values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self.__values.items():
+            yield f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets.
+
+    A bucket counts the observations lower than or equal to its upper bound ;
+    quantiles (e.g. the p95 latency) are estimated from the buckets by the scraper.
+
+    ```py
+    latency = Histogram("request_seconds", "Time spent on requests", ("route",))
+    with latency.time(route="edit"):
+        ...
+    ```
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values : one count per bucket then one for +Inf, sum, count
+        self.__values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if (values := self.__values.get(key)) is None:
+                values = self.__values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            counts, totals = values
+            counts[i] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the time (in seconds) spent in a `with` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        values = self.__values.get(self._key(labels))
+        return 0 if values is None else values[1][1]
+
+    def _samples(self) -> Iterator[str]:
+        for key, (counts, (total, n)) in self.__values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts, strict=True):
+                cumulative += count
+                le = _labels(self.label_names, key, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {n}"
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, by name.
+
+    Metrics are declared where they are measured, asking twice for the same name
+    gives back the same metric.
+
+    ```py
+    jobs = REGISTRY.counter("pixelia_jobs_total", "Generation jobs by outcome", ("outcome",))
+    jobs.inc(outcome="ok")
+    print(REGISTRY.render())
+    ```
+    """
+
+    def __init__(self):
+        self.__metrics: dict[str, _Metric] = {}
+        self.__lock = threading.Lock()
+
+    def __get(self, cls: type[_Metric], name: str, *args, **kwargs) -> _Metric:
+        with self.__lock:
+            if (metric := self.__metrics.get(name)) is None:
+                metric = self.__metrics[name] = cls(name, *args, **kwargs)
+        if not isinstance(metric, cls):
+            raise ValueError(f"metric {name} is already a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.__get(Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self.__get(Gauge, name, description, labels)
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.__get(Histogram, name, description, labels, buckets)
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+async def start_metrics_server(
+    host: str = "127.0.0.1", port: int = 9100, registry: MetricsRegistry = REGISTRY
+) -> web.AppRunner:
+    """
+    Serve the metrics of a registry on `http://{host}:{port}/metrics`.
+
+    ## Returns
+    ```py
+    web.AppRunner : the running server, `await runner.cleanup()` stops it
+    ```
+    """
+
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.getLogger("metrics").info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
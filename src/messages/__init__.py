@@ -1,5 +1,6 @@
 from .timestamps import *
 
+from .outbound import *
 from .dispatcher import *
 from .embedder import *
 from .custom_view import *
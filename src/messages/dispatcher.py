@@ -1,18 +1,41 @@
-from collections.abc import Coroutine
+import io
+from collections.abc import Awaitable, Coroutine
 from typing import Any
 
 from arrow import Arrow
 import discord
 
+from .outbound import OutboundScheduler
 from .timestamps import format_timestamp as ft
 
 __all__ = ["Dispatcher"]
 
 
 class Dispatcher:
+    """
+    Sends messages on behalf of the cogs.
 
-    def __init__(self):
-        pass
+    First responses to an interaction are sent right away (Discord only gives a few
+    seconds for them) ; every later request (edits, followups, channel messages) goes
+    through an `OutboundScheduler`, one bucket per interaction message, channel message
+    or channel, so that repeated edits of a message are coalesced and spaced out.
+    """
+
+    def __init__(self, outbound: OutboundScheduler = None):
+        self.outbound = outbound if outbound is not None else OutboundScheduler()
+
+    @staticmethod
+    def __interaction_route(interaction: discord.Interaction) -> str:
+        return f"interaction:{interaction.id}"
+
+    @staticmethod
+    def __channel_route(channel: discord.abc.Messageable) -> str:
+        return f"channel:{channel.id}"
+
+    @staticmethod
+    def __message_route(msg_id: int) -> str:
+        # edits of different messages of a channel must not replace each other
+        return f"message:{msg_id}"
 
     def __send_embed(
         self,
@@ -28,7 +51,11 @@ class Dispatcher:
         interaction: discord.Interaction,
         embed: discord.Embed,
     ):
-        return interaction.edit_original_response(embed=embed)
+        return self.outbound.submit(
+            self.__interaction_route(interaction),
+            lambda: interaction.edit_original_response(embed=embed),
+            coalesce=True,
+        )
 
     def reply_with_embed(
         self,
@@ -59,9 +86,10 @@ class Dispatcher:
         self,
         interaction: discord.Interaction,
         embed: discord.Embed,
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
+    ) -> Awaitable[discord.InteractionMessage]:
         """
-        edit the reply with an embed
+        edit the reply with an embed\\
+        a pending edit of the same reply is replaced by this one
 
         ## Parameters
         ```py
@@ -75,7 +103,7 @@ class Dispatcher:
 
         ## Returns
         ```py
-        Coroutine[Any, Any, discord.InteractionMessage] : the coroutine that sends the embed
+        Awaitable[discord.InteractionMessage] : resolved once the reply is edited
         ```
         """
         return self.__edit_embed(interaction, embed)
@@ -119,6 +147,69 @@ class Dispatcher:
                 embed.description = r
         return self.__send_embed(interaction, embed, ephemeral=True, delete_after=s if not failed else None)
 
+    def followup_with_status_embed(
+        self,
+        interaction: discord.Interaction,
+        embed: discord.Embed,
+    ) -> Awaitable[discord.WebhookMessage]:
+        """
+        send an ephemeral status embed to an interaction that was already responded to
+
+        ## Parameters
+        ```py
+        >>> interaction : discord.Interaction
+        ```
+        original interaction
+        ```py
+        >>> embed : discord.Embed
+        ```
+        embed to send
+
+        ## Returns
+        ```py
+        Awaitable[discord.WebhookMessage] : resolved once the embed is sent
+        ```
+        """
+        return self.outbound.submit(
+            self.__interaction_route(interaction),
+            lambda: interaction.followup.send(embed=embed, ephemeral=True),
+        )
+
+    def followup_with_embed_and_files(
+        self,
+        interaction: discord.Interaction,
+        embed: discord.Embed,
+        files: list[discord.File],
+    ) -> Awaitable[discord.WebhookMessage]:
+        """
+        send an ephemeral embed with attached files to an interaction that was already responded to
+
+        ## Parameters
+        ```py
+        >>> interaction : discord.Interaction
+        ```
+        original interaction
+        ```py
+        >>> embed : discord.Embed
+        ```
+        embed to send
+        ```py
+        >>> files : list[discord.File]
+        ```
+        files to attach
+
+        ## Returns
+        ```py
+        Awaitable[discord.WebhookMessage] : resolved once the embed is sent
+        ```
+        """
+        # uploaded files can not be sent twice, so no retry
+        return self.outbound.submit(
+            self.__interaction_route(interaction),
+            lambda: interaction.followup.send(embed=embed, files=files, ephemeral=True),
+            retry=False,
+        )
+
     def send_status_embed(
         self,
         interaction: discord.Interaction,
@@ -157,7 +248,10 @@ class Dispatcher:
             except TypeError:
                 embed.description = r
         channel = interaction.channel
-        return channel.send(embed=embed, delete_after=s if not failed else None)
+        return self.outbound.submit(
+            self.__channel_route(channel),
+            lambda: channel.send(embed=embed, delete_after=s if not failed else None),
+        )
 
     def send_poll_embed(
         self,
@@ -193,7 +287,7 @@ class Dispatcher:
         self,
         interaction: discord.Interaction,
         embed: discord.Embed,
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
+    ) -> Awaitable[discord.WebhookMessage]:
         """
         send a poll followup embed
 
@@ -209,18 +303,25 @@ class Dispatcher:
 
         ## Returns
         ```py
-        Coroutine[Any, Any, discord.InteractionMessage] : the coroutine that sends the embed
+        Awaitable[discord.WebhookMessage] : resolved once the embed is sent
         ```
         """
-        return interaction.followup.send(embed=embed, ephemeral=True)
+        return self.outbound.submit(
+            self.__interaction_route(interaction),
+            lambda: interaction.followup.send(embed=embed, ephemeral=True),
+        )
 
     def reply_files(
         self,
         user: discord.User,
         interaction: discord.InteractionMessage,
         files: list[discord.File],
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
-        return interaction.reply(content=user.mention, files=files)
+    ) -> Awaitable[discord.Message]:
+        return self.outbound.submit(
+            self.__channel_route(interaction.channel),
+            lambda: interaction.reply(content=user.mention, files=files),
+            retry=False,
+        )
 
     def send_embed_and_view(
         self,
@@ -247,11 +348,66 @@ class Dispatcher:
         embed: discord.Embed,
         view: discord.ui.View,
         files: list[discord.File] = None,
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
+    ) -> Awaitable[discord.InteractionMessage]:
 
         if files is not None:
-            return interaction.edit_original_response(embed=embed, view=view, attachments=files)
-        return interaction.edit_original_response(embed=embed, view=view)
+            return self.edit_embed_view_and_files(interaction, embed, view, files)
+        return self.outbound.submit(
+            self.__interaction_route(interaction),
+            lambda: interaction.edit_original_response(embed=embed, view=view),
+            coalesce=True,
+        )
+
+    def edit_embed_with_image(
+        self,
+        interaction: discord.Interaction,
+        embed: discord.Embed,
+        image: bytes,
+        filename: str,
+        view: discord.ui.View = None,
+    ) -> Awaitable[discord.InteractionMessage]:
+        """
+        edit the reply with an embed and a single attached image (e.g. a preview)\\
+        a pending edit of the same reply is replaced by this one, so the image must not
+        be one that has to be delivered
+
+        ## Parameters
+        ```py
+        >>> interaction : discord.Interaction
+        ```
+        original interaction
+        ```py
+        >>> embed : discord.Embed
+        ```
+        embed to send
+        ```py
+        >>> image : bytes
+        ```
+        content of the image, replaces the attachments of the reply
+        ```py
+        >>> filename : str
+        ```
+        name of the attachment, for the embed to refer to it
+        ```py
+        >>> view : discord.ui.View, (optional)
+        ```
+        view to set\\
+        defaults to `None` (the view is left as is)
+
+        ## Returns
+        ```py
+        Awaitable[discord.InteractionMessage] : resolved once the reply is edited
+        ```
+        """
+        kwargs = {} if view is None else {"view": view}
+        return self.outbound.submit(
+            self.__interaction_route(interaction),
+            # a new file for each attempt, so the edit can be retried
+            lambda: interaction.edit_original_response(
+                embed=embed, attachments=[discord.File(io.BytesIO(image), filename)], **kwargs
+            ),
+            coalesce=True,
+        )
 
     def edit_embed_view_and_files(
         self,
@@ -259,33 +415,42 @@ class Dispatcher:
         embed: discord.Embed,
         view: discord.ui.View,
         files: list[discord.File],
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
+    ) -> Awaitable[discord.InteractionMessage]:
 
-        return interaction.edit_original_response(embed=embed, view=view, attachments=files)
+        # never coalesced, a later edit without attachments must not drop these
+        return self.outbound.submit(
+            self.__interaction_route(interaction),
+            lambda: interaction.edit_original_response(embed=embed, view=view, attachments=files),
+            retry=not files,
+        )
 
-    def send_channel_message(
-        self, channel: discord.TextChannel, message: str
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
-        return channel.send(message)
+    def send_channel_message(self, channel: discord.TextChannel, message: str) -> Awaitable[discord.Message]:
+        return self.outbound.submit(self.__channel_route(channel), lambda: channel.send(message))
 
     def edit_channel_message(
         self, channel: discord.TextChannel, message: str, msg_id: int
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
-        return channel.edit_message(message, msg_id)
+    ) -> Awaitable[discord.Message]:
+        return self.outbound.submit(
+            self.__message_route(msg_id), lambda: channel.edit_message(message, msg_id), coalesce=True
+        )
 
     def send_channel_file(
         self, channel: discord.TextChannel, file: discord.File
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
-        return channel.send(file=file)
+    ) -> Awaitable[discord.Message]:
+        return self.outbound.submit(
+            self.__channel_route(channel), lambda: channel.send(file=file), retry=False
+        )
 
     async def await_channel_file(
         self, channel: discord.TextChannel, file: discord.File, message: str = None
     ) -> None:
         if message:
-            await channel.send(message)
-        await channel.send(file=file)
+            await self.send_channel_message(channel, message)
+        await self.send_channel_file(channel, file)
 
     def send_channel_event(
         self, channel: discord.TextChannel, embed: discord.Embed, content: str = None
-    ) -> Coroutine[Any, Any, discord.InteractionMessage]:
-        return channel.send(content=content or "", embed=embed)
+    ) -> Awaitable[discord.Message]:
+        return self.outbound.submit(
+            self.__channel_route(channel), lambda: channel.send(content=content or "", embed=embed)
+        )
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+import discord
+
+from ..helper.metrics import REGISTRY
+
+__all__ = ["OutboundScheduler"]
+
+_waits = REGISTRY.histogram("pixelia_outbound_wait_seconds", "Time requests waited to be sent", ("route",))
+_latencies = REGISTRY.histogram("pixelia_outbound_seconds", "Time spent sending requests", ("route",))
+_rate_limits = REGISTRY.counter("pixelia_outbound_rate_limited_total", "Requests rate limited", ("route",))
+
+
+@dataclass(eq=False)
+class _Request:
+    factory: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    coalesce: bool = False
+    retry: bool = True
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+
+@dataclass(eq=False)
+class _Bucket:
+    queue: deque[_Request] = field(default_factory=deque)
+    worker: asyncio.Task = None
+    next_at: float = 0  # loop time before which the route must not be hit again
+
+
+class OutboundScheduler:
+    """
+    Sends requests to Discord one route at a time.
+
+    Requests made to the same route (e.g. the same interaction message) are sent in order,
+    at most once every `interval` seconds. A coalescible request (typically an edit)
+    that is still waiting when a newer coalescible request shows up for the same route is
+    replaced by it : both callers get the outcome of the newer one. Requests that hit a
+    rate limit are retried with an exponential backoff.
+
+    ```py
+    outbound = OutboundScheduler(interval=1)
+    message = await outbound.submit(route, lambda: interaction.edit_original_response(embed=embed), True)
+    ```
+    """
+
+    def __init__(self, interval: float = 1, max_retries: int = 5, backoff: float = 0.5):
+        self.logger = logging.getLogger("outbound")
+        self.interval = max(0, interval)
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+
+        self.__buckets: dict[str, _Bucket] = {}
+
+    def submit(
+        self,
+        route: str,
+        factory: Callable[[], Awaitable[Any]],
+        coalesce: bool = False,
+        retry: bool = True,
+    ) -> asyncio.Future:
+        """
+        Schedule a request.
+
+        ## Parameters
+        ```py
+        >>> route : str
+        ```
+        key of the rate limit bucket the request belongs to
+        ```py
+        >>> factory : Callable[[], Awaitable[Any]]
+        ```
+        makes the request, called once per attempt
+        ```py
+        >>> coalesce : bool, (optional)
+        ```
+        if the request may be replaced by a newer coalescible one for the same route\\
+        defaults to `False`
+        ```py
+        >>> retry : bool, (optional)
+        ```
+        if the request can be made again after a rate limit (not the case when it uploads files)\\
+        defaults to `True`
+
+        ## Returns
+        ```py
+        asyncio.Future : resolved with the outcome of the request
+        ```
+        """
+        bucket = self.__buckets.setdefault(route, _Bucket())
+        if coalesce and bucket.queue and bucket.queue[-1].coalesce:
+            # only the last waiting request is replaced, so that requests are never reordered
+            pending = bucket.queue[-1]
+            pending.factory, pending.retry = factory, retry
+            return pending.future
+
+        request = _Request(factory, asyncio.get_running_loop().create_future(), coalesce, retry)
+        bucket.queue.append(request)
+        if bucket.worker is None:
+            bucket.worker = asyncio.get_running_loop().create_task(self.__drain(route, bucket))
+        return request.future
+
+    async def __drain(self, route: str, bucket: _Bucket) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # also waits after the last request, so that a request made right after is spaced out too
+            if (delay := bucket.next_at - loop.time()) > 0:
+                await asyncio.sleep(delay)
+            if not bucket.queue:
+                break
+            request = bucket.queue.popleft()
+            # "edit:1234" and "reply:5678" are both observed by kind, not one series per message
+            kind = route.split(":", 1)[0]
+            _waits.observe(time.perf_counter() - request.submitted_at, route=kind)
+            try:
+                with _latencies.time(route=kind):
+                    result = await self.__send(request, kind)
+            except Exception as e:  # noqa
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                if not request.future.done():
+                    request.future.set_result(result)
+            bucket.next_at = loop.time() + self.interval
+
+        bucket.worker = None
+        del self.__buckets[route]
+
+    async def __send(self, request: _Request, kind: str) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await request.factory()
+            except (discord.RateLimited, discord.HTTPException) as e:
+                if isinstance(e, discord.HTTPException) and e.status != 429:
+                    raise
+                _rate_limits.inc(route=kind)
+                if not request.retry or attempt >= self.max_retries:
+                    raise
+                delay = max(getattr(e, "retry_after", 0), self.backoff * 2**attempt)
+                self.logger.warning("rate limited, retrying in %.2fs", delay)
+                await asyncio.sleep(delay)
+                attempt += 1
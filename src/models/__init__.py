@@ -1 +1,8 @@
 from .diffusion_model import *
+from .embedding_cache import *
+from .encoding import *
+from .pool import *
+from .preview import *
+from .queue import *
+from .result_cache import *
+from .worker import *
@@ -1,15 +1,173 @@
 import asyncio
+import io
 import logging
 import os
-from threading import Lock
+import random
+import struct
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Any
 
+import numpy as np
 import torch
 from diffusers import DiffusionPipeline
 from PIL import Image
 
 from ..helper.chrono import ChronoContext
+from ..helper.metrics import REGISTRY
+from .embedding_cache import EmbeddingCache, PromptEmbeds
+from .encoding import EncodedImage, ImageEncoder
+from .preview import LatentPreviewer
+from .queue import GenerationQueue, Job, JobCancelledError
+from .result_cache import ResultCache
+from .scheduler import BatchScheduler
 
-__all__ = ["DiffusionModel"]
+__all__ = ["DiffusionModel", "GenerationProgress", "GenerationRequest", "GenerationResult", "WarmupShape"]
+
+_jobs = REGISTRY.counter("pixelia_jobs_total", "Generation jobs by outcome", ("model", "outcome"))
+_queue_wait = REGISTRY.histogram("pixelia_job_queue_seconds", "Time jobs waited in the queue", ("model",))
+_compute = REGISTRY.histogram("pixelia_job_compute_seconds", "Time jobs spent running", ("model",))
+_stages = REGISTRY.histogram("pixelia_stage_seconds", "Time a batch spent in a stage", ("model", "stage"))
+_batch_sizes = REGISTRY.histogram(
+    "pixelia_batch_size", "Jobs per batch", ("model",), buckets=(1, 2, 3, 4, 6, 8, 12, 16)
+)
+_queue_depth = REGISTRY.gauge("pixelia_queue_depth", "Jobs waiting for a model", ("model",))
+
+
+def track_job(job: Job, model: str) -> Job:
+    """Count a job and observe its queue wait and compute time once it is done"""
+
+    def done(future: asyncio.Future) -> None:
+        if future.cancelled() or isinstance(future.exception(), JobCancelledError):
+            outcome = "dropped"
+        elif future.exception() is not None:
+            outcome = "failed"
+        else:
+            outcome = "cached" if future.result().cached else "ok"
+        _jobs.inc(model=model, outcome=outcome)
+        if job.started_at is not None:
+            _queue_wait.observe(job.wait_time, model=model)
+            if outcome in {"ok", "cached"}:
+                _compute.observe(time.perf_counter() - job.started_at, model=model)
+
+    job.future.add_done_callback(done)
+    return job
+
+
+def observe_batch(model: str, queue: GenerationQueue, size: int) -> None:
+    """Observe the size of a batch taken from a queue and what is left in the queue"""
+    _batch_sizes.observe(size, model=model)
+    _queue_depth.set(len(queue), model=model)
+
+
+def observe_stages(model: str, timings: dict[str, float]) -> None:
+    """Observe the time (in seconds) a batch spent in each stage"""
+    for stage, elapsed in timings.items():
+        _stages.observe(elapsed, model=model, stage=stage)
+
+
+def observe_submit(model: str, queue: GenerationQueue) -> None:
+    """Observe the depth of a queue after a job was submitted to it"""
+    _queue_depth.set(len(queue), model=model)
+
+
+def _use_compile_cache(directory: str) -> None:
+    """Keep what `torch.compile` produces on disk, so that a restart reuses it instead of compiling again"""
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    # read by inductor and triton when they first compile, explicit environment variables win
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", directory)
+    os.environ.setdefault("TRITON_CACHE_DIR", os.path.join(directory, "triton"))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    try:
+        from torch._inductor import config as inductor_config
+    except ImportError:
+        return
+    # the environment is only read when inductor is first imported
+    if hasattr(inductor_config, "fx_graph_cache"):
+        inductor_config.fx_graph_cache = os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] == "1"
+
+
+@dataclass
+class WarmupShape:
+    """A shape to compile the pipelines for at startup"""
+
+    batch_size: int = 1
+    steps: int = 4  # the graphs do not depend on it, a few steps are enough to compile and record them
+    width: int = None  # `None` for the native resolution of the model
+    height: int = None
+
+    @classmethod
+    def from_dict(cls, data: dict[str, int]) -> "WarmupShape":
+        return cls(data.get("batch_size", 1), data.get("steps", 4), data.get("width"), data.get("height"))
+
+    def __str__(self) -> str:
+        size = "native" if self.width is None and self.height is None else f"{self.width}x{self.height}"
+        return f"{size} x{self.batch_size} ({self.steps} steps)"
+
+
+@dataclass
+class GenerationProgress:
+    """Denoising progress of a job : `step` steps done out of the `total` steps of a stage"""
+
+    stage: str  # "base" or "refiner"
+    step: int
+    total: int
+    preview: bytes = field(default=None, repr=False)  # JPEG preview of the latents, if enabled
+
+    @property
+    def fraction(self) -> float:
+        return self.step / self.total if self.total > 0 else 1
+
+
+@dataclass
+class GenerationRequest:
+    pprompt: str
+    nprompt: str = None
+    seed: int = None
+    cache_key: str = None
+    # called on the event loop with the progress of the job, see `DiffusionModel.submit`
+    on_progress: Callable[[GenerationProgress], None] = field(default=None, repr=False)
+
+
+@dataclass
+class GenerationResult:
+    """A generated image, PNG encoded, with the seed that produced it"""
+
+    png: bytes
+    seed: int
+    cached: bool = False  # if the image comes from the result cache
+    _image: Image.Image = field(default=None, repr=False)
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image is None:
+            self._image = Image.open(io.BytesIO(self.png))
+            self._image.load()
+        return self._image
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """Width and height of the image, read from the PNG header when it is not decoded"""
+        if self._image is not None:
+            return self._image.size
+        return struct.unpack(">II", self.png[16:24])
+
+    def encode(self, encoder: ImageEncoder) -> EncodedImage:
+        """Encode the image for delivery (blocking, reuses the decoded image when there is one)"""
+        return encoder.encode(self.png, self.image)
+
+
+@dataclass
+class _Handoff:
+    """A batch that went through the base stage and waits for the refiner"""
+
+    jobs: list[Job]
+    latents: torch.Tensor
+    futures: list[asyncio.Future]
 
 
 class DiffusionModel:
@@ -21,26 +179,47 @@ class DiffusionModel:
         lora_weights: str = None,
         cpu_offload: bool = False,
         fp: int = 16,
+        max_batch_size: int = 4,
+        max_batch_wait_ms: int = 50,
+        max_queue_depth: int = 32,
+        pipelined: bool = True,
+        embedding_cache: EmbeddingCache = None,
+        result_cache: ResultCache = None,
+        encoder: ImageEncoder = None,
+        progress_interval: float = 0.5,
+        preview_size: int = 0,
+        compile_cache_dir: str = None,
     ):
         self.logger = logging.getLogger("diffusion_model")
         self.name = name
         self.refiner = refiner
         self.weights = lora_weights
         self.cpu_offload = cpu_offload
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache()
+        self.result_cache = result_cache
+        self.encoder = encoder if encoder is not None else ImageEncoder()
+        self.fp = fp
+        self.progress_interval = max(0, progress_interval)
+        self.preview_size = max(0, preview_size)
+
+        if compile_cache_dir is not None and os.name != "nt":
+            _use_compile_cache(compile_cache_dir)
 
         variant = "fp16" if fp == 16 else "fp32"
         torch_type = torch.float16 if fp == 16 else torch.float32
 
-        self.__lock = Lock()
-        self.__counter_lock = Lock()
-        self.__counter = 0
+        self.__scheduler = BatchScheduler(
+            self.__run_batch, GenerationQueue(max_queue_depth), max_batch_size, max_batch_wait_ms
+        )
         self.__cuda_available = torch.cuda.is_available()
         self.__refiner = None
+        self.__refiner_previewer: LatentPreviewer = None
         self.__base = DiffusionPipeline.from_pretrained(
             self.name, torch_dtype=torch_type, variant=variant, use_safetensors=True
         )
         if self.weights is not None:
             self.__base.load_lora_weights(self.weights)
+        self.__base_previewer = self.__make_previewer(self.__base)
         if self.__cuda_available:
             if self.cpu_offload:
                 self.__base.enable_model_cpu_offload()
@@ -58,6 +237,7 @@ class DiffusionModel:
                 use_safetensors=True,
                 variant=variant,
             )
+            self.__refiner_previewer = self.__make_previewer(self.__refiner)
             if self.__cuda_available:
                 if self.cpu_offload:
                     self.__refiner.enable_model_cpu_offload()
@@ -72,50 +252,484 @@ class DiffusionModel:
         self.__n_steps = 40
         self.__high_noise_frac = 0.8
 
+        # each stage runs on its own thread so that the refiner can work on a batch
+        # while the base model already works on the next one ; offloaded models share
+        # their hooks and devices, so they are kept sequential
+        self.pipelined = pipelined and self.__refiner is not None and not self.cpu_offload
+        self.__base_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="base")
+        self.__refiner_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refiner")
+        self.__handoff: asyncio.Queue[_Handoff] = None
+        self.__refiner_worker: asyncio.Task = None
+        self.__loop: asyncio.AbstractEventLoop = None  # where the progress of the jobs is published
+        # previews are encoded off the denoising thread
+        self.__preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+        self.__stage_timings: dict[str, deque[float]] = {
+            "base": deque(maxlen=32),
+            "refiner": deque(maxlen=32),
+        }
+
+    @property
+    def queue(self) -> GenerationQueue:
+        """Jobs waiting for the model"""
+        return self.__scheduler.queue
+
     @property
-    def counter(self) -> int:
-        """Current queue size"""
-        with self.__counter_lock:
-            return self.__counter
+    def idle(self) -> bool:
+        """If no job is waiting for or running on the model"""
+        return len(self.queue) == 0 and self.queue.running == 0
+
+    @property
+    def memory_footprint(self) -> int:
+        """Memory (in bytes) taken by the weights of the pipelines"""
+        modules = {
+            id(module): module
+            for pipe in (self.__base, self.__refiner)
+            if pipe is not None
+            for module in pipe.components.values()
+            if isinstance(module, torch.nn.Module)
+        }
+        return sum(p.element_size() * p.nelement() for m in modules.values() for p in m.parameters())
+
+    def offload(self) -> None:
+        """Move the pipelines to the CPU to free the GPU memory (blocking)"""
+        # the cached embeddings live on the device the model ran on, they are cheap to compute again
+        self.embedding_cache.discard(*self.__embedding_models)
+        if not self.__cuda_available or self.cpu_offload:
+            return
+        for pipe in (self.__base, self.__refiner):
+            if pipe is not None:
+                pipe.to("cpu")
+        torch.cuda.empty_cache()
+
+    def onload(self) -> None:
+        """Move the pipelines back to the GPU after an `offload` (blocking)"""
+        if not self.__cuda_available or self.cpu_offload:
+            return
+        for pipe in (self.__base, self.__refiner):
+            if pipe is not None:
+                pipe.to("cuda")
+
+    def close(self) -> None:
+        """Stop the scheduler and the stage threads, pending jobs are left unresolved"""
+        self.__scheduler.close()
+        self.embedding_cache.discard(*self.__embedding_models)
+        self.__base_executor.shutdown(wait=False, cancel_futures=True)
+        self.__refiner_executor.shutdown(wait=False, cancel_futures=True)
+        self.__preview_executor.shutdown(wait=False, cancel_futures=True)
+        if self.__refiner_worker is not None:
+            self.__refiner_worker.cancel()
 
-    def __generate(self, pprompt: str, nprompt: str = None) -> Image.Image:
-        images = None
+    @property
+    def stage_timings(self) -> dict[str, float]:
+        """Average time (in seconds) spent in each stage over the last batches"""
+        return {stage: sum(t) / len(t) for stage, t in self.__stage_timings.items() if len(t) > 0}
+
+    @property
+    def __embedding_models(self) -> tuple[str, ...]:
+        """Names of the base model (with its LoRA weights) and of the refiner in the embedding cache"""
+        base = self.name if self.weights is None else f"{self.name}+{self.weights}"
+        return (base,) if self.refiner is None else (base, self.refiner)
+
+    def __record(self, stage: str, jobs: list[Job], elapsed: float) -> None:
+        self.__stage_timings[stage].append(elapsed)
+        observe_stages(self.name, {stage: elapsed})
+        for job in jobs:
+            job.timings[stage] = elapsed
+
+    def __encode(
+        self, pipe: DiffusionPipeline, model: str, prompts: list[str], negative: bool = False
+    ) -> dict[str, torch.Tensor]:
+        """
+        Encode a batch of prompts, reusing the cached embeddings of the prompts seen before.\\
+        Like the pipeline, empty negative prompts get zeroed embeddings when it forces them (SDXL).
+        """
+        encoders = "+".join(
+            type(encoder).__name__
+            for encoder in (getattr(pipe, "text_encoder", None), getattr(pipe, "text_encoder_2", None))
+            if encoder is not None
+        )
+        zeros_for_empty = negative and pipe.config.get("force_zeros_for_empty_prompt", False)
+        embeds: list[PromptEmbeds] = []
+        for prompt in prompts:
+            zeros = zeros_for_empty and prompt == ""
+            key = (model, f"{encoders}/zeros" if zeros else encoders, prompt)
+            if (cached := self.embedding_cache.get(key)) is None:
+                # without guidance the pipeline only encodes the given prompt
+                with torch.no_grad():
+                    out = pipe.encode_prompt(
+                        prompt=prompt,
+                        device=pipe._execution_device,
+                        num_images_per_prompt=1,
+                        do_classifier_free_guidance=False,
+                    )
+                prompt_embeds, pooled = out[0], out[2] if len(out) == 4 else None
+                if zeros:
+                    # only the shapes of the encoded empty prompt are kept
+                    prompt_embeds = torch.zeros_like(prompt_embeds)
+                    pooled = None if pooled is None else torch.zeros_like(pooled)
+                cached = self.embedding_cache.put(key, PromptEmbeds(prompt_embeds, pooled))
+            embeds.append(cached)
+
+        batch = {"prompt_embeds": torch.cat([e.prompt_embeds for e in embeds])}
+        if embeds[0].pooled_prompt_embeds is not None:
+            batch["pooled_prompt_embeds"] = torch.cat([e.pooled_prompt_embeds for e in embeds])
+        return batch
+
+    def __prompt_kwargs(
+        self, pipe: DiffusionPipeline, model: str, pprompts: list[str], nprompts: list[str]
+    ) -> dict[str, torch.Tensor]:
+        positive = self.__encode(pipe, model, pprompts)
+        negative = self.__encode(pipe, model, nprompts, negative=True)
+        return positive | {f"negative_{name}": tensor for name, tensor in negative.items()}
+
+    @staticmethod
+    def __prompts(jobs: list[Job]) -> tuple[list[str], list[str]]:
+        # the pipeline wants one negative prompt per positive prompt, never `None` in a list
+        return [job.request.pprompt for job in jobs], [job.request.nprompt or "" for job in jobs]
+
+    @staticmethod
+    def __generators(jobs: list[Job]) -> list[torch.Generator]:
+        # cpu generators give the same noise whatever the device the model runs on
+        return [torch.Generator("cpu").manual_seed(job.request.seed) for job in jobs]
+
+    def __make_previewer(self, pipe: DiffusionPipeline) -> LatentPreviewer | None:
+        if self.preview_size == 0:
+            return None
+        previewer = LatentPreviewer.for_pipeline(pipe, self.preview_size)
+        if previewer is None:
+            self.logger.warning("no latent preview for %s, progress is published without previews", pipe)
+        return previewer
+
+    @staticmethod
+    def __publish(
+        loop: asyncio.AbstractEventLoop,
+        subscribers: dict[int, Callable[[GenerationProgress], None]],
+        progress: GenerationProgress,
+        previewer: LatentPreviewer = None,
+        latents: np.ndarray = None,
+    ) -> None:
+        for i, subscriber in subscribers.items():
+            if previewer is not None:
+                progress = replace(progress, preview=previewer(latents[i]))
+            loop.call_soon_threadsafe(subscriber, progress)
+
+    def __progress_callback(self, stage: str, jobs: list[Job], marks: dict[str, float]) -> Callable:
+        """
+        Step end callback of a pass, publishes the progress of the jobs that have a subscriber
+        and marks the end of the denoising in `marks["denoised"]`
+        """
+        subscribers = {i: job.request.on_progress for i, job in enumerate(jobs) if job.request.on_progress}
+        previewer = self.__base_previewer if stage == "base" else self.__refiner_previewer
+        loop, last = self.__loop, 0.0
+
+        def callback(pipe: DiffusionPipeline, step: int, timestep: int, kwargs: dict) -> dict:
+            nonlocal last
+            # runs between two denoising steps : when throttled, this is only a clock read
+            now, total = time.perf_counter(), pipe.num_timesteps
+            if step + 1 == total:
+                # all that is left for the pass is decoding the latents
+                marks["denoised"] = now
+            if not subscribers or (step + 1 < total and now - last < self.progress_interval):
+                return kwargs
+            last = now
+            progress = GenerationProgress(stage, step + 1, total)
+            if previewer is None:
+                self.__publish(loop, subscribers, progress)
+                return kwargs
+            # the copy waits for the step to be done on the device, which the next step does anyway ;
+            # the previews are then made on their own thread while the denoising goes on
+            latents = kwargs["latents"].float().cpu().numpy()
+            self.__preview_executor.submit(self.__publish, loop, subscribers, progress, previewer, latents)
+            return kwargs
+
+        return callback
+
+    def __record_decode(self, jobs: list[Job], marks: dict[str, float], end: float) -> None:
+        """Time spent decoding the latents, part of the time of the last stage"""
+        if (denoised := marks.get("denoised")) is None:
+            return
+        observe_stages(self.name, {"decode": end - denoised})
+        for job in jobs:
+            job.timings["decode"] = end - denoised
+
+    def __base_pass(self, jobs: list[Job]) -> tuple[list[Image.Image], float]:
+        start, marks = time.perf_counter(), {}
+        pprompts, nprompts = self.__prompts(jobs)
+        prompt_kwargs = self.__prompt_kwargs(self.__base, self.__embedding_models[0], pprompts, nprompts)
+        callback = self.__progress_callback("base", jobs, marks)
         match self.refiner:
             case None:
-                with self.__lock:
-                    images = self.__base(prompt=pprompt, negative_prompt=nprompt).images
+                images = self.__base(
+                    **prompt_kwargs, generator=self.__generators(jobs), callback_on_step_end=callback
+                ).images
             case str(_):
-                with self.__lock:
-                    images = self.__base(
-                        prompt=pprompt,
-                        negative_prompt=nprompt,
-                        num_inference_steps=self.__n_steps,
-                        denoising_end=self.__high_noise_frac,
-                        output_type="latent",
-                    ).images
-                    images = self.__refiner(
-                        prompt=nprompt,
-                        negative_prompt=nprompt,
-                        num_inference_steps=self.__n_steps,
-                        denoising_start=self.__high_noise_frac,
-                        image=images,
-                    ).images
+                images = self.__base(
+                    **prompt_kwargs,
+                    generator=self.__generators(jobs),
+                    callback_on_step_end=callback,
+                    num_inference_steps=self.__n_steps,
+                    denoising_end=self.__high_noise_frac,
+                    output_type="latent",
+                ).images
             case _:
                 raise ValueError("Refiner must be a string or None")
+        end = time.perf_counter()
+        if self.refiner is None:
+            self.__record_decode(jobs, marks, end)
+        return images, end - start
+
+    def __refine_pass(self, jobs: list[Job], latents: torch.Tensor) -> tuple[list[Image.Image], float]:
+        start, marks = time.perf_counter(), {}
+        pprompts, nprompts = self.__prompts(jobs)
+        prompt_kwargs = self.__prompt_kwargs(self.__refiner, self.refiner, pprompts, nprompts)
+        images = self.__refiner(
+            **prompt_kwargs,
+            generator=self.__generators(jobs),
+            callback_on_step_end=self.__progress_callback("refiner", jobs, marks),
+            num_inference_steps=self.__n_steps,
+            denoising_start=self.__high_noise_frac,
+            image=latents,
+        ).images
+        end = time.perf_counter()
+        self.__record_decode(jobs, marks, end)
+        return images, end - start
+
+    def __finish(self, jobs: list[Job], images: list[Image.Image]) -> list[GenerationResult]:
+        """Encode the images and store them in the result cache"""
+        results = []
+        for job, image in zip(jobs, images, strict=True):
+            result = GenerationResult(self.encoder.png(image), job.request.seed, _image=image)
+            if self.result_cache is not None:
+                self.result_cache.put(job.request.cache_key, result.png)
+            results.append(result)
+        return results
+
+    def __generate(self, jobs: list[Job]) -> list[GenerationResult]:
+        images, elapsed = self.__base_pass(jobs)
+        self.__record("base", jobs, elapsed)
+        if self.__refiner is not None:
+            images, elapsed = self.__refine_pass(jobs, images)
+            self.__record("refiner", jobs, elapsed)
+        return self.__finish(jobs, images)
+
+    def __refine(self, handoff: _Handoff) -> list[GenerationResult]:
+        images, elapsed = self.__refine_pass(handoff.jobs, handoff.latents)
+        self.__record("refiner", handoff.jobs, elapsed)
+        return self.__finish(handoff.jobs, images)
+
+    def __ensure_refiner_worker(self) -> None:
+        if self.__handoff is None:
+            # a single batch may wait for the refiner, the base stage blocks beyond that
+            self.__handoff = asyncio.Queue(maxsize=1)
+        if self.__refiner_worker is None or self.__refiner_worker.done():
+            self.__refiner_worker = asyncio.get_running_loop().create_task(self.__run_refiner())
+
+    async def __run_refiner(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            handoff = await self.__handoff.get()
+            try:
+                results = await loop.run_in_executor(self.__refiner_executor, self.__refine, handoff)
+            except Exception as e:  # noqa
+                for future in handoff.futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(handoff.futures, results, strict=True):
+                future.set_result(result)
 
-        return images[0]
+    async def __run_batch(self, jobs: list[Job]) -> list[GenerationResult | asyncio.Future]:
+        loop = self.__loop = asyncio.get_running_loop()
+        observe_batch(self.name, self.queue, len(jobs))
+        if not self.pipelined:
+            return await loop.run_in_executor(self.__base_executor, self.__generate, jobs)
 
-    async def query(self, pprompt: str, nprompt: str = None) -> Image.Image:
+        self.__ensure_refiner_worker()
+        latents, elapsed = await loop.run_in_executor(self.__base_executor, self.__base_pass, jobs)
+        self.__record("base", jobs, elapsed)
+
+        futures = [loop.create_future() for _ in jobs]
+        await self.__handoff.put(_Handoff(jobs, latents, futures))
+        return futures
+
+    @property
+    def cache_params(self) -> dict[str, Any]:
+        """Parameters of the model that change the image, part of the result cache key of every request"""
+        return {
+            "model": self.name,
+            "lora_weights": self.weights,
+            "refiner": self.refiner,
+            "fp": self.fp,
+            "steps": self.__n_steps,
+            "high_noise_frac": self.__high_noise_frac,
+        }
+
+    def cache_key(self, request: GenerationRequest) -> str:
+        """Key of a request in the result cache, built from every parameter that changes the image"""
+        return ResultCache.key(
+            **self.cache_params, pprompt=request.pprompt, nprompt=request.nprompt or "", seed=request.seed
+        )
+
+    async def __from_cache(self, job: Job) -> None:
+        data = await asyncio.to_thread(self.result_cache.get, job.request.cache_key)
+        if job.done:
+            return
+        if data is None:
+            # evicted in the meantime, generate it after all
+            try:
+                self.__scheduler.submit(job)
+            except Exception as e:  # noqa
+                job.future.set_exception(e)
+            return
+        job.future.set_result(GenerationResult(data, job.request.seed, cached=True))
+
+    def submit(
+        self,
+        pprompt: str,
+        nprompt: str = None,
+        priority: int = 1,
+        expires_at: float = None,
+        seed: int = None,
+        on_progress: Callable[[GenerationProgress], None] = None,
+    ) -> Job:
+        """
+        Enqueue a generation job without waiting for it.
+
+        ## Parameters
+        ```py
+        >>> pprompt : str
+        ```
+        positive prompt
+        ```py
+        >>> nprompt : str, (optional)
+        ```
+        negative prompt
+        ```py
+        >>> priority : int, (optional)
+        ```
+        jobs with a higher priority are served first\\
+        defaults to `1`
+        ```py
+        >>> expires_at : float, (optional)
+        ```
+        unix timestamp after which the job is dropped if it has not started yet\\
+        defaults to `None` (never expires)
+        ```py
+        >>> seed : int, (optional)
+        ```
+        seed of the random noise, the same request with the same seed gives the same image\\
+        defaults to `None` (a random seed)
+        ```py
+        >>> on_progress : Callable[[GenerationProgress], None], (optional)
+        ```
+        called on the event loop as the denoising goes, at most once every `progress_interval`
+        seconds per stage (and always on the last step) ; never called for a cached result\\
+        defaults to `None`
+
+        ## Returns
+        ```py
+        Job : the job, await it to get the `GenerationResult`
+        ```
+
+        ## Raises
+        ```py
+        QueueFullError : if too many jobs are already waiting
+        ```
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+        request = GenerationRequest(pprompt, nprompt, seed, on_progress=on_progress)
+        request.cache_key = self.cache_key(request)
+        job = track_job(Job(request, priority, expires_at), self.name)
+
+        if self.result_cache is not None and request.cache_key in self.result_cache:
+            job.started_at = time.perf_counter()
+            asyncio.get_running_loop().create_task(self.__from_cache(job))
+            return job
+        self.__scheduler.submit(job)
+        observe_submit(self.name, self.queue)
+        return job
+
+    def position(self, job: Job) -> int:
+        """Position of a job in the queue (0 if it is not waiting anymore)"""
+        return self.queue.position(job)
+
+    async def query(
+        self,
+        pprompt: str,
+        nprompt: str = None,
+        priority: int = 1,
+        expires_at: float = None,
+        seed: int = None,
+        on_progress: Callable[[GenerationProgress], None] = None,
+    ) -> GenerationResult:
         """Query the model with a positive and negative prompt"""
-        with self.__counter_lock:
-            self.__counter += 1
-        res = await asyncio.to_thread(self.__generate, pprompt, nprompt)
-        with self.__counter_lock:
-            self.__counter -= 1
-        return res
-
-    async def warmup(self) -> None:
-        """Warmup the model"""
+        return await self.submit(pprompt, nprompt, priority, expires_at, seed, on_progress)
+
+    def __warmup_kwargs(self, shape: WarmupShape) -> dict:
+        kwargs = {"generator": [torch.Generator("cpu").manual_seed(i) for i in range(shape.batch_size)]}
+        if shape.width is not None:
+            kwargs["width"] = shape.width
+        if shape.height is not None:
+            kwargs["height"] = shape.height
+        return kwargs
+
+    def __warmup_base(self, shape: WarmupShape) -> torch.Tensor | None:
+        pprompts, nprompts = ["warmup"] * shape.batch_size, [""] * shape.batch_size
+        prompt_kwargs = self.__prompt_kwargs(self.__base, self.__embedding_models[0], pprompts, nprompts)
+        if self.__refiner is None:
+            self.__base(**prompt_kwargs, **self.__warmup_kwargs(shape), num_inference_steps=shape.steps)
+            return None
+        return self.__base(
+            **prompt_kwargs,
+            **self.__warmup_kwargs(shape),
+            num_inference_steps=shape.steps,
+            denoising_end=self.__high_noise_frac,
+            output_type="latent",
+        ).images
+
+    def __warmup_refiner(self, shape: WarmupShape, latents: torch.Tensor) -> None:
+        pprompts, nprompts = ["warmup"] * shape.batch_size, [""] * shape.batch_size
+        prompt_kwargs = self.__prompt_kwargs(self.__refiner, self.refiner, pprompts, nprompts)
+        kwargs = self.__warmup_kwargs(shape)
+        # the size comes from the latents
+        kwargs.pop("width", None)
+        kwargs.pop("height", None)
+        self.__refiner(
+            **prompt_kwargs,
+            **kwargs,
+            num_inference_steps=shape.steps,
+            denoising_start=self.__high_noise_frac,
+            image=latents,
+        )
+
+    async def warmup(self, plan: list[WarmupShape] = None) -> None:
+        """
+        Compile the pipelines for every shape of a warmup plan, the timing of each shape is logged.
+
+        `torch.compile` specializes on the shapes it sees, so a batch size or a resolution that was not
+        warmed up is compiled again by the first request that uses it.
+
+        ## Parameters
+        ```py
+        >>> plan : list[WarmupShape], (optional)
+        ```
+        shapes to compile for, each runs once straight on the pipelines (not through the queue)\\
+        defaults to `None` (every batch size up to the maximum, at the native resolution)
+        """
+        if plan is None:
+            plan = [WarmupShape(batch_size) for batch_size in range(1, self.__scheduler.max_batch_size + 1)]
+        loop = asyncio.get_running_loop()
         with ChronoContext() as cc:
-            await self.query("test")
-        self.logger.info("Warmup took %s", cc.get_formatted_elapsed("%Mm %Ss"))
+            for shape in plan:
+                with ChronoContext() as shape_cc:
+                    latents = await loop.run_in_executor(self.__base_executor, self.__warmup_base, shape)
+                    if latents is not None:
+                        # on the refiner thread, the stage may already serve requests
+                        await loop.run_in_executor(
+                            self.__refiner_executor, self.__warmup_refiner, shape, latents
+                        )
+                self.logger.info("  %s: %.2fs", shape, shape_cc.elapsed)
+        self.logger.info("Warmup of %d shape(s) took %s", len(plan), cc.get_formatted_elapsed("%Mm %Ss"))
+        self.logger.debug("Prompt embedding cache: %s", self.embedding_cache.stats)
+        if self.result_cache is not None:
+            self.logger.debug("Result cache: %s", self.result_cache.stats)
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+
+import torch
+
+from ..helper.metrics import REGISTRY
+
+__all__ = ["PromptEmbeds", "EmbeddingCache"]
+
+_lookups = REGISTRY.counter("pixelia_cache_lookups_total", "Cache lookups by outcome", ("cache", "outcome"))
+
+
+@dataclass
+class PromptEmbeds:
+    """Text encoder outputs for a single prompt"""
+
+    prompt_embeds: torch.Tensor
+    pooled_prompt_embeds: torch.Tensor = None  # only for pipelines with a pooled text encoder (SDXL)
+
+    @property
+    def nbytes(self) -> int:
+        size = self.prompt_embeds.element_size() * self.prompt_embeds.nelement()
+        if self.pooled_prompt_embeds is not None:
+            size += self.pooled_prompt_embeds.element_size() * self.pooled_prompt_embeds.nelement()
+        return size
+
+
+class EmbeddingCache:
+    """
+    LRU cache of prompt embeddings keyed by `(model, text encoder, prompt)`.\\
+    Least recently used entries are evicted once the cache holds more than `max_bytes`.
+    The cache is thread safe since the pipeline stages run on their own threads.
+
+    ```py
+    cache = EmbeddingCache(max_bytes=256 * 1024**2)
+    embeds = cache.get(key)
+    if embeds is None:
+        embeds = cache.put(key, encode(prompt))
+    ```
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024**2):
+        self.max_bytes = max(0, max_bytes)
+
+        self.__entries: OrderedDict[tuple[str, str, str], PromptEmbeds] = OrderedDict()
+        self.__lock = Lock()
+        self.__size = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @property
+    def size(self) -> int:
+        """Memory (in bytes) held by the cached tensors"""
+        return self.__size
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self.__lock:
+            return {
+                "entries": len(self.__entries),
+                "bytes": self.__size,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions,
+            }
+
+    def get(self, key: tuple[str, str, str]) -> PromptEmbeds | None:
+        """Get the embeddings stored for a key, counting a hit or a miss"""
+        with self.__lock:
+            embeds = self.__entries.get(key)
+            if embeds is None:
+                self.__misses += 1
+                _lookups.inc(cache="embeddings", outcome="miss")
+                return None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            _lookups.inc(cache="embeddings", outcome="hit")
+            return embeds
+
+    def put(self, key: tuple[str, str, str], embeds: PromptEmbeds) -> PromptEmbeds:
+        """
+        Store embeddings, evicting the least recently used entries if needed.
+
+        ## Returns
+        ```py
+        PromptEmbeds : the stored embeddings
+        ```
+        """
+        size = embeds.nbytes
+        with self.__lock:
+            if size > self.max_bytes:
+                # would evict everything else and still not fit
+                return embeds
+
+            if (previous := self.__entries.pop(key, None)) is not None:
+                self.__size -= previous.nbytes
+            self.__entries[key] = embeds
+            self.__size += size
+
+            while self.__size > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__size -= evicted.nbytes
+                self.__evictions += 1
+        return embeds
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+
+    def discard(self, *models: str) -> int:
+        """
+        Drop the embeddings of some models (e.g. to free the device memory they hold once
+        the models are offloaded).
+
+        ## Returns
+        ```py
+        int : how many entries were dropped
+        ```
+        """
+        with self.__lock:
+            keys = [key for key in self.__entries if key[0] in models]
+            for key in keys:
+                self.__size -= self.__entries.pop(key).nbytes
+            return len(keys)
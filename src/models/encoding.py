@@ -0,0 +1,154 @@
+import io
+import math
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from ..helper.metrics import REGISTRY
+
+__all__ = ["EncodedImage", "ImageEncoder"]
+
+_encode_seconds = REGISTRY.histogram("pixelia_encode_seconds", "Time spent encoding an image", ("format",))
+
+
+@dataclass
+class EncodedImage:
+    """An image encoded for delivery, along with a small preview of it"""
+
+    data: bytes
+    extension: str
+    thumbnail: bytes
+    thumbnail_extension: str
+
+    @property
+    def filename(self) -> str:
+        return f"image.{self.extension}"
+
+    @property
+    def thumbnail_filename(self) -> str:
+        return f"thumbnail.{self.thumbnail_extension}"
+
+
+class ImageEncoder:
+    """
+    Encodes generated images into in-memory buffers.
+
+    Images are stored (and cached) as PNG, `encode` then produces what is actually
+    sent : the full image in the configured format (the PNG bytes are reused as is
+    when the format is PNG) and a thumbnail of at most `thumbnail_size` pixels per side.
+
+    Encoding is CPU bound, call `png` and `encode` from a worker thread.
+
+    ```py
+    encoder = ImageEncoder("webp", quality=90)
+    encoded = await asyncio.to_thread(encoder.encode, png)
+    ```
+    """
+
+    # format name -> file extension
+    formats = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+
+    def __init__(
+        self,
+        format: str = "png",  # noqa
+        quality: int = 90,
+        png_compress_level: int = 6,
+        thumbnail_size: int = 256,
+    ):
+        if format not in self.formats:
+            raise ValueError(f"unsupported image format {format}")
+        self.format = format
+        self.quality = min(max(1, quality), 100)
+        self.png_compress_level = min(max(0, png_compress_level), 9)
+        self.thumbnail_size = max(16, thumbnail_size)
+
+    def __save(self, image: Image.Image, format: str, quality: int) -> bytes:  # noqa
+        buffer = io.BytesIO()
+        with _encode_seconds.time(format=format):
+            match format:
+                case "png":
+                    image.save(buffer, "PNG", compress_level=self.png_compress_level)
+                case "webp":
+                    image.save(buffer, "WEBP", quality=quality, method=4)
+                case "jpeg":
+                    image.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True)
+        return buffer.getvalue()
+
+    @property
+    def thumbnail_format(self) -> str:
+        # a lossy thumbnail is a fraction of the size of a PNG one and only ever shown small
+        return "jpeg" if self.format == "jpeg" else "webp"
+
+    @property
+    def thumbnail_extension(self) -> str:
+        return self.formats[self.thumbnail_format]
+
+    def png(self, image: Image.Image) -> bytes:
+        """Encode an image as PNG, the lossless format results are stored in"""
+        return self.__save(image, "png", self.quality)
+
+    def encode(self, png: bytes, image: Image.Image = None) -> EncodedImage:
+        """
+        Encode an image and its thumbnail.
+
+        ## Parameters
+        ```py
+        >>> png : bytes
+        ```
+        the image, PNG encoded
+        ```py
+        >>> image : Image.Image, (optional)
+        ```
+        the decoded image, if already at hand\\
+        defaults to `None` (decoded from `png`)
+
+        ## Returns
+        ```py
+        EncodedImage : the encoded image and thumbnail
+        ```
+        """
+        if image is None:
+            image = Image.open(io.BytesIO(png))
+            image.load()
+
+        data = png if self.format == "png" else self.__save(image, self.format, self.quality)
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        return EncodedImage(
+            data,
+            self.formats[self.format],
+            self.__save(thumbnail, self.thumbnail_format, min(self.quality, 80)),
+            self.thumbnail_extension,
+        )
+
+    def grid(self, images: list[Image.Image]) -> bytes:
+        """
+        Lay thumbnails of several images out in a grid, from left to right then top to bottom.
+
+        Every cell is `thumbnail_size` pixels on its longest side (the size of the first image
+        sets the shape of the cells), the grid is encoded like a thumbnail.
+
+        ## Parameters
+        ```py
+        >>> images : list[Image.Image]
+        ```
+        the images, usually variants of the same request
+
+        ## Returns
+        ```py
+        bytes : the encoded grid, see `thumbnail_extension`
+        ```
+        """
+        columns = math.ceil(math.sqrt(len(images)))
+        rows = math.ceil(len(images) / columns)
+        scale = self.thumbnail_size / max(images[0].size)
+        width, height = max(1, round(images[0].width * scale)), max(1, round(images[0].height * scale))
+
+        cells = np.zeros((rows * columns, height, width, 3), dtype=np.uint8)
+        for i, image in enumerate(images):
+            cells[i] = np.asarray(image.convert("RGB").resize((width, height), Image.BILINEAR))
+        # (rows, columns, height, width, 3) -> (rows * height, columns * width, 3)
+        grid = cells.reshape(rows, columns, height, width, 3).swapaxes(1, 2).reshape(rows * height, -1, 3)
+        return self.__save(Image.fromarray(grid, "RGB"), self.thumbnail_format, min(self.quality, 80))
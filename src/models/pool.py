@@ -0,0 +1,370 @@
+import asyncio
+import gc
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+import torch
+
+from ..helper.auto_numbered import AutoNumberedEnum
+from ..helper.chrono import ChronoContext
+from .diffusion_model import DiffusionModel
+
+__all__ = ["ModelSpec", "ModelState", "ModelPool"]
+
+
+class ModelState(AutoNumberedEnum):
+    """Where a model of the pool stands"""
+
+    UNLOADED = ()  # never loaded, or evicted
+    LOADING = ()  # weights being loaded (or moved back to the device)
+    WARMING = ()  # loaded, being compiled by the warmup
+    READY = ()
+    FAILED = ()  # the last load failed, the next `get` tries again
+
+
+@dataclass
+class ModelSpec:
+    """What to load for a named model of the pool"""
+
+    name: str
+    model: str
+    refiner: str = None
+    lora_weights: str = None
+
+    @classmethod
+    def from_dict(cls, name: str, data: dict[str, str]) -> "ModelSpec":
+        return cls(name, data["model"], data.get("refiner"), data.get("lora_weights"))
+
+
+@dataclass
+class _Slot:
+    spec: ModelSpec
+    model: DiffusionModel = None
+    resident: bool = False  # if the model is ready to be used on its device
+    loading: asyncio.Task = None
+    state: ModelState = ModelState.UNLOADED
+    since: float = field(default_factory=time.monotonic)  # when the slot entered its state
+    error: Exception = None  # why the last load failed
+    leases: int = 0  # callers about to submit jobs, the model is not evicted meanwhile
+
+    @property
+    def claimed(self) -> bool:
+        """If the model holds (or is about to hold) device memory"""
+        return self.resident or self.state in {ModelState.LOADING, ModelState.WARMING}
+
+
+class ModelPool:
+    """
+    Registry of named diffusion models, loaded on first use.
+
+    At most `max_resident` models (and, if set, `memory_budget` bytes of weights)
+    are kept ready at once ; the least recently used idle models are evicted
+    to make room, either to the CPU (`evict_to="cpu"`, fast to bring back) or
+    entirely (`evict_to="disk"`, reloaded from the Hugging Face cache).
+
+    Loading happens off the event loop and concurrent requests for a model
+    being loaded all wait on the same load. A freshly loaded model goes through
+    `warmup` (if given) before it is handed out ; the time each step took is
+    remembered (in `timings_file` if given, across restarts) to estimate when
+    a model will be ready.
+
+    Models being loaded count towards `max_resident`, and a model handed out by
+    `acquire` is not evicted until it is `release`d (once its jobs are submitted,
+    it is busy anyway).
+
+    ```py
+    pool = ModelPool(specs, factory, default="base")
+    model = await pool.acquire("base")
+    try:
+        job = model.submit(prompt)
+    finally:
+        pool.release("base")
+    ```
+    """
+
+    def __init__(
+        self,
+        specs: list[ModelSpec],
+        factory: Callable[[ModelSpec], DiffusionModel],
+        default: str,
+        max_resident: int = 1,
+        memory_budget: int = 0,
+        evict_to: str = "disk",
+        warmup: Callable[[DiffusionModel], Awaitable[None]] = None,
+        timings_file: str = None,
+    ):
+        if evict_to not in {"cpu", "disk"}:
+            raise ValueError("models can only be evicted to 'cpu' or 'disk'")
+
+        self.logger = logging.getLogger("model_pool")
+        self.default = default
+        self.max_resident = max(1, max_resident)
+        self.memory_budget = max(0, memory_budget)
+        self.evict_to = evict_to
+
+        self.__factory = factory
+        self.__warmup = warmup
+        self.__timings_file = timings_file
+        # model name -> step ("loading", "onloading", "warming") -> seconds
+        self.__timings: dict[str, dict[str, float]] = {}
+        if timings_file is not None and os.path.exists(timings_file):
+            try:
+                with open(timings_file, "r", encoding="utf-8") as f:
+                    self.__timings = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning("Could not read the model timings: %s", e)
+        # ordered from the least to the most recently used
+        self.__slots: OrderedDict[str, _Slot] = OrderedDict((spec.name, _Slot(spec)) for spec in specs)
+        # making room and claiming it go together, so that concurrent loads do not both take the last place
+        self.__admission = asyncio.Lock()
+        # set (and replaced) whenever a model may have become evictable
+        self.__changed = asyncio.Event()
+        if default not in self.__slots:
+            raise ValueError(f"default model {default} is not part of the pool")
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.__slots)
+
+    @property
+    def resident(self) -> list[str]:
+        return [name for name, slot in self.__slots.items() if slot.resident]
+
+    def is_resident(self, name: str = None) -> bool:
+        return self.__slot(name).resident
+
+    def state(self, name: str = None) -> ModelState:
+        return self.__slot(name).state
+
+    def error(self, name: str = None) -> Exception | None:
+        """Why the last load of a model failed"""
+        return self.__slot(name).error
+
+    def eta(self, name: str = None) -> float | None:
+        """
+        Estimate the time left before a model is ready.
+
+        ## Returns
+        ```py
+        float | None : seconds (0 once overdue or ready), `None` if there is nothing to go by
+        ```
+        """
+        slot = self.__slot(name)
+        match slot.state:
+            case ModelState.READY:
+                return 0
+            case ModelState.WARMING:
+                steps = ["warming"]
+            case ModelState.FAILED:
+                return None
+            case _:
+                fresh = slot.model is None
+                steps = ["loading" if fresh else "onloading"]
+                if fresh and self.__warmup is not None:
+                    steps.append("warming")
+
+        timings = self.__timings.get(slot.spec.name, {})
+        if any(step not in timings for step in steps):
+            return None
+        remaining = sum(timings[step] for step in steps)
+        if slot.state in {ModelState.LOADING, ModelState.WARMING}:
+            remaining -= time.monotonic() - slot.since
+        return max(0, remaining)
+
+    def start(self, name: str = None) -> None:
+        """Start loading a model in the background, without waiting for it"""
+        slot = self.__slot(name)
+        if slot.resident or (slot.loading is not None and not slot.loading.done()):
+            return
+        slot.loading = asyncio.get_running_loop().create_task(self.__load(slot))
+        # the failure is logged and kept in the slot, there might be no one waiting for it
+        slot.loading.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    def __enter(self, slot: _Slot, state: ModelState) -> None:
+        slot.state, slot.since = state, time.monotonic()
+        self.__signal()
+
+    def __signal(self) -> None:
+        """Wake up the loads waiting for room"""
+        self.__changed.set()
+        self.__changed = asyncio.Event()
+
+    async def __signal_when_idle(self, model: DiffusionModel) -> None:
+        await model.queue.wait_idle()
+        self.__signal()
+
+    async def __record(self, slot: _Slot, step: str, elapsed: float) -> None:
+        self.__timings.setdefault(slot.spec.name, {})[step] = elapsed
+        if self.__timings_file is None:
+            return
+
+        def save() -> None:
+            os.makedirs(os.path.dirname(self.__timings_file) or ".", exist_ok=True)
+            with open(self.__timings_file, "w", encoding="utf-8") as f:
+                json.dump(self.__timings, f)
+
+        try:
+            await asyncio.to_thread(save)
+        except OSError as e:
+            self.logger.warning("Could not save the model timings: %s", e)
+
+    def __slot(self, name: str = None) -> _Slot:
+        try:
+            return self.__slots[name or self.default]
+        except KeyError as e:
+            raise KeyError(f"unknown model {name}") from e
+
+    def __footprint(self) -> int:
+        return sum(slot.model.memory_footprint for slot in self.__slots.values() if slot.resident)
+
+    async def get(self, name: str = None) -> DiffusionModel:
+        """
+        Get a model ready to be used, loading it (and evicting others) if needed.
+
+        ## Parameters
+        ```py
+        >>> name : str, (optional)
+        ```
+        name of the model in the pool\\
+        defaults to `None` (the default model)
+
+        ## Returns
+        ```py
+        DiffusionModel : the loaded model
+        ```
+
+        ## Raises
+        ```py
+        KeyError : if the model is not part of the pool
+        ```
+        """
+        slot = self.__slot(name)
+        self.__slots.move_to_end(slot.spec.name)
+        # waiting callers hold a lease, a concurrent load must not evict the model before they get it
+        slot.leases += 1
+        try:
+            while not slot.resident:
+                self.start(slot.spec.name)
+                # shield the shared load from the cancellation of a single caller
+                await asyncio.shield(slot.loading)
+        finally:
+            self.release(slot.spec.name)
+        return slot.model
+
+    async def acquire(self, name: str = None) -> DiffusionModel:
+        """
+        Same as `get`, but the model is kept on its device until `release` is called.\\
+        Use it when something is awaited between getting the model and submitting jobs to it.
+        """
+        model = await self.get(name)
+        # nothing ran since `get` saw the model resident
+        self.__slot(name).leases += 1
+        return model
+
+    def release(self, name: str = None) -> None:
+        """Let a model acquired with `acquire` be evicted again"""
+        slot = self.__slot(name)
+        slot.leases = max(0, slot.leases - 1)
+        if slot.leases == 0:
+            self.__signal()
+
+    async def __load(self, slot: _Slot) -> None:
+        await self.__make_room(slot, self.max_resident - 1, claim=True)
+
+        fresh = slot.model is None
+        try:
+            with ChronoContext() as cc:
+                if fresh:
+                    slot.model = await asyncio.to_thread(self.__factory, slot.spec)
+                else:
+                    await asyncio.to_thread(slot.model.onload)
+        except Exception as e:
+            slot.error = e
+            self.__enter(slot, ModelState.FAILED)
+            self.logger.exception("Could not load model %s", slot.spec.name)
+            raise
+        self.logger.info("Loaded model %s in %s", slot.spec.name, cc.get_formatted_elapsed("%Mm %Ss"))
+        await self.__record(slot, "loading" if fresh else "onloading", cc.elapsed)
+
+        if fresh and self.__warmup is not None:
+            self.__enter(slot, ModelState.WARMING)
+            try:
+                with ChronoContext() as cc:
+                    await self.__warmup(slot.model)
+            except Exception:  # noqa
+                # the model works without it, the first requests are only slower
+                self.logger.exception("Warmup of model %s failed", slot.spec.name)
+            else:
+                await self.__record(slot, "warming", cc.elapsed)
+
+        slot.resident, slot.error = True, None
+        self.__enter(slot, ModelState.READY)
+
+        if self.memory_budget > 0:
+            await self.__make_room(slot, self.max_resident - 1, self.memory_budget)
+
+    async def __make_room(
+        self, keep: _Slot, max_others: int, memory_budget: int = 0, claim: bool = False
+    ) -> None:
+        """
+        Evict the least recently used models that can be until there is room for `keep`,
+        then enter it in `LOADING` if `claim` is set (along with the check, so that concurrent
+        loads do not both take the last place).\\
+        While the other models are busy, leased or loading, waits for one of them to change
+        without holding the admission lock.
+        """
+
+        def too_many() -> bool:
+            # models still loading will be resident soon, they count too
+            others = [s for s in self.__slots.values() if s.claimed and s is not keep]
+            if len(others) > max_others:
+                return True
+            return memory_budget > 0 and len(others) > 0 and self.__footprint() > memory_budget
+
+        while True:
+            async with self.__admission:
+                if not too_many():
+                    if claim:
+                        self.__enter(keep, ModelState.LOADING)
+                    return
+                others = [s for s in self.__slots.values() if s.resident and s is not keep]
+                candidates = [s for s in others if s.leases == 0 and s.model.idle]
+                if candidates:
+                    await self.__evict(candidates[0])
+                    continue
+                # taken along with the check, a change right after it is not missed
+                changed = self.__changed
+                watchers = [
+                    asyncio.get_running_loop().create_task(self.__signal_when_idle(s.model))
+                    for s in others
+                    if not s.model.idle
+                ]
+            try:
+                # a release, a load that ends or a model that goes idle
+                await changed.wait()
+            finally:
+                for watcher in watchers:
+                    watcher.cancel()
+
+    async def __evict(self, slot: _Slot) -> None:
+        slot.resident = False
+        self.__enter(slot, ModelState.UNLOADED)
+        self.logger.info("Evicting model %s to %s", slot.spec.name, self.evict_to)
+        if self.evict_to == "cpu":
+            await asyncio.to_thread(slot.model.offload)
+            return
+
+        model, slot.model = slot.model, None
+        model.close()
+
+        def release() -> None:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        await asyncio.to_thread(release)
@@ -0,0 +1,110 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+__all__ = ["LatentPreviewer"]
+
+
+class LatentPreviewer:
+    """
+    Turns latents into a small RGB preview without running the VAE.
+
+    Each latent channel contributes linearly to the red, green and blue values of its
+    pixel ; the per-family factors below were fitted against the VAE output. The result
+    is blurry and a bit off in colors, but is computed in a few milliseconds, where a
+    VAE decode costs about as much as a denoising step.
+
+    Call it from a worker thread, the JPEG encoding is CPU bound.
+
+    ```py
+    previewer = LatentPreviewer.for_pipeline(pipe, size=192)
+    jpeg = previewer(latents[0].float().cpu().numpy())
+    ```
+    """
+
+    # (latent channels, RGB) projections and RGB biases, the SD 1.x / 2.x and SDXL VAEs differ
+    factors = {
+        "sd": np.array(
+            [
+                [0.3512, 0.2297, 0.3227],
+                [0.3250, 0.4974, 0.2350],
+                [-0.2829, 0.1762, 0.2721],
+                [-0.2120, -0.2616, -0.7177],
+            ],
+            dtype=np.float32,
+        ),
+        "sdxl": np.array(
+            [
+                [0.3651, 0.4232, 0.4341],
+                [-0.2533, -0.0042, 0.1068],
+                [0.1076, 0.1111, -0.0362],
+                [-0.3165, -0.2492, -0.2188],
+            ],
+            dtype=np.float32,
+        ),
+    }
+    biases = {
+        "sd": np.zeros(3, dtype=np.float32),
+        "sdxl": np.array([0.1084, -0.0175, -0.0311], dtype=np.float32),
+    }
+
+    def __init__(self, family: str = "sd", size: int = 192, quality: int = 70):
+        if family not in self.factors:
+            raise ValueError(f"unsupported latent family {family}")
+        self.family = family
+        self.size = max(16, size)
+        self.quality = min(max(1, quality), 100)
+
+        self.__factors = self.factors[family]
+        self.__bias = self.biases[family]
+
+    @classmethod
+    def for_pipeline(cls, pipe, size: int = 192, quality: int = 70) -> "LatentPreviewer | None":
+        """
+        Previewer matching the latent space of a pipeline.
+
+        ## Returns
+        ```py
+        LatentPreviewer | None : the previewer, `None` if the latents of the pipeline are not supported
+        ```
+        """
+        unet = getattr(pipe, "unet", None)
+        if unet is None or getattr(unet.config, "in_channels", None) not in {4, 9}:
+            # 9 channels for inpainting unets, their latents still have 4
+            return None
+        # SDXL pipelines (base and refiner) come with a second text encoder
+        family = "sdxl" if getattr(pipe, "text_encoder_2", None) is not None else "sd"
+        return cls(family, size, quality)
+
+    def rgb(self, latents: np.ndarray) -> np.ndarray:
+        """
+        Project latents to RGB.
+
+        ## Parameters
+        ```py
+        >>> latents : np.ndarray
+        ```
+        latents of a single image, shaped `(4, height, width)`
+
+        ## Returns
+        ```py
+        np.ndarray : `(height, width, 3)` pixels as `uint8`
+        ```
+        """
+        rgb = np.tensordot(latents.astype(np.float32, copy=False), self.__factors, axes=(0, 0))
+        rgb += self.__bias
+        # from [-1, 1] to [0, 255]
+        return np.clip((rgb + 1) * 127.5, 0, 255).astype(np.uint8)
+
+    def __call__(self, latents: np.ndarray) -> bytes:
+        """Preview of the latents of a single image, JPEG encoded and at most `size` pixels per side"""
+        image = Image.fromarray(self.rgb(latents), "RGB")
+        # latents are 8 times smaller than the image, so this mostly upscales
+        scale = self.size / max(image.size)
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR
+        )
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=self.quality)
+        return buffer.getvalue()
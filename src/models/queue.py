@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+__all__ = ["Job", "GenerationQueue", "QueueFullError", "JobCancelledError"]
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted to a queue that already reached its maximum depth"""
+
+
+class JobCancelledError(Exception):
+    """Raised to the owner of a job that was cancelled (or expired) before it could run"""
+
+
+_job_ids = itertools.count(1)
+
+
+@dataclass(eq=False)
+class Job:
+    """
+    A single unit of work waiting in a `GenerationQueue`.\\
+    Higher `priority` jobs are served first, ties are served in submission order.
+    A job can be awaited directly to get its result.
+
+    ```py
+    job = queue.put(Job(request, priority=3))
+    result = await job
+    ```
+    """
+
+    request: Any
+    priority: int = 1
+    expires_at: float = None  # unix timestamp, `None` means the job never expires
+
+    id: int = field(default_factory=lambda: next(_job_ids))
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    started_at: float = None
+    timings: dict[str, float] = field(default_factory=dict)  # seconds spent in each stage
+    future: asyncio.Future = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.future is None:
+            self.future = asyncio.get_running_loop().create_future()
+
+    def __await__(self):
+        return self.future.__await__()
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None and not self.done
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    @property
+    def wait_time(self) -> float:
+        """Time (in seconds) this job spent in the queue"""
+        end = self.started_at if self.started_at is not None else time.perf_counter()
+        return end - self.enqueued_at
+
+    def cancel(self, reason: str = "job cancelled") -> bool:
+        """Cancel the job if it is not already done ; returns if the job was cancelled"""
+        if self.done:
+            return False
+        self.future.set_exception(JobCancelledError(reason))
+        # the owner may have walked away, do not warn about a never retrieved exception
+        self.future.exception()
+        return True
+
+
+class GenerationQueue:
+    """
+    Priority queue of `Job`s with admission control.
+
+    - jobs are served by decreasing priority, then in submission order
+    - jobs that were cancelled or whose interaction expired are dropped when they reach the front
+    - `put` rejects jobs early (`QueueFullError`) once `max_depth` jobs are waiting
+    """
+
+    def __init__(self, max_depth: int = 32):
+        self.max_depth = max(1, max_depth)
+
+        self.__heap: list[tuple[int, int, Job]] = []
+        self.__jobs: dict[int, Job] = {}
+        self.__running: dict[int, Job] = {}
+        self.__wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        """Number of jobs waiting to be served"""
+        self.__prune()
+        return len(self.__jobs)
+
+    @property
+    def running(self) -> int:
+        """Number of jobs taken out of the queue that are not done yet"""
+        self.__running = {job_id: job for job_id, job in self.__running.items() if not job.done}
+        return len(self.__running)
+
+    async def wait_idle(self) -> None:
+        """Wait until no job is waiting nor running"""
+        while len(self) > 0 or self.running > 0:
+            # new jobs may show up meanwhile, hence the loop
+            await asyncio.wait([job.future for job in (*self.__jobs.values(), *self.__running.values())])
+
+    def __prune(self) -> None:
+        for job in list(self.__jobs.values()):
+            if job.done:
+                del self.__jobs[job.id]
+            elif job.expired:
+                job.cancel("interaction expired")
+                del self.__jobs[job.id]
+
+    def put(self, job: Job) -> Job:
+        """
+        Add a job to the queue.
+
+        ## Parameters
+        ```py
+        >>> job : Job
+        ```
+        the job to enqueue
+
+        ## Returns
+        ```py
+        Job : the very same job
+        ```
+
+        ## Raises
+        ```py
+        QueueFullError : if the queue already holds `max_depth` jobs
+        ```
+        """
+        if len(self) >= self.max_depth:
+            raise QueueFullError(f"queue is full ({self.max_depth} jobs waiting)")
+
+        self.__jobs[job.id] = job
+        heapq.heappush(self.__heap, (-job.priority, job.id, job))
+        self.__wakeup.set()
+        return job
+
+    def get_nowait(self) -> Job | None:
+        """Pop the next job to serve, or `None` if there is none"""
+        while self.__heap:
+            _, _, job = heapq.heappop(self.__heap)
+            if self.__jobs.pop(job.id, None) is None or job.done:
+                continue
+            if job.expired:
+                job.cancel("interaction expired")
+                continue
+            job.started_at = time.perf_counter()
+            self.__running[job.id] = job
+            return job
+
+        self.__wakeup.clear()
+        return None
+
+    async def get(self, timeout: float = None) -> Job | None:
+        """
+        Wait for the next job to serve.
+
+        ## Parameters
+        ```py
+        >>> timeout : float, (optional)
+        ```
+        maximum time (in seconds) to wait for a job\\
+        defaults to `None` (wait forever)
+
+        ## Returns
+        ```py
+        Job | None : the next job, or `None` if the timeout expired
+        ```
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while (job := self.get_nowait()) is None:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), remaining)
+            except TimeoutError:
+                return None
+        return job
+
+    def position(self, job: Job) -> int:
+        """
+        Position of a job in the queue.
+
+        ## Returns
+        ```py
+        int : 1 for the next job to be served, 0 if the job is not waiting anymore
+        ```
+        """
+        if job.id not in self.__jobs or job.done:
+            return 0
+        key = (-job.priority, job.id)
+        return 1 + sum(
+            1
+            for other in self.__jobs.values()
+            if other is not job and not other.done and (-other.priority, other.id) < key
+        )
+
+    def cancel(self, job_id: int, reason: str = "job cancelled") -> bool:
+        """Cancel a waiting job by its id ; returns if a job was cancelled"""
+        job = self.__jobs.pop(job_id, None)
+        return job is not None and job.cancel(reason)
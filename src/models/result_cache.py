@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+from ..helper.metrics import REGISTRY
+
+__all__ = ["ResultCache"]
+
+_lookups = REGISTRY.counter("pixelia_cache_lookups_total", "Cache lookups by outcome", ("cache", "outcome"))
+
+
+class ResultCache:
+    """
+    Content-addressed cache of generated images (encoded bytes).
+
+    Entries are keyed on a hash of every parameter that influences the output
+    (see `ResultCache.key`). Recently used entries are kept in memory, all of them
+    are kept on disk (one file per entry) ; both tiers evict their least recently
+    used entries once they go over their budget.
+
+    Disk accesses are blocking, call `get` and `put` from a worker thread.
+
+    ```py
+    cache = ResultCache(".cache/results")
+    key = ResultCache.key(model="foo", prompt="bar", seed=42)
+    if (data := cache.get(key)) is None:
+        cache.put(key, generate())
+    ```
+    """
+
+    suffix = ".png"
+
+    def __init__(
+        self,
+        directory: str = None,
+        max_memory_bytes: int = 256 * 1024**2,
+        max_disk_bytes: int = 2048 * 1024**2,
+    ):
+        self.logger = logging.getLogger("result_cache")
+        self.directory = directory
+        self.max_memory_bytes = max(0, max_memory_bytes)
+        self.max_disk_bytes = max(0, max_disk_bytes) if directory else 0
+
+        self.__lock = Lock()
+        self.__memory: OrderedDict[str, bytes] = OrderedDict()
+        self.__memory_size = 0
+        self.__disk: OrderedDict[str, int] = OrderedDict()
+        self.__disk_size = 0
+        self.__stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if self.max_disk_bytes > 0:
+            self.__scan()
+
+    @staticmethod
+    def key(**params: Any) -> str:
+        """Hash the parameters of a generation into a cache key"""
+        blob = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self.__lock:
+            return self.__stats | {
+                "memory_entries": len(self.__memory),
+                "memory_bytes": self.__memory_size,
+                "disk_entries": len(self.__disk),
+                "disk_bytes": self.__disk_size,
+            }
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def __scan(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(self.suffix)
+        ]
+        # oldest first so that the least recently used entries are evicted first
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            size = entry.stat().st_size
+            self.__disk[entry.name.removesuffix(self.suffix)] = size
+            self.__disk_size += size
+        self.__evict_disk()
+
+    def __remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_memory_bytes:
+            return
+        if (previous := self.__memory.pop(key, None)) is not None:
+            self.__memory_size -= len(previous)
+        self.__memory[key] = data
+        self.__memory_size += len(data)
+        while self.__memory_size > self.max_memory_bytes:
+            _, evicted = self.__memory.popitem(last=False)
+            self.__memory_size -= len(evicted)
+            self.__stats["evictions"] += 1
+
+    def __evict_disk(self) -> None:
+        while self.__disk_size > self.max_disk_bytes and self.__disk:
+            key, size = self.__disk.popitem(last=False)
+            self.__disk_size -= size
+            self.__stats["evictions"] += 1
+            try:
+                os.unlink(self.__path(key))
+            except OSError:
+                pass
+
+    def __contains__(self, key: str) -> bool:
+        with self.__lock:
+            return key in self.__memory or key in self.__disk
+
+    def get(self, key: str) -> bytes | None:
+        """Get the bytes stored for a key, or `None` if there is no such entry"""
+        with self.__lock:
+            if (data := self.__memory.get(key)) is not None:
+                self.__memory.move_to_end(key)
+                if key in self.__disk:
+                    self.__disk.move_to_end(key)
+                self.__stats["memory_hits"] += 1
+                _lookups.inc(cache="results", outcome="memory_hit")
+                return data
+            on_disk = key in self.__disk
+
+        if on_disk:
+            try:
+                with open(self.__path(key), "rb") as f:
+                    data = f.read()
+                os.utime(self.__path(key))
+            except OSError:
+                self.logger.warning("cache entry %s vanished from disk", key)
+                data = None
+
+        with self.__lock:
+            if data is None:
+                if on_disk and (size := self.__disk.pop(key, None)) is not None:
+                    self.__disk_size -= size
+                self.__stats["misses"] += 1
+                _lookups.inc(cache="results", outcome="miss")
+                return None
+            if key in self.__disk:
+                self.__disk.move_to_end(key)
+            self.__remember(key, data)
+            self.__stats["disk_hits"] += 1
+            _lookups.inc(cache="results", outcome="disk_hit")
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store bytes for a key in memory and on disk"""
+        with self.__lock:
+            self.__remember(key, data)
+            if len(data) > self.max_disk_bytes or key in self.__disk:
+                return
+
+        # write to a temporary file first so that a crash never leaves a truncated entry,
+        # the pid keeps processes sharing the directory from writing to the same file
+        path = self.__path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            self.logger.warning("could not write cache entry %s: %s", key, e)
+            return
+
+        with self.__lock:
+            if key not in self.__disk:
+                self.__disk[key] = len(data)
+                self.__disk_size += len(data)
+            self.__evict_disk()
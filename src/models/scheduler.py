@@ -0,0 +1,140 @@
+import asyncio
+import inspect
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from .queue import GenerationQueue, Job
+
+__all__ = ["BatchScheduler"]
+
+
+class BatchScheduler:
+    """
+    Collects pending jobs for a short window and runs them as a single batch.
+
+    The first job of a batch opens a window of `max_wait_ms` milliseconds,
+    every job that shows up in the queue during that window (up to `max_batch_size`)
+    is handed to the runner alongside it. Each job then gets its own result back.
+
+    With `workers > 1`, that many batches can be in flight at once (one per worker),
+    which is useful when the runner dispatches batches to several devices or processes.
+
+    The runner may also hand back awaitables instead of results (e.g. when the batch
+    continues in a later stage) : the worker then moves on to the next batch right away
+    and each job is resolved once its awaitable is.
+
+    ```py
+    async def runner(jobs: list[Job]) -> list[str]:
+        return [job.request.upper() for job in jobs]
+
+    scheduler = BatchScheduler(runner, GenerationQueue(), max_batch_size=4, max_wait_ms=50)
+    assert await scheduler.submit(Job("foo")) == "FOO"
+    ```
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[list[Job]], Awaitable[list[Any]]],
+        queue: GenerationQueue,
+        max_batch_size: int = 4,
+        max_wait_ms: int = 50,
+        workers: int = 1,
+    ):
+        self.logger = logging.getLogger("batch_scheduler")
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+
+        self.__runner = runner
+        self.__queue = queue
+        self.__workers: list[asyncio.Task] = [None] * max(1, workers)
+
+    @property
+    def queue(self) -> GenerationQueue:
+        return self.__queue
+
+    @staticmethod
+    def __chain(job: Job, awaitable: Awaitable[Any]) -> None:
+        async def resolve() -> None:
+            try:
+                result = await awaitable
+            except Exception as e:  # noqa
+                if not job.done:
+                    job.future.set_exception(e)
+            else:
+                if not job.done:
+                    job.future.set_result(result)
+
+        asyncio.get_running_loop().create_task(resolve())
+
+    def __ensure_workers(self) -> None:
+        # the workers need a running loop, so they are created lazily
+        for i, worker in enumerate(self.__workers):
+            if worker is None or worker.done():
+                self.__workers[i] = asyncio.get_running_loop().create_task(self.__run())
+
+    def submit(self, job: Job) -> Job:
+        """
+        Enqueue a job ; await the returned job to get its own result.
+
+        ## Parameters
+        ```py
+        >>> job : Job
+        ```
+        the job to hand to the runner
+
+        ## Returns
+        ```py
+        Job : the very same job
+        ```
+
+        ## Raises
+        ```py
+        QueueFullError : if the queue is full
+        ```
+        """
+        self.__ensure_workers()
+        return self.__queue.put(job)
+
+    def close(self) -> None:
+        """Stop the workers, queued jobs are left unresolved (a later `submit` starts them again)"""
+        for i, worker in enumerate(self.__workers):
+            if worker is not None:
+                worker.cancel()
+            self.__workers[i] = None
+
+    async def __collect(self) -> list[Job]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.__queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            job = self.__queue.get_nowait()
+            if job is None:
+                job = await self.__queue.get(timeout=deadline - loop.time())
+            if job is None:
+                break
+            batch.append(job)
+
+        return batch
+
+    async def __run(self) -> None:
+        while True:
+            batch = await self.__collect()
+
+            self.logger.debug("running a batch of %d job(s)", len(batch))
+            try:
+                results = await self.__runner(batch)
+                if len(results) != len(batch):
+                    raise RuntimeError(f"runner returned {len(results)} result(s) for {len(batch)} job(s)")
+            except Exception as e:  # noqa
+                for job in batch:
+                    if not job.done:
+                        job.future.set_exception(e)
+                continue
+
+            for job, result in zip(batch, results, strict=True):
+                if inspect.isawaitable(result):
+                    self.__chain(job, result)
+                elif not job.done:
+                    job.future.set_result(result)
@@ -0,0 +1,526 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import random
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+from typing import Any
+
+import torch
+
+from ..helper.chrono import ChronoContext
+from ..helper.fmt import UsefulFormatter
+from .diffusion_model import (
+    DiffusionModel,
+    GenerationProgress,
+    GenerationRequest,
+    GenerationResult,
+    WarmupShape,
+    observe_batch,
+    observe_stages,
+    observe_submit,
+    track_job,
+)
+from .embedding_cache import EmbeddingCache
+from .encoding import ImageEncoder
+from .queue import GenerationQueue, Job
+from .result_cache import ResultCache
+from .scheduler import BatchScheduler
+
+__all__ = ["RemoteDiffusionModel", "WorkerCrashedError"]
+
+
+class WorkerCrashedError(Exception):
+    """Raised to the owners of the jobs a worker process was running when it died"""
+
+
+# ------------------------------------------------------------------------------
+# worker process side
+#
+# the protocol is a request / response exchange of plain dicts over a pipe :
+#   -> {"op": "generate", "requests": [{"pprompt": str, "nprompt": str, "seed": int, "progress": bool}, ...]}
+#   <- {"ok": True, "op": "progress", "index": int, "stage": str, "step": int, "total": int, "preview": bytes}
+#      (any number of them, before the reply)
+#   <- {"ok": True, "shm": str, "sizes": [int], "seeds": [int], "timings": [dict]}
+#   -> {"op": "warmup", "plan": [{"batch_size": int, "steps": int, "width": int, "height": int}, ...] | None}
+#   -> {"op": "offload" | "onload" | "stop"}
+#   <- {"ok": True}
+# failures are answered with {"ok": False, "error": str}, the very first message
+# sent by a worker is {"ok": True, "op": "ready", "memory_footprint": int, "cache_params": dict} once its
+# model is loaded ; images are shipped back in a shared memory block (created by the worker, unlinked by the bot)
+# the result cache is the bot's, workers only ever see the requests it missed
+
+
+def _serve(conn: Connection, device: int | None, log_lvl: int, model_kwargs: dict[str, Any]) -> None:
+    """Entry point of a worker process"""
+    if device is not None:
+        # before torch initializes CUDA in this process
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(device)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(UsefulFormatter(colored_output=False))
+    logging.basicConfig(level=log_lvl, handlers=[handler])
+    logger = logging.getLogger(f"worker.{os.getpid()}")
+
+    try:
+        embedding_cache = EmbeddingCache(model_kwargs.pop("embedding_cache_bytes"))
+        model = DiffusionModel(**model_kwargs, embedding_cache=embedding_cache)
+    except Exception as e:  # noqa
+        logger.exception("could not load the model")
+        conn.send({"ok": False, "error": repr(e)})
+        return
+
+    conn.send(
+        {
+            "ok": True,
+            "op": "ready",
+            "memory_footprint": model.memory_footprint,
+            "cache_params": model.cache_params,
+        }
+    )
+    asyncio.run(_serve_forever(conn, model, logger))
+
+
+async def _serve_forever(conn: Connection, model: DiffusionModel, logger: logging.Logger) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            message = await loop.run_in_executor(None, conn.recv)
+        except EOFError:
+            # the bot went away
+            return
+
+        try:
+            match message["op"]:
+                case "generate":
+                    reply = await _generate(conn, model, message["requests"])
+                case "warmup":
+                    plan = message.get("plan")
+                    if plan is not None:
+                        plan = [WarmupShape.from_dict(shape) for shape in plan]
+                    await model.warmup(plan)
+                    reply = {"ok": True}
+                case "offload":
+                    await asyncio.to_thread(model.offload)
+                    reply = {"ok": True}
+                case "onload":
+                    await asyncio.to_thread(model.onload)
+                    reply = {"ok": True}
+                case "stop":
+                    conn.send({"ok": True})
+                    return
+                case op:
+                    raise ValueError(f"unknown operation {op}")
+        except Exception as e:  # noqa
+            logger.exception("operation %s failed", message.get("op"))
+            reply = {"ok": False, "error": repr(e)}
+        conn.send(reply)
+
+
+async def _generate(
+    conn: Connection, model: DiffusionModel, requests: list[dict[str, Any]]
+) -> dict[str, Any]:
+    def forward(index: int) -> Callable[[GenerationProgress], None]:
+        # already throttled by the model, sent from the event loop like the replies
+        return lambda progress: conn.send({"ok": True, "op": "progress", "index": index, **asdict(progress)})
+
+    # submitted together, the requests end up in the same batch of the worker's model
+    jobs = [
+        model.submit(
+            r["pprompt"], r["nprompt"], seed=r["seed"], on_progress=forward(i) if r.get("progress") else None
+        )
+        for i, r in enumerate(requests)
+    ]
+    results: list[GenerationResult] = await asyncio.gather(*jobs)
+
+    sizes = [len(result.png) for result in results]
+    shm = SharedMemory(create=True, size=max(1, sum(sizes)))
+    offset = 0
+    for result, size in zip(results, sizes, strict=True):
+        shm.buf[offset : offset + size] = result.png
+        offset += size
+    name = shm.name
+    shm.close()
+
+    return {
+        "ok": True,
+        "shm": name,
+        "sizes": sizes,
+        "seeds": [result.seed for result in results],
+        "timings": [job.timings for job in jobs],
+    }
+
+
+# ------------------------------------------------------------------------------
+# bot side
+
+
+class _Worker:
+    """Handle on a single worker process, calls are blocking and serialized"""
+
+    def __init__(
+        self, ctx: mp.context.SpawnContext, device: int | None, log_lvl: int, kwargs: dict[str, Any]
+    ):
+        self.__ctx = ctx
+        self.__args = (device, log_lvl, kwargs)
+        self.__lock = Lock()
+        self.__conn: Connection = None
+        self.__process: mp.Process = None
+        self.memory_footprint = 0
+        self.cache_params: dict[str, Any] = {}
+
+    @property
+    def alive(self) -> bool:
+        return self.__process is not None and self.__process.is_alive()
+
+    def start(self) -> None:
+        """Spawn the process and wait for its model to be loaded"""
+        with self.__lock:
+            parent, child = self.__ctx.Pipe()
+            device, log_lvl, kwargs = self.__args
+            self.__process = self.__ctx.Process(
+                target=_serve, args=(child, device, log_lvl, dict(kwargs)), daemon=True
+            )
+            self.__process.start()
+            child.close()
+            self.__conn = parent
+
+            reply = self.__receive()
+            if not reply["ok"]:
+                raise RuntimeError(f"worker could not load its model: {reply['error']}")
+            self.memory_footprint = reply["memory_footprint"]
+            self.cache_params = reply["cache_params"]
+
+    def stop(self) -> None:
+        with self.__lock:
+            if self.alive:
+                try:
+                    self.__conn.send({"op": "stop"})
+                    self.__receive()
+                except WorkerCrashedError:
+                    pass
+                self.__process.join(timeout=10)
+            if self.__process is not None and self.__process.is_alive():
+                self.__process.kill()
+            self.__process = None
+
+    def __receive(self) -> dict[str, Any]:
+        try:
+            return self.__conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashedError(f"worker process {self.__process.pid} died") from e
+
+    def call(
+        self, message: dict[str, Any], on_progress: Callable[[dict[str, Any]], None] = None
+    ) -> dict[str, Any]:
+        with self.__lock:
+            try:
+                self.__conn.send(message)
+            except (OSError, ValueError) as e:
+                raise WorkerCrashedError(f"worker process {self.__process.pid} died") from e
+            # progress messages may come before the reply
+            while (reply := self.__receive()).get("op") == "progress":
+                if on_progress is not None:
+                    on_progress(reply)
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return reply
+
+    def generate(
+        self, requests: list[GenerationRequest], on_progress: Callable[[int, GenerationProgress], None] = None
+    ) -> list[tuple[bytes, int, dict]]:
+        def progress(message: dict[str, Any]) -> None:
+            if on_progress is not None:
+                progress = GenerationProgress(
+                    message["stage"], message["step"], message["total"], message.get("preview")
+                )
+                on_progress(message["index"], progress)
+
+        reply = self.call(
+            {
+                "op": "generate",
+                "requests": [
+                    {
+                        "pprompt": r.pprompt,
+                        "nprompt": r.nprompt,
+                        "seed": r.seed,
+                        "progress": r.on_progress is not None,
+                    }
+                    for r in requests
+                ],
+            },
+            progress,
+        )
+        shm = SharedMemory(name=reply["shm"])
+        try:
+            images, offset = [], 0
+            for size in reply["sizes"]:
+                images.append(bytes(shm.buf[offset : offset + size]))
+                offset += size
+        finally:
+            shm.close()
+            shm.unlink()
+        return list(zip(images, reply["seeds"], reply["timings"], strict=True))
+
+
+class RemoteDiffusionModel:
+    """
+    Drop-in replacement for `DiffusionModel` that runs the pipelines in worker processes.
+
+    The bot process keeps the job queue (priorities, positions, admission) and hands
+    batches to the first free worker ; each worker process loads its own copy of the
+    model (round-robin over the visible GPUs) and ships images back through shared memory.
+    A worker that dies fails the batch it was running and is restarted in the background.
+
+    The result cache stays in the bot process : cached requests never reach a worker.
+    A worker runs a single batch at a time, the stages of a worker's model do not overlap
+    across batches (more workers do).
+
+    ```py
+    model = RemoteDiffusionModel(2, name="runwayml/stable-diffusion-v1-5")
+    result = await model.query("a cat")
+    ```
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        name: str,
+        refiner: str = None,
+        lora_weights: str = None,
+        cpu_offload: bool = False,
+        fp: int = 16,
+        max_batch_size: int = 4,
+        max_batch_wait_ms: int = 50,
+        max_queue_depth: int = 32,
+        pipelined: bool = True,
+        embedding_cache_bytes: int = 256 * 1024**2,
+        result_cache: ResultCache = None,
+        encoder: ImageEncoder = None,
+        devices: int = None,
+        progress_interval: float = 0.5,
+        preview_size: int = 0,
+        compile_cache_dir: str = None,
+    ):
+        self.logger = logging.getLogger("remote_model")
+        self.name = name
+        self.refiner = refiner
+        self.weights = lora_weights
+        self.result_cache = result_cache
+
+        kwargs = {
+            "name": name,
+            "refiner": refiner,
+            "lora_weights": lora_weights,
+            "cpu_offload": cpu_offload,
+            "fp": fp,
+            "max_batch_size": max_batch_size,
+            # the bot already batches, the worker runs what it receives right away
+            "max_batch_wait_ms": 0,
+            "max_queue_depth": max_batch_size,
+            "pipelined": pipelined,
+            "embedding_cache_bytes": embedding_cache_bytes,
+            "encoder": encoder,
+            "progress_interval": progress_interval,
+            "preview_size": preview_size,
+            # shared by the workers, they reuse what the first one compiled
+            "compile_cache_dir": compile_cache_dir,
+        }
+        if devices is None:
+            devices = torch.cuda.device_count()
+        ctx = mp.get_context("spawn")  # CUDA does not survive a fork
+        log_lvl = logging.getLogger().getEffectiveLevel()
+        self.__workers = [
+            _Worker(ctx, i % devices if devices > 0 else None, log_lvl, kwargs)
+            for i in range(max(1, workers))
+        ]
+        # every worker loads its model at the same time
+        with ThreadPoolExecutor(len(self.__workers)) as executor:
+            started = [executor.submit(worker.start) for worker in self.__workers]
+        try:
+            for future in started:
+                future.result()
+        except Exception:
+            for worker in self.__workers:
+                worker.stop()
+            raise
+
+        self.__scheduler = BatchScheduler(
+            self.__run_batch,
+            GenerationQueue(max_queue_depth),
+            max_batch_size,
+            max_batch_wait_ms,
+            workers=len(self.__workers),
+        )
+        self.__free: asyncio.Queue[_Worker] = None
+        self.__stage_timings: dict[str, deque[float]] = {}
+
+    @property
+    def queue(self) -> GenerationQueue:
+        """Jobs waiting for the model"""
+        return self.__scheduler.queue
+
+    @property
+    def idle(self) -> bool:
+        return len(self.queue) == 0 and self.queue.running == 0
+
+    @property
+    def memory_footprint(self) -> int:
+        return sum(worker.memory_footprint for worker in self.__workers)
+
+    @property
+    def stage_timings(self) -> dict[str, float]:
+        """Average time (in seconds) spent in each stage over the last batches"""
+        return {stage: sum(t) / len(t) for stage, t in self.__stage_timings.items() if len(t) > 0}
+
+    def __broadcast(self, op: str) -> None:
+        for worker in self.__workers:
+            worker.call({"op": op})
+
+    def offload(self) -> None:
+        self.__broadcast("offload")
+
+    def onload(self) -> None:
+        self.__broadcast("onload")
+
+    def close(self) -> None:
+        self.__scheduler.close()
+        for worker in self.__workers:
+            worker.stop()
+
+    def __ensure_free_workers(self) -> None:
+        if self.__free is None:
+            self.__free = asyncio.Queue()
+            for worker in self.__workers:
+                self.__free.put_nowait(worker)
+
+    async def __restart(self, worker: _Worker) -> None:
+        self.logger.warning("Restarting a crashed worker")
+        while True:
+            try:
+                await asyncio.to_thread(worker.stop)
+                await asyncio.to_thread(worker.start)
+                break
+            except Exception as e:  # noqa
+                self.logger.error("Could not restart the worker: %s", e)
+                await asyncio.sleep(5)
+        self.__free.put_nowait(worker)
+
+    async def __run_batch(self, jobs: list[Job]) -> list[GenerationResult]:
+        observe_batch(self.name, self.queue, len(jobs))
+        self.__ensure_free_workers()
+        worker = await self.__free.get()
+        loop = asyncio.get_running_loop()
+
+        def on_progress(index: int, progress: GenerationProgress) -> None:
+            # called from the thread waiting on the worker
+            if (subscriber := jobs[index].request.on_progress) is not None:
+                loop.call_soon_threadsafe(subscriber, progress)
+
+        try:
+            replies = await asyncio.to_thread(worker.generate, [job.request for job in jobs], on_progress)
+        except WorkerCrashedError:
+            asyncio.get_running_loop().create_task(self.__restart(worker))
+            raise
+        except Exception:
+            self.__free.put_nowait(worker)
+            raise
+        self.__free.put_nowait(worker)
+        if self.result_cache is not None:
+            await asyncio.to_thread(self.__store, jobs, replies)
+
+        results, observed = [], False
+        for job, (png, seed, timings) in zip(jobs, replies, strict=True):
+            job.timings.update(timings)
+            for stage, elapsed in timings.items():
+                self.__stage_timings.setdefault(stage, deque(maxlen=32)).append(elapsed)
+            if timings and not observed:
+                # the stages timings are those of the whole batch, the same for each job
+                observe_stages(self.name, timings)
+                observed = True
+            results.append(GenerationResult(png, seed))
+        return results
+
+    def __store(self, jobs: list[Job], replies: list[tuple[bytes, int, dict]]) -> None:
+        for job, (png, _, _) in zip(jobs, replies, strict=True):
+            self.result_cache.put(job.request.cache_key, png)
+
+    def cache_key(self, request: GenerationRequest) -> str:
+        """Key of a request in the result cache (see `DiffusionModel.cache_key`)"""
+        return ResultCache.key(
+            **self.__workers[0].cache_params,
+            pprompt=request.pprompt,
+            nprompt=request.nprompt or "",
+            seed=request.seed,
+        )
+
+    async def __from_cache(self, job: Job) -> None:
+        data = await asyncio.to_thread(self.result_cache.get, job.request.cache_key)
+        if job.done:
+            return
+        if data is None:
+            # evicted in the meantime, generate it after all
+            try:
+                self.__scheduler.submit(job)
+            except Exception as e:  # noqa
+                job.future.set_exception(e)
+            return
+        job.future.set_result(GenerationResult(data, job.request.seed, cached=True))
+
+    def submit(
+        self,
+        pprompt: str,
+        nprompt: str = None,
+        priority: int = 1,
+        expires_at: float = None,
+        seed: int = None,
+        on_progress: Callable[[GenerationProgress], None] = None,
+    ) -> Job:
+        """Enqueue a generation job without waiting for it (see `DiffusionModel.submit`)"""
+        if seed is None:
+            seed = random.randrange(2**32)
+        request = GenerationRequest(pprompt, nprompt, seed, on_progress=on_progress)
+        request.cache_key = self.cache_key(request)
+        job = track_job(Job(request, priority, expires_at), self.name)
+
+        if self.result_cache is not None and request.cache_key in self.result_cache:
+            job.started_at = time.perf_counter()
+            asyncio.get_running_loop().create_task(self.__from_cache(job))
+            return job
+        self.__scheduler.submit(job)
+        observe_submit(self.name, self.queue)
+        return job
+
+    def position(self, job: Job) -> int:
+        """Position of a job in the queue (0 if it is not waiting anymore)"""
+        return self.queue.position(job)
+
+    async def query(
+        self,
+        pprompt: str,
+        nprompt: str = None,
+        priority: int = 1,
+        expires_at: float = None,
+        seed: int = None,
+        on_progress: Callable[[GenerationProgress], None] = None,
+    ) -> GenerationResult:
+        """Query the model with a positive and negative prompt"""
+        return await self.submit(pprompt, nprompt, priority, expires_at, seed, on_progress)
+
+    async def warmup(self, plan: list[WarmupShape] = None) -> None:
+        """Warmup every worker for a warmup plan (see `DiffusionModel.warmup`)"""
+        message = {"op": "warmup", "plan": None if plan is None else [asdict(shape) for shape in plan]}
+        with ChronoContext() as cc:
+            # the first worker fills the compilation cache, the others then mostly read from it
+            await asyncio.to_thread(self.__workers[0].call, message)
+            await asyncio.gather(*(asyncio.to_thread(worker.call, message) for worker in self.__workers[1:]))
+        self.logger.info(
+            "Warmup of %d worker(s) took %s", len(self.__workers), cc.get_formatted_elapsed("%Mm %Ss")
+        )
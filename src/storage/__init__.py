@@ -0,0 +1,5 @@
+from .base import *
+from .json_storage import *
+from .migration import *
+from .sqlite_storage import *
+from .transfer import *
@@ -0,0 +1,87 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+__all__ = ["GLOBAL_GUILD", "WhiteListEntry", "WhiteListStorage"]
+
+T = TypeVar("T")
+
+GLOBAL_GUILD = 0  # entries that apply to every guild (the owner, entries from before per-guild whitelists)
+
+
+@dataclass(slots=True)
+class WhiteListEntry:
+    user_id: int
+    perms: int  # 1 = use, 2 = use + add/remove 1, 3 = use + add/remove 1 + add/remove 2
+    by: int
+    date: float
+    guild_id: int = GLOBAL_GUILD
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "perms": self.perms,
+            "by": self.by,
+            "date": self.date,
+            "guild_id": self.guild_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, int | float]):
+        return cls(
+            data["user_id"], data["perms"], data["by"], data["date"], data.get("guild_id", GLOBAL_GUILD)
+        )
+
+
+class WhiteListStorage(ABC):
+    """
+    Where whitelist entries live, keyed by `(guild_id, user_id)`.
+
+    Every operation runs on a dedicated thread so that disk accesses never
+    block the event loop, and one after the other so that backends do not
+    need to be thread safe.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whitelist")
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    @abstractmethod
+    async def open(self) -> None:
+        """Open (and create if needed) the store"""
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    @abstractmethod
+    async def is_empty(self) -> bool:
+        """If the store holds no entry at all"""
+
+    @abstractmethod
+    async def get(self, guild_id: int, user_id: int) -> WhiteListEntry | None:
+        """Entry of a user in a guild (global entries are not looked up)"""
+
+    @abstractmethod
+    async def load_guild(self, guild_id: int) -> list[WhiteListEntry]:
+        """Every entry of a guild"""
+
+    @abstractmethod
+    async def put(self, entry: WhiteListEntry) -> None:
+        """Insert or replace an entry"""
+
+    @abstractmethod
+    async def put_many(self, entries: list[WhiteListEntry]) -> None:
+        """Insert or replace several entries at once"""
+
+    @abstractmethod
+    async def delete(self, guild_id: int, user_id: int) -> None:
+        """Remove the entry of a user in a guild"""
+
+    @abstractmethod
+    def scan(self, batch_size: int = 512) -> AsyncIterator[list[WhiteListEntry]]:
+        """Iterate over every entry of the store, a batch at a time"""
@@ -0,0 +1,87 @@
+from collections.abc import AsyncIterator
+
+import pyjson5 as json
+
+from ..helper.journal import Journal
+from .base import WhiteListEntry, WhiteListStorage
+
+__all__ = ["JsonWhiteListStorage"]
+
+
+def _key(guild_id: int, user_id: int) -> str:
+    return f"{guild_id}:{user_id}"
+
+
+class JsonWhiteListStorage(WhiteListStorage):
+    """
+    Whitelist stored as a JSON5 snapshot plus a journal of mutations (see `Journal`).\\
+    The whole whitelist is kept in memory, fine for a single bot with a modest whitelist.
+
+    ```py
+    storage = JsonWhiteListStorage("whitelist.json")
+    await storage.open()
+    entry = await storage.get(guild_id, user_id)
+    ```
+    """
+
+    def __init__(self, filename: str = "whitelist.json"):
+        super().__init__()
+        self.filename = filename
+
+        self.__journal = Journal(
+            filename,
+            key=lambda entry: _key(entry.get("guild_id", 0), entry["user_id"]),
+            decode=json.decode_io,
+            encode=json.encode,
+        )
+        self.__guilds: dict[int, dict[int, WhiteListEntry]] = {}
+
+    def __load(self) -> None:
+        try:
+            records = self.__journal.load()
+        except (FileNotFoundError, json.Json5DecoderException):
+            # starts over with an empty whitelist
+            self.__journal.reset([])
+            return
+        for record in records.values():
+            entry = WhiteListEntry.from_dict(record)
+            self.__guilds.setdefault(entry.guild_id, {})[entry.user_id] = entry
+
+    async def open(self) -> None:
+        await self._run(self.__load)
+
+    async def close(self) -> None:
+        await self._run(self.__journal.close)
+        await super().close()
+
+    async def is_empty(self) -> bool:
+        return len(self.__journal) == 0
+
+    async def get(self, guild_id: int, user_id: int) -> WhiteListEntry | None:
+        return self.__guilds.get(guild_id, {}).get(user_id)
+
+    async def load_guild(self, guild_id: int) -> list[WhiteListEntry]:
+        return list(self.__guilds.get(guild_id, {}).values())
+
+    def __put(self, entries: list[WhiteListEntry]) -> None:
+        self.__journal.put_many([entry.to_dict() for entry in entries])
+        for entry in entries:
+            self.__guilds.setdefault(entry.guild_id, {})[entry.user_id] = entry
+
+    async def put(self, entry: WhiteListEntry) -> None:
+        await self._run(self.__put, [entry])
+
+    async def put_many(self, entries: list[WhiteListEntry]) -> None:
+        await self._run(self.__put, entries)
+
+    def __delete(self, guild_id: int, user_id: int) -> None:
+        self.__journal.delete(_key(guild_id, user_id))
+        self.__guilds.get(guild_id, {}).pop(user_id, None)
+
+    async def delete(self, guild_id: int, user_id: int) -> None:
+        await self._run(self.__delete, guild_id, user_id)
+
+    async def scan(self, batch_size: int = 512) -> AsyncIterator[list[WhiteListEntry]]:
+        entries = [entry for guild in list(self.__guilds.values()) for entry in list(guild.values())]
+        for i in range(0, len(entries), batch_size):
+            yield entries[i : i + batch_size]
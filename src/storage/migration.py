@@ -0,0 +1,84 @@
+import logging
+import os
+
+from .base import WhiteListStorage
+from .json_storage import JsonWhiteListStorage
+from .sqlite_storage import SqliteWhiteListStorage
+
+__all__ = ["migrate_whitelist", "open_whitelist_storage"]
+
+
+async def migrate_whitelist(filename: str, storage: WhiteListStorage) -> int:
+    """
+    One-shot import of a JSON5 whitelist file into another storage.
+
+    Nothing happens if the file does not exist or if the storage already holds
+    entries ; once imported, the file (and its journal) are renamed with a
+    `.migrated` suffix so that they are not imported again.
+
+    ## Parameters
+    ```py
+    >>> filename : str
+    ```
+    path to the JSON5 whitelist
+    ```py
+    >>> storage : WhiteListStorage
+    ```
+    opened storage to import the entries into
+
+    ## Returns
+    ```py
+    int : number of imported entries
+    ```
+    """
+    if not os.path.exists(filename) or not await storage.is_empty():
+        return 0
+
+    source = JsonWhiteListStorage(filename)
+    await source.open()
+    n = 0
+    try:
+        async for entries in source.scan():
+            await storage.put_many(entries)
+            n += len(entries)
+    finally:
+        await source.close()
+
+    for path in (filename, f"{filename}.journal"):
+        if os.path.exists(path):
+            os.replace(path, f"{path}.migrated")
+    logging.getLogger("whitelist").info("Migrated %d whitelist entries from %s", n, filename)
+    return n
+
+
+async def open_whitelist_storage(kind: str, filename: str, db_filename: str) -> WhiteListStorage:
+    """
+    Open a whitelist storage, importing the JSON5 whitelist into a new database.
+
+    ## Parameters
+    ```py
+    >>> kind : str
+    ```
+    `"json"` or `"sqlite"`
+    ```py
+    >>> filename : str
+    ```
+    path to the JSON5 whitelist
+    ```py
+    >>> db_filename : str
+    ```
+    path to the SQLite database
+
+    ## Returns
+    ```py
+    WhiteListStorage : the opened storage
+    ```
+    """
+    if kind == "sqlite":
+        storage = SqliteWhiteListStorage(db_filename)
+        await storage.open()
+        await migrate_whitelist(filename, storage)
+    else:
+        storage = JsonWhiteListStorage(filename)
+        await storage.open()
+    return storage
@@ -0,0 +1,126 @@
+import sqlite3
+from collections.abc import AsyncIterator
+
+from .base import WhiteListEntry, WhiteListStorage
+
+__all__ = ["SqliteWhiteListStorage"]
+
+
+class SqliteWhiteListStorage(WhiteListStorage):
+    """
+    Whitelist stored in a SQLite database.
+
+    The database runs in WAL mode, so several bot processes can share it
+    (readers never wait for a writer), and only the guilds being looked at are loaded.
+
+    ```py
+    storage = SqliteWhiteListStorage("whitelist.db")
+    await storage.open()
+    entry = await storage.get(guild_id, user_id)
+    ```
+    """
+
+    def __init__(self, filename: str = "whitelist.db"):
+        super().__init__()
+        self.filename = filename
+        self.__db: sqlite3.Connection = None
+
+    def __open(self) -> None:
+        # only ever used from the storage thread
+        self.__db = sqlite3.connect(self.filename, check_same_thread=False, timeout=10)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        with self.__db:
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS whitelist ("
+                "guild_id INTEGER NOT NULL, "
+                "user_id INTEGER NOT NULL, "
+                "perms INTEGER NOT NULL, "
+                "granted_by INTEGER NOT NULL, "
+                "date REAL NOT NULL, "
+                "PRIMARY KEY (guild_id, user_id)"
+                ") WITHOUT ROWID"
+            )
+            self.__db.execute(
+                "CREATE INDEX IF NOT EXISTS whitelist_granted_by ON whitelist (guild_id, granted_by)"
+            )
+
+    async def open(self) -> None:
+        await self._run(self.__open)
+
+    async def close(self) -> None:
+        if self.__db is not None:
+            await self._run(self.__db.close)
+            self.__db = None
+        await super().close()
+
+    @staticmethod
+    def __entry(row: tuple) -> WhiteListEntry:
+        guild_id, user_id, perms, by, date = row
+        return WhiteListEntry(user_id, perms, by, date, guild_id)
+
+    @staticmethod
+    def __row(entry: WhiteListEntry) -> tuple:
+        return entry.guild_id, entry.user_id, entry.perms, entry.by, entry.date
+
+    def __fetch(self, query: str, *params: int) -> list[tuple]:
+        return self.__db.execute(query, params).fetchall()
+
+    async def is_empty(self) -> bool:
+        return not await self._run(self.__fetch, "SELECT 1 FROM whitelist LIMIT 1")
+
+    async def get(self, guild_id: int, user_id: int) -> WhiteListEntry | None:
+        rows = await self._run(
+            self.__fetch,
+            "SELECT guild_id, user_id, perms, granted_by, date FROM whitelist WHERE guild_id = ? AND user_id = ?",
+            guild_id,
+            user_id,
+        )
+        return self.__entry(rows[0]) if rows else None
+
+    async def load_guild(self, guild_id: int) -> list[WhiteListEntry]:
+        rows = await self._run(
+            self.__fetch,
+            "SELECT guild_id, user_id, perms, granted_by, date FROM whitelist WHERE guild_id = ?",
+            guild_id,
+        )
+        return [self.__entry(row) for row in rows]
+
+    def __put(self, entries: list[WhiteListEntry]) -> None:
+        # a single transaction for the whole batch
+        with self.__db:
+            self.__db.executemany(
+                "INSERT INTO whitelist (guild_id, user_id, perms, granted_by, date) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, user_id) DO UPDATE SET "
+                "perms = excluded.perms, granted_by = excluded.granted_by, date = excluded.date",
+                [self.__row(entry) for entry in entries],
+            )
+
+    async def put(self, entry: WhiteListEntry) -> None:
+        await self._run(self.__put, [entry])
+
+    async def put_many(self, entries: list[WhiteListEntry]) -> None:
+        await self._run(self.__put, entries)
+
+    def __delete(self, guild_id: int, user_id: int) -> None:
+        with self.__db:
+            self.__db.execute("DELETE FROM whitelist WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+    async def delete(self, guild_id: int, user_id: int) -> None:
+        await self._run(self.__delete, guild_id, user_id)
+
+    async def scan(self, batch_size: int = 512) -> AsyncIterator[list[WhiteListEntry]]:
+        # keyset pagination, never holds more than a batch in memory
+        last = (-1, -1)
+        while True:
+            rows = await self._run(
+                self.__fetch,
+                "SELECT guild_id, user_id, perms, granted_by, date FROM whitelist "
+                "WHERE (guild_id, user_id) > (?, ?) ORDER BY guild_id, user_id LIMIT ?",
+                *last,
+                batch_size,
+            )
+            if not rows:
+                return
+            yield [self.__entry(row) for row in rows]
+            last = rows[-1][:2]
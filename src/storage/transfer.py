@@ -0,0 +1,180 @@
+import csv
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from typing import BinaryIO
+
+from .base import GLOBAL_GUILD, WhiteListEntry, WhiteListStorage
+from .migration import open_whitelist_storage
+
+__all__ = [
+    "transfer_format",
+    "parse_rows",
+    "write_entries",
+    "import_file",
+    "export_file",
+    "transfer_whitelist",
+]
+
+# what the exported files hold, in this order for CSV
+_columns = ("user_id", "perms", "by", "date", "guild_id")
+
+
+def transfer_format(filename: str) -> str:
+    """Format of a whitelist file from its extension, `"jsonl"` or `"csv"`"""
+    return "jsonl" if os.path.splitext(filename)[1].lower() in {".jsonl", ".ndjson"} else "csv"
+
+
+def _parse_line(line: str, fmt: str, header_allowed: bool) -> tuple[int, int] | None:
+    line = line.strip()
+    if not line:
+        return None
+
+    if fmt == "jsonl":
+        data = json.loads(line)
+        user_id, perms = data["user_id"], data.get("perms", 1)
+    else:
+        fields = next(csv.reader([line]))
+        if header_allowed and not fields[0].strip().isdigit():
+            # header
+            return None
+        user_id, perms = fields[0], fields[1] if len(fields) > 1 and fields[1].strip() else 1
+
+    user_id, perms = int(user_id), int(perms)
+    if perms not in {1, 2, 3}:
+        raise ValueError(f"invalid permission level {perms}")
+    return user_id, perms
+
+
+async def parse_rows(
+    lines: AsyncIterable[bytes | str], fmt: str
+) -> AsyncIterator[tuple[int, int] | ValueError]:
+    """
+    Parse a whitelist file line by line, as it comes.
+
+    CSV files hold a `user_id` and an optional `perms` column (a header line is skipped),
+    JSONL files hold one `{"user_id": ..., "perms": ...}` object per line.
+    The permission level defaults to 1.
+
+    ## Parameters
+    ```py
+    >>> lines : AsyncIterable[bytes | str]
+    ```
+    lines of the file
+    ```py
+    >>> fmt : str
+    ```
+    `"csv"` or `"jsonl"`
+
+    ## Returns
+    ```py
+    AsyncIterator[tuple[int, int] | ValueError] : `(user_id, perms)` for each row, or the error of an invalid row
+    ```
+    """
+    first = True
+    async for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8-sig")
+        header_allowed, first = first, first and not line.strip()
+        try:
+            row = _parse_line(line, fmt, header_allowed)
+        except (ValueError, KeyError, TypeError, StopIteration) as e:
+            yield ValueError(f"invalid row {line.strip()!r}: {e}")
+            continue
+        if row is not None:
+            yield row
+
+
+def write_entries(entries: Iterable[WhiteListEntry], fmt: str, out: BinaryIO) -> int:
+    """
+    Write entries to a binary file, one row at a time.
+
+    ## Returns
+    ```py
+    int : number of written entries
+    ```
+    """
+    n = 0
+    if fmt == "csv" and out.tell() == 0:
+        out.write((",".join(_columns) + "\n").encode("utf-8"))
+    for entry in entries:
+        if fmt == "jsonl":
+            line = json.dumps(entry.to_dict(), separators=(",", ":"))
+        else:
+            line = ",".join(str(getattr(entry, column)) for column in _columns)
+        out.write((line + "\n").encode("utf-8"))
+        n += 1
+    return n
+
+
+async def import_file(
+    storage: WhiteListStorage, filename: str, guild_id: int, batch_size: int = 512
+) -> tuple[int, int]:
+    """
+    Import a whitelist file into a storage as is (no permission checks, for the command line).\\
+    Entries are written a batch at a time.
+
+    ## Returns
+    ```py
+    tuple[int, int] : number of imported rows and of invalid rows
+    ```
+    """
+
+    async def lines() -> AsyncIterator[str]:
+        with open(filename, "r", encoding="utf-8-sig") as f:
+            for line in f:
+                yield line
+
+    date = time.time()
+    imported, invalid, batch = 0, 0, []
+    async for row in parse_rows(lines(), transfer_format(filename)):
+        if isinstance(row, ValueError):
+            invalid += 1
+            continue
+        user_id, perms = row
+        # granted by nobody, from the console
+        batch.append(WhiteListEntry(user_id, perms, 0, date, guild_id))
+        if len(batch) >= batch_size:
+            await storage.put_many(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        await storage.put_many(batch)
+        imported += len(batch)
+    return imported, invalid
+
+
+async def export_file(storage: WhiteListStorage, filename: str, guild_id: int = None) -> int:
+    """
+    Export the entries of a storage (of a single guild if `guild_id` is set) to a file.
+
+    ## Returns
+    ```py
+    int : number of exported entries
+    ```
+    """
+    fmt = transfer_format(filename)
+    n = 0
+    with open(filename, "wb") as f:
+        async for entries in storage.scan():
+            n += write_entries((e for e in entries if guild_id is None or e.guild_id == guild_id), fmt, f)
+    return n
+
+
+async def transfer_whitelist(
+    kind: str, whitelist_file: str, whitelist_db: str, action: str, filename: str, guild_id: int = None
+) -> None:
+    """Run `import_file` or `export_file` against the configured storage (command line entry point)"""
+    logger = logging.getLogger("whitelist")
+    storage = await open_whitelist_storage(kind, whitelist_file, whitelist_db)
+    try:
+        if action == "import":
+            imported, invalid = await import_file(storage, filename, guild_id or GLOBAL_GUILD)
+            logger.info("Imported %d users from %s (%d invalid rows)", imported, filename, invalid)
+        else:
+            exported = await export_file(storage, filename, guild_id)
+            logger.info("Exported %d users to %s", exported, filename)
+    finally:
+        await storage.close()
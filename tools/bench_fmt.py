@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Per record cost of `UsefulFormatter`, against the formatter it replaced (rebuilding its
+formats and a `logging.Formatter` for every record, and running `emoji_pattern` over every
+uncolored message).
+
+```sh
+python tools/bench_fmt.py --records 100000
+```
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.helper.fmt import UsefulFormatter, emoji_pattern, formatter
+
+
+class LegacyFormatter(logging.Formatter):
+    """`UsefulFormatter` as it was, for reference"""
+
+    name_width = 10
+    dt_fmt = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, *args: Any, colored_output: bool = True, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.colored_output = colored_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        self.name_width = max(len(record.name) + 1, self.name_width)
+        formats = {
+            logging.DEBUG: formatter("green", self.colored_output, self.name_width),
+            logging.INFO: formatter("blue", self.colored_output, self.name_width),
+            logging.WARNING: formatter("yellow", self.colored_output, self.name_width),
+            logging.ERROR: formatter("red", self.colored_output, self.name_width),
+            logging.CRITICAL: formatter("red", self.colored_output, self.name_width, ["bold"]),
+        }
+        log_fmt = formats.get(record.levelno)
+        fmt = logging.Formatter(log_fmt, self.dt_fmt, style="%")
+        if not self.colored_output:
+            record.msg = emoji_pattern.sub("", record.msg)
+        return fmt.format(record)
+
+
+# what the bot logs the most : interactions, model progress, and a few emojis
+MESSAGES = [
+    ("imagine", logging.INFO, "%s used /imagine raw in %s : %r", ("someone#0001", "a guild", "a red fox")),
+    ("model", logging.DEBUG, "batch of %d job(s) took %.2fs", (4, 3.14159)),
+    ("outbound", logging.WARNING, "rate limited, retrying in %.2fs", (0.5,)),
+    ("client", logging.INFO, "Ready 🥳 !", ()),
+    ("whitelist", logging.INFO, "Imported %d users from %s (%d invalid rows)", (120, "users.csv", 2)),
+]
+
+
+def make_records(n: int) -> list[logging.LogRecord]:
+    records = []
+    for i in range(n):
+        name, level, msg, args = MESSAGES[i % len(MESSAGES)]
+        records.append(logging.LogRecord(name, level, __file__, 0, msg, args, None))
+    return records
+
+
+def bench(fmt: logging.Formatter, records: list[logging.LogRecord]) -> float:
+    """Average time (in microseconds) spent formatting a record"""
+    start = time.perf_counter()
+    for record in records:
+        fmt.format(record)
+    return (time.perf_counter() - start) / len(records) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=100_000, help="records formatted per run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per formatter, the best one is kept")
+    args = parser.parse_args()
+
+    print(f"{'output':>10} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for colored_output in (True, False):
+        before = min(
+            bench(LegacyFormatter(colored_output=colored_output), make_records(args.records))
+            for _ in range(args.repeat)
+        )
+        after = min(
+            bench(UsefulFormatter(colored_output=colored_output), make_records(args.records))
+            for _ in range(args.repeat)
+        )
+        output = "colored" if colored_output else "plain"
+        print(f"{output:>10} {before:>12.2f} {after:>12.2f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()